@@ -40,6 +40,12 @@ setup(
         'clld': [
             'pycldf>=1.16',
             'clld',
+            'numpy',
+        ],
+        'fieldguide': [
+            'pycldf>=1.16',
+            'xhtml2pdf',
+            'Pillow',
         ],
         'dev': ['flake8', 'wheel', 'twine'],
         'test': [
@@ -49,6 +55,10 @@ setup(
             'pytest-cov',
             'coverage>=4.2',
         ],
+        'benchmark': [
+            'pytest-benchmark',
+            'xhtml2pdf',
+        ],
     },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
@@ -0,0 +1,415 @@
+"""
+An offline, local copy of the GBIF Backbone Taxonomy.
+
+The backbone is distributed as Darwin Core Archive at
+https://hosted-datasets.gbif.org/datasets/backbone/current/backbone.zip
+Its `Taxon.tsv` and `VernacularName.tsv` can be loaded into a `Backbone` database, which can then
+be used as backend for `pytsammalex.gbif.GBIF`, answering `usage`, `suggest` and `lookup` queries
+with the same result shapes as the GBIF API:
+
+.. code-block:: python
+
+    >>> backbone = Backbone.from_dwca('backbone/', 'backbone.sqlite')
+    >>> gbif = GBIF(backend=backbone, cache=False)
+    >>> gbif.lookup(q='Pantera leo')['results'][0]['canonicalName']
+    'Panthera leo'
+"""
+import csv
+import math
+import sqlite3
+import pathlib
+import threading
+import contextlib
+
+from appdirs import user_cache_dir
+
+import pytsammalex
+from pytsammalex.gbif import NotFound
+
+__all__ = ['Backbone']
+
+# The backbone uses ISO 639-1 codes for the language of vernacular names, the GBIF API uses
+# ISO 639-2 codes.
+ISO_639_1_TO_2 = {
+    'af': 'afr', 'am': 'amh', 'ar': 'ara', 'az': 'aze', 'be': 'bel', 'bg': 'bul', 'bn': 'ben',
+    'br': 'bre', 'ca': 'cat', 'cs': 'ces', 'cy': 'cym', 'da': 'dan', 'de': 'deu', 'el': 'ell',
+    'en': 'eng', 'eo': 'epo', 'es': 'spa', 'et': 'est', 'eu': 'eus', 'fa': 'fas', 'fi': 'fin',
+    'fo': 'fao', 'fr': 'fra', 'fy': 'fry', 'ga': 'gle', 'gd': 'gla', 'gl': 'glg', 'gu': 'guj',
+    'ha': 'hau', 'he': 'heb', 'hi': 'hin', 'hr': 'hrv', 'hu': 'hun', 'hy': 'hye', 'id': 'ind',
+    'ig': 'ibo', 'is': 'isl', 'it': 'ita', 'ja': 'jpn', 'ka': 'kat', 'kk': 'kaz', 'km': 'khm',
+    'kn': 'kan', 'ko': 'kor', 'ku': 'kur', 'la': 'lat', 'lb': 'ltz', 'ln': 'lin', 'lo': 'lao',
+    'lt': 'lit', 'lv': 'lav', 'mg': 'mlg', 'mi': 'mri', 'mk': 'mkd', 'ml': 'mal', 'mn': 'mon',
+    'mr': 'mar', 'ms': 'msa', 'mt': 'mlt', 'my': 'mya', 'nb': 'nob', 'ne': 'nep', 'nl': 'nld',
+    'nn': 'nno', 'no': 'nor', 'nr': 'nbl', 'ny': 'nya', 'oc': 'oci', 'om': 'orm', 'pa': 'pan',
+    'pl': 'pol', 'ps': 'pus', 'pt': 'por', 'qu': 'que', 'rm': 'roh', 'ro': 'ron', 'ru': 'rus',
+    'rw': 'kin', 'se': 'sme', 'si': 'sin', 'sk': 'slk', 'sl': 'slv', 'sn': 'sna', 'so': 'som',
+    'sq': 'sqi', 'sr': 'srp', 'ss': 'ssw', 'st': 'sot', 'sv': 'swe', 'sw': 'swa', 'ta': 'tam',
+    'te': 'tel', 'tg': 'tgk', 'th': 'tha', 'ti': 'tir', 'tl': 'tgl', 'tn': 'tsn', 'tr': 'tur',
+    'ts': 'tso', 'uk': 'ukr', 'ur': 'urd', 'uz': 'uzb', 've': 'ven', 'vi': 'vie', 'wo': 'wol',
+    'xh': 'xho', 'yi': 'yid', 'yo': 'yor', 'zh': 'zho', 'zu': 'zul',
+}
+# Tolerance for comparisons of similarities.
+EPSILON = 1e-9
+HIGHER_RANKS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS taxon (
+    key INTEGER PRIMARY KEY,
+    parent_key INTEGER,
+    accepted_key INTEGER,
+    scientific_name TEXT,
+    authorship TEXT,
+    canonical_name TEXT,
+    rank TEXT,
+    status TEXT,
+    kingdom TEXT,
+    phylum TEXT,
+    class TEXT,
+    "order" TEXT,
+    family TEXT,
+    genus TEXT,
+    name_lc TEXT
+);
+CREATE TABLE IF NOT EXISTS vernacular_name (
+    key INTEGER,
+    name TEXT,
+    language TEXT,
+    country TEXT
+);
+CREATE TABLE IF NOT EXISTS name (
+    id INTEGER PRIMARY KEY,
+    name_lc TEXT,
+    ntri INTEGER
+);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS taxon_name_lc ON taxon (name_lc);
+CREATE INDEX IF NOT EXISTS vernacular_name_key ON vernacular_name (key);
+"""
+# The trigram index is built after loading the taxa - in SQL, with `ntri` computing the number of
+# distinct trigrams of a name. Trigrams are collected in `trigram_load` first, because inserting
+# sorted rows into a WITHOUT ROWID table is much faster than inserting them in random order.
+# Postings are ordered by the number of trigrams of the name, so that queries can restrict them to
+# names of suitable length, and the number of names per trigram is stored, so that queries can
+# probe the rarest trigrams only.
+TRIGRAM_INDEX = """
+INSERT INTO name (name_lc, ntri)
+    SELECT name_lc, ntri(name_lc) FROM taxon GROUP BY name_lc ORDER BY name_lc;
+CREATE TABLE position (k INTEGER PRIMARY KEY);
+INSERT INTO position
+    WITH RECURSIVE p(k) AS (
+        SELECT 1 UNION ALL SELECT k + 1 FROM p WHERE k <= (SELECT max(length(name_lc)) FROM name))
+    SELECT k FROM p;
+CREATE TABLE trigram_load AS
+    SELECT substr('  ' || name_lc || ' ', k, 3) AS trigram, ntri, id AS name_id
+    FROM name JOIN position ON k <= length(name_lc) + 1;
+CREATE TABLE trigram (
+    trigram TEXT,
+    ntri INTEGER,
+    name_id INTEGER,
+    PRIMARY KEY (trigram, ntri, name_id)
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO trigram SELECT trigram, ntri, name_id FROM trigram_load ORDER BY 1, 2, 3;
+DROP TABLE trigram_load;
+DROP TABLE position;
+CREATE TABLE trigram_count (trigram TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID;
+INSERT INTO trigram_count SELECT trigram, count(*) FROM trigram GROUP BY trigram;
+"""
+
+
+def default_dbpath():
+    return pathlib.Path(user_cache_dir(appname=pytsammalex.__name__)) / 'backbone.sqlite'
+
+
+def trigrams(name):
+    """
+    The set of trigrams of a (normalized, padded) name - used for fuzzy matching.
+    """
+    name = '  {} '.format(' '.join(name.lower().split()))
+    return set(name[i:i + 3] for i in range(len(name) - 2))
+
+
+def _int(s):
+    return int(s) if s and s.isdigit() else None
+
+
+def _read_tsv(p):
+    with pathlib.Path(p).open(encoding='utf8', newline='') as fp:
+        reader = csv.reader(fp, delimiter='\t', quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        for row in reader:
+            yield dict(zip(header, row))
+
+
+def _batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Backbone:
+    """
+    A backend for `pytsammalex.gbif.GBIF`, answering queries from a local SQLite copy of the GBIF
+    backbone taxonomy.
+
+    :param dbpath: Path to the SQLite database created by `Backbone.from_dwca`.
+    :raises FileNotFoundError: If there is no database at `dbpath`.
+    """
+    def __init__(self, dbpath):
+        self.dbpath = pathlib.Path(dbpath)
+        # sqlite3.connect would silently create an empty database - without any taxa.
+        if not self.dbpath.is_file():
+            raise FileNotFoundError('No backbone database at {}'.format(self.dbpath))
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # sqlite3 connections cannot be shared between threads, so we open one per thread.
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = sqlite3.connect(str(self.dbpath))
+            self._local.connection.row_factory = sqlite3.Row
+        return self._local.connection
+
+    @contextlib.contextmanager
+    def cursor(self):
+        cu = self.connection.cursor()
+        try:
+            yield cu
+        finally:
+            cu.close()
+
+    @classmethod
+    def from_dwca(cls, dwca, dbpath, log=None):
+        """
+        Load `Taxon.tsv` and `VernacularName.tsv` from the unzipped backbone archive into a new
+        SQLite database.
+
+        :param dwca: Directory containing the unzipped Darwin Core Archive.
+        :param dbpath: Path of the database to create.
+        """
+        dwca, dbpath = pathlib.Path(dwca), pathlib.Path(dbpath)
+        if dbpath.exists():
+            dbpath.unlink()
+        conn = sqlite3.connect(str(dbpath))
+        # Loading data into a new database, we don't need the safety of a journal.
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.executescript(SCHEMA)
+
+        n = 0
+        taxa = (
+            (
+                _int(r['taxonID']),
+                _int(r['parentNameUsageID']),
+                _int(r['acceptedNameUsageID']),
+                r['scientificName'],
+                r.get('scientificNameAuthorship') or None,
+                r.get('canonicalName') or None,
+                (r.get('taxonRank') or '').upper() or None,
+                (r.get('taxonomicStatus') or '').upper().replace(' ', '_') or None,
+                r.get('kingdom') or None,
+                r.get('phylum') or None,
+                r.get('class') or None,
+                r.get('order') or None,
+                r.get('family') or None,
+                r.get('genus') or None,
+                ' '.join((r.get('canonicalName') or r['scientificName']).lower().split()),
+            ) for r in _read_tsv(dwca / 'Taxon.tsv'))
+        for batch in _batches(taxa):
+            conn.executemany('INSERT INTO taxon VALUES ({})'.format(','.join(15 * '?')), batch)
+            n += len(batch)
+            if log:
+                log.info('{} taxa loaded'.format(n))
+
+        if (dwca / 'VernacularName.tsv').exists():
+            names = (
+                (
+                    _int(r['taxonID']),
+                    r['vernacularName'],
+                    ISO_639_1_TO_2.get(r.get('language'), r.get('language') or None),
+                    r.get('countryCode') or None,
+                ) for r in _read_tsv(dwca / 'VernacularName.tsv'))
+            for batch in _batches(names):
+                conn.executemany('INSERT INTO vernacular_name VALUES (?, ?, ?, ?)', batch)
+        conn.executescript(INDEXES)
+        if log:
+            log.info('building trigram index')
+        conn.create_function('ntri', 1, lambda name: len(trigrams(name)), deterministic=True)
+        conn.executescript(TRIGRAM_INDEX)
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.close()
+        return cls(dbpath)
+
+    def _classification(self, cu, row):
+        """
+        Walk up the parent chain to determine the keys of the higher taxa.
+        """
+        res, seen = {}, set()
+        while row is not None:
+            seen.add(row['key'])
+            rank = (row['rank'] or '').lower()
+            if rank in HIGHER_RANKS and rank + 'Key' not in res:
+                res[rank + 'Key'] = row['key']
+            if row['parent_key'] is None or row['parent_key'] in seen:
+                break
+            row = cu.execute(
+                'SELECT key, parent_key, rank FROM taxon WHERE key = ?',
+                (row['parent_key'],)).fetchone()
+        return res
+
+    def _usage(self, cu, row):
+        res = {
+            'key': row['key'],
+            'nubKey': row['key'],
+            'scientificName': row['scientific_name'],
+            'canonicalName': row['canonical_name'],
+            'authorship': row['authorship'] or '',
+            'rank': row['rank'],
+            'taxonomicStatus': row['status'],
+            'status': row['status'],
+            'synonym': row['accepted_key'] is not None,
+        }
+        if row['parent_key'] is not None:
+            res['parentKey'] = row['parent_key']
+        if row['accepted_key'] is not None:
+            res['acceptedKey'] = row['accepted_key']
+        for rank in HIGHER_RANKS[:-1]:
+            if row[rank]:
+                res[rank] = row[rank]
+        res.update(self._classification(cu, row))
+        return res
+
+    def _get(self, cu, key):
+        row = cu.execute('SELECT * FROM taxon WHERE key = ?', (int(key),)).fetchone()
+        if row is None:
+            raise NotFound(key)
+        return row
+
+    def name_usage(self, key=None, data='all', limit=100, offset=None, **kw):
+        offset = offset or 0
+        with self.cursor() as cu:
+            row = self._get(cu, key)
+            if data == 'vernacularNames':
+                rows = cu.execute(
+                    'SELECT name, language, country FROM vernacular_name WHERE key = ? '
+                    'ORDER BY rowid LIMIT ? OFFSET ?',
+                    (row['key'], limit + 1, offset)).fetchall()
+                return {
+                    'offset': offset,
+                    'limit': limit,
+                    'endOfRecords': len(rows) <= limit,
+                    'results': [
+                        {
+                            'taxonKey': row['key'],
+                            'vernacularName': r['name'],
+                            'language': r['language'] or '',
+                            'country': r['country'] or '',
+                        } for r in rows[:limit]]}
+            if data == 'all':
+                return self._usage(cu, row)
+        raise ValueError('Unsupported data for offline backbone: {}'.format(data))
+
+    def name_suggest(self, q=None, rank=None, limit=100, **kw):
+        """
+        Prefix search on canonical names.
+        """
+        q = ' '.join((q or '').lower().split())
+        sql, params = 'SELECT * FROM taxon WHERE name_lc >= ? AND name_lc < ?', [q, q + '\uffff']
+        if rank:
+            sql += ' AND rank = ?'
+            params.append(rank.upper())
+        sql += ' ORDER BY accepted_key IS NOT NULL, length(name_lc), name_lc LIMIT ?'
+        with self.cursor() as cu:
+            return [self._usage(cu, row) for row in cu.execute(sql, params + [limit]).fetchall()]
+
+    def _similar(self, cu, query, threshold):
+        """
+        Names with a trigram similarity of at least `threshold` to `query`.
+
+        A name with `n` trigrams sharing `s` of the `m` trigrams of the query has similarity
+        `t = s / (m + n - s)`, thus `n` must be within `[t * m, m / t]` and `s` at least
+        `t * (m + n) / (1 + t)`. So we only scan postings of names of suitable length, and - probing
+        the trigrams of the query from the rarest - only consider names first seen with the `i`th
+        trigram if they could still share enough of the remaining trigrams. Candidates which can't
+        reach `threshold` - even if they shared all trigrams we didn't probe - are discarded before
+        computing their similarity.
+
+        :return: `list` of pairs (name, similarity).
+        """
+        qtri = trigrams(query)
+        if not qtri or threshold <= 0:
+            return []
+        m = len(qtri)
+        cu.row_factory = None  # Plain tuples are considerably faster to unpack.
+        counts = dict(cu.execute(
+            'SELECT trigram, n FROM trigram_count WHERE trigram IN ({})'.format(','.join('?' * m)),
+            sorted(qtri)).fetchall())
+        order = sorted(counts, key=lambda tri: (counts[tri], tri))
+
+        def min_shared(n):
+            return threshold * (m + n) / (1 + threshold) - EPSILON
+
+        lo, hi = math.ceil(threshold * m - EPSILON), math.floor(m / threshold + EPSILON)
+        shared, ntri, probed = {}, {}, 0
+        for i, tri in enumerate(order):
+            if len(order) - i < min_shared(lo):
+                break
+            probed += 1
+            for name_id, n in cu.execute(
+                    'SELECT name_id, ntri FROM trigram '
+                    'WHERE trigram = ? AND ntri BETWEEN ? AND ?',
+                    (tri, lo, hi)):
+                if name_id in shared:
+                    shared[name_id] += 1
+                elif len(order) - i >= min_shared(n):
+                    shared[name_id], ntri[name_id] = 1, n
+
+        ids = [
+            name_id for name_id, s in shared.items()
+            if min(s + len(order) - probed, ntri[name_id]) >= min_shared(ntri[name_id])]
+        res = []
+        for batch in _batches(ids, size=500):
+            for (name,) in cu.execute(
+                    'SELECT name_lc FROM name WHERE id IN ({})'.format(','.join('?' * len(batch))),
+                    batch):
+                ntri = trigrams(name)
+                score = len(qtri & ntri) / len(qtri | ntri)
+                if score >= threshold:
+                    res.append((name, score))
+        return res
+
+    def name_lookup(self, q=None, rank=None, limit=20, offset=None, threshold=0.3, **kw):
+        """
+        Fuzzy search on canonical names, ranking names by the similarity of their trigram sets,
+        i.e. by the Jaccard index, which must be at least `threshold`.
+        """
+        offset = offset or 0
+        query = ' '.join((q or '').lower().split())
+        with self.cursor() as cu:
+            scored = [(score, name) for name, score in self._similar(cu, query, threshold)]
+        scored.sort(key=lambda i: (-i[0], i[1]))
+
+        with self.cursor() as cu:
+            results = []
+            for score, name in scored:
+                sql = 'SELECT * FROM taxon WHERE name_lc = ?'
+                params = [name]
+                if rank:
+                    sql += ' AND rank = ?'
+                    params.append(rank.upper())
+                for row in cu.execute(sql + ' ORDER BY accepted_key IS NOT NULL', params):
+                    results.append(row)
+            return {
+                'offset': offset,
+                'limit': limit,
+                'endOfRecords': offset + limit >= len(results),
+                'count': len(results),
+                'results': [self._usage(cu, row) for row in results[offset:offset + limit]],
+            }
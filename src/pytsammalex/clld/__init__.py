@@ -1,13 +1,29 @@
 try:
     from clld.interfaces import IIndex
+    from pyramid.settings import asbool
 except ImportError:
     IIndex = None
 
 from pytsammalex.clld.models import Ecoregion, IEcoregion
-from pytsammalex.clld.adapters import GeoJsonEcoregions
+from pytsammalex.clld.adapters import GeoJsonEcoregions, ecoregion_tile
+from pytsammalex.clld.maps import GBIFTileProxy, GBIF_TILE_ROUTE
+from pytsammalex.tilecache import TileCache, MAX_SIZE
 
 
 def includeme(config):
     config.registry.settings['mako.directories'].append('pytsammalex:clld/templates')
     config.register_resource('ecoregion', Ecoregion, IEcoregion, with_index=True)
     config.register_adapter(GeoJsonEcoregions, IEcoregion, IIndex)
+    # Clients showing only part of the world fetch the ecoregions tile by tile:
+    config.add_route('ecoregion_tile', '/ecoregions/tiles/{z}/{x}/{y}.geojson')
+    config.add_view(ecoregion_tile, route_name='ecoregion_tile')
+
+    # Optionally, GBIF occurrence density tiles are proxied - and cached - by the app:
+    settings = config.registry.settings
+    if asbool(settings.get('pytsammalex.gbif_tile_proxy', False)):
+        config.add_route(GBIF_TILE_ROUTE, '/gbif-tiles/{z}/{x}/{y}.png')
+        config.add_view(
+            GBIFTileProxy(TileCache(
+                dbpath=settings.get('pytsammalex.gbif_tile_cache'),
+                max_size=int(settings.get('pytsammalex.gbif_tile_cache_size', MAX_SIZE)))),
+            route_name=GBIF_TILE_ROUTE)
@@ -1,26 +1,257 @@
+import json
+import zlib
+import hashlib
+import datetime
+import functools
+import threading
+import collections
+
 try:
+    import sqlalchemy as sa
+    from pyramid.response import Response
+    from sqlalchemy.orm import joinedload
+    from pyramid.httpexceptions import HTTPNotFound
+    from clld.db.meta import DBSession
     from clld.web.adapters.geojson import GeoJson
 except ImportError:
     GeoJson = object
 
+from pytsammalex.ecoregions import (
+    zoom_level, tile_bbox, geometry_bbox, clip, GridIndex, ZOOM_LEVELS)
+from pytsammalex.clld.models import Ecoregion
+
 ECOREGIONS_TITLE = "WWF's Terrestrial Ecoregions"
+# Size of the chunks in which cached responses are sent.
+CHUNK_SIZE = 64 * 1024
+# Maximal zoom level of ecoregion tiles - and number of pixels by which tiles are buffered, to hide
+# the borders of clipped polygons.
+MAX_TILE_ZOOM = 12
+TILE_BUFFER = 4
+
+
+def _zoom_level(req):
+    try:
+        return zoom_level(int(req.params['zoom']))
+    except (KeyError, ValueError):
+        return None
+
+
+def data_version():
+    """
+    :return: Pair (number of ecoregions, time of the last update).
+    """
+    return DBSession.query(sa.func.count(Ecoregion.pk), sa.func.max(Ecoregion.updated)).one()
+
+
+def feature_properties(ecoregion):
+    return {
+        'id': ecoregion.id,
+        'label': '%s %s' % (ecoregion.id, ecoregion.name),
+        'color': ecoregion.biome.description,
+        'language': {'id': ecoregion.id},
+        'latlng': [ecoregion.latitude, ecoregion.longitude],
+    }
+
+
+def iter_featurecollection(properties, features):
+    """
+    Serialize a GeoJSON feature collection incrementally, one feature at a time.
+    """
+    yield '{"type": "FeatureCollection", "properties": %s, "features": [' % json.dumps(properties)
+    for i, feature in enumerate(features):
+        yield (', ' if i else '') + json.dumps(feature)
+    yield ']}'
+
+
+def cached_response(body, req, content_type):
+    """
+    :param body: `CachedBody` instance.
+    :return: `Response` - gzip-compressed if accepted by the client - supporting conditional \
+    requests.
+    """
+    res = Response(conditional_response=True)
+    res.content_type = content_type
+    res.vary = ('Accept', 'Accept-Encoding')
+    res.last_modified = body.last_modified
+    # Clients not sending an Accept-Encoding header get the uncompressed body.
+    if req.accept_encoding and req.accept_encoding.acceptable_offers(['gzip']):
+        chunks, res.content_encoding, res.etag = body.gzip, 'gzip', body.etag + '-gzip'
+    else:
+        chunks, res.etag = body.identity, body.etag
+    res.content_length = sum(len(chunk) for chunk in chunks)
+    res.app_iter = chunks
+    return res
+
+
+class CachedBody:
+    """
+    A serialized response body - plain and gzip-compressed - stored in chunks.
+    """
+    def __init__(self, chunks, last_modified=None):
+        self.identity, self.gzip = [], []
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        sha1, buffer, size = hashlib.sha1(), [], 0
+        for chunk in chunks:
+            chunk = chunk.encode('utf8')
+            sha1.update(chunk)
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= CHUNK_SIZE:
+                self._add(b''.join(buffer), compressor)
+                buffer, size = [], 0
+        self._add(b''.join(buffer), compressor)
+        self.gzip.append(compressor.flush())
+        self.etag = sha1.hexdigest()
+        self.last_modified = last_modified or datetime.datetime.now(datetime.timezone.utc)
+
+    def _add(self, data, compressor):
+        self.identity.append(data)
+        self.gzip.append(compressor.compress(data))
 
 
 class GeoJsonEcoregions(GeoJson):
+    """
+    GeoJSON of ecoregions - with geometries simplified for a map at the zoom level passed as
+    request parameter `zoom`, if any.
+
+    Since the ecoregions rarely change, serialized responses are cached - keyed on the data
+    version - and served with `ETag` and `Last-Modified` headers, supporting conditional requests.
+    Only requests with no parameters other than `zoom` and `layer` are cached, because other
+    parameters - e.g. search or paging of the `DataTable` - change the result of `ctx.get_query()`.
+    """
+    # Request parameters for which responses are cached:
+    cache_params = {'zoom', 'layer'}
+    # Maximal number of cached responses - bounding memory, since `layer` is chosen by the client:
+    max_cached = 16
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
     def featurecollection_properties(self, ctx, req):
         return {'name': ECOREGIONS_TITLE}
 
     def get_features(self, ctx, req):
+        level = _zoom_level(req)
         for ecoregion in ctx.get_query():
-            for polygon in ecoregion.jsondata['polygons']:
+            polygons = ecoregion.jsondata['polygons']
+            if level is not None:
+                # Ecoregions loaded before simplified geometries were added - or which collapse
+                # when simplified - are served at full resolution.
+                polygons = ecoregion.jsondata.get('simplified', {}).get(str(level)) or polygons
+            for polygon in polygons:
                 yield {
                     'type': 'Feature',
-                    'properties': {
-                        'id': ecoregion.id,
-                        'label': '%s %s' % (ecoregion.id, ecoregion.name),
-                        'color': ecoregion.biome.description,
-                        'language': {'id': ecoregion.id},
-                        'latlng': [ecoregion.latitude, ecoregion.longitude],
-                    },
+                    'properties': feature_properties(ecoregion),
                     'geometry': polygon,
                 }
+
+    def data_version(self, ctx, req):
+        return data_version()
+
+    def iter_json(self, ctx, req):
+        return iter_featurecollection(
+            self._featurecollection_properties(ctx, req), self.get_features(ctx, req))
+
+    def cached_body(self, ctx, req):
+        version = tuple(self.data_version(ctx, req))
+        if not set(req.params) <= self.cache_params:
+            return CachedBody(self.iter_json(ctx, req), last_modified=version[1])
+        key = (version, _zoom_level(req), req.params.get('layer', ''))
+        with self._cache_lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+                return body
+        body = CachedBody(self.iter_json(ctx, req), last_modified=version[1])
+        with self._cache_lock:
+            for k in [k for k in self._cache if k[0] != version]:
+                del self._cache[k]
+            self._cache[key] = body
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return body
+
+    def render(self, ctx, req, dump=True):
+        if dump:
+            return b''.join(self.cached_body(ctx, req).identity).decode('utf8')
+        return super().render(ctx, req, dump=False)
+
+    def render_to_response(self, ctx, req):
+        return cached_response(
+            self.cached_body(ctx, req), req, str(self.send_mimetype or self.mimetype))
+
+
+class EcoregionTiles:
+    """
+    GeoJSON map tiles of ecoregions, with the geometries - simplified according to the zoom level
+    - clipped to the tile.
+
+    Features intersecting a tile are looked up in `GridIndex`es of the bounding boxes of the
+    polygons, which are built once per data version from the boxes computed in `load_ecoregions`.
+
+    :param ecoregions: Iterable of `Ecoregion` instances.
+    :param version: Data version, as returned by `data_version`.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, ecoregions, version=None, max_tiles=1024):
+        self.version = version
+        self.features = {level: [] for level in [None] + ZOOM_LEVELS}
+        bboxes = {level: [] for level in self.features}
+        for ecoregion in ecoregions:
+            properties = feature_properties(ecoregion)
+            polygons = ecoregion.jsondata['polygons']
+            for level in self.features:
+                if level is None:
+                    geometries = polygons
+                    # Ecoregions loaded before bounding boxes were added lack them:
+                    boxes = ecoregion.jsondata.get('bboxes') \
+                        or [geometry_bbox(g) for g in geometries]
+                else:
+                    geometries = ecoregion.jsondata.get('simplified', {}).get(str(level)) \
+                        or polygons
+                    boxes = [geometry_bbox(g) for g in geometries]
+                self.features[level].extend((properties, g) for g in geometries)
+                bboxes[level].extend(boxes)
+        self.index = {level: GridIndex(bboxes[level]) for level in self.features}
+        self.tile = functools.lru_cache(maxsize=max_tiles)(self._tile)
+
+    @classmethod
+    def get(cls):
+        """
+        :return: `EcoregionTiles` for the ecoregions in the database - (re-)built if needed.
+        """
+        version = data_version()
+        with cls._lock:
+            if cls._instance is None or cls._instance.version != version:
+                cls._instance = cls(
+                    DBSession.query(Ecoregion).options(joinedload(Ecoregion.biome)),
+                    version=version)
+            return cls._instance
+
+    def get_features(self, z, x, y):
+        level = zoom_level(z)
+        bbox = tile_bbox(z, x, y, buffer=TILE_BUFFER)
+        for i in self.index[level].query(bbox):
+            properties, geometry = self.features[level][i]
+            geometry = clip(geometry, bbox)
+            if geometry:
+                yield {'type': 'Feature', 'properties': properties, 'geometry': geometry}
+
+    def _tile(self, z, x, y):
+        return CachedBody(
+            iter_featurecollection({'name': ECOREGIONS_TITLE}, self.get_features(z, x, y)),
+            last_modified=self.version[1] if self.version else None)
+
+
+def ecoregion_tile(req):
+    """
+    View serving GeoJSON tiles of ecoregions for route `ecoregion_tile`.
+    """
+    try:
+        z, x, y = [int(req.matchdict[k]) for k in 'zxy']
+    except ValueError:
+        raise HTTPNotFound()
+    if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPNotFound()
+    return cached_response(EcoregionTiles.get().tile(z, x, y), req, 'application/geo+json')
@@ -1,13 +1,16 @@
+import os
+import logging
 import pathlib
 import functools
-import itertools
 
+from appdirs import user_cache_dir
 from clldutils import jsonlib
 from clldutils.misc import nfilter
 import pycldf
 
 import pytsammalex
-from pytsammalex.gbif import GBIF
+from pytsammalex.gbif import GBIF, ordered_map
+from pytsammalex.ecoregions import Ecoregions, area_centroid, geometry_bbox, ZOOM_LEVELS
 from pytsammalex.clld.models import TaxonMixin, Biome, Ecoregion
 
 try:
@@ -16,59 +19,197 @@ except ImportError:
     Data = None
 
 
-def iter_datasets(default_dir, filter=None, exclude=('bin', 'lib', 'share', 'include', 'man')):
-    d = input('Directory containing the datasets [{}]:'.format(default_dir)) or default_dir
-    for dd in pathlib.Path(d).iterdir():
-        if dd.is_dir() and dd.name in exclude:
-            continue
-        for ds in pycldf.iter_datasets(dd):
+# Environment variable to specify the directory containing the datasets.
+DATASETS_DIR_ENV = 'TSAMMALEX_DATASETS'
+
+
+def default_index_path():
+    return pathlib.Path(user_cache_dir(appname=pytsammalex.__name__)) / 'datasets.json'
+
+
+def _read_index(path):
+    try:
+        return jsonlib.load(path)['files']
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+
+
+def _write_index(path, files):
+    path = pathlib.Path(path)
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True)
+    tmp = path.parent / (path.name + '.tmp')
+    jsonlib.dump({'files': files}, tmp)
+    os.replace(str(tmp), str(path))
+
+
+def _stat(p):
+    stat = os.stat(str(p))
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _unchanged(d, files):
+    """
+    :return: The index entries for directory `d` - if `d` was indexed and none of the recorded \
+    files and directories changed - or `None`.
+    """
+    prefix = str(d) + os.sep
+    entries = {k: v for k, v in files.items() if k == str(d) or k.startswith(prefix)}
+    if str(d) not in entries:
+        return None
+    try:
+        # Adding, removing or renaming a file changes the modification time of its directory.
+        if all(_stat(k) == v[:2] for k, v in entries.items()):
+            return entries
+    except OSError:
+        pass
+
+
+def _scan(d, files):
+    """
+    Discover CLDF datasets in directory `d` - like `pycldf.iter_datasets` - but only walking `d`
+    if anything changed since it was recorded in the index `files`, and only sniffing files which
+    changed. Hidden directories - e.g. `.git` - are skipped.
+
+    :return: Pair (`list` of `pycldf.Dataset` instances, `dict` of index entries for `d`).
+    """
+    entries = _unchanged(d, files)
+    if entries is None:
+        entries = {}
+        for root, dirs, filenames in os.walk(str(d)):
+            dirs[:] = [dd for dd in dirs if not dd.startswith('.')]
+            try:
+                entries[root] = _stat(root) + [False]
+            except OSError:  # pragma: no cover
+                continue
+            for fname in filenames:
+                p = pathlib.Path(root) / fname
+                try:
+                    stat = _stat(p)
+                except OSError:  # pragma: no cover
+                    continue
+                entry = files.get(str(p))
+                is_cldf = entry[2] if entry and entry[:2] == stat else pycldf.sniff(p)
+                entries[str(p)] = stat + [is_cldf]
+    datasets = []
+    for p in sorted(k for k, v in entries.items() if v[2]):
+        try:
+            datasets.append(pycldf.Dataset.from_metadata(p))
+        except ValueError as e:
+            logging.getLogger('tsammalex').warning('Reading {} failed: {}'.format(p, e))
+    return datasets, entries
+
+
+def iter_datasets(
+        default_dir=None,
+        filter=None,
+        exclude=('bin', 'lib', 'share', 'include', 'man'),
+        interactive=False,
+        index=None,
+        max_workers=8):
+    """
+    Discover CLDF datasets in the subdirectories of a directory.
+
+    The directory is read from the environment variable `TSAMMALEX_DATASETS`, falling back to
+    `default_dir` - or prompted for, if `interactive`. Subdirectories are scanned concurrently,
+    and datasets are yielded in the order of the sorted subdirectories.
+
+    :param filter: Callable accepting a `pycldf.Dataset`, returning whether to yield the dataset.
+    :param exclude: Names of subdirectories to skip - in addition to hidden directories.
+    :param index: Path of a JSON file recording modification time and size of all files and \
+    directories seen, to avoid re-walking unchanged subdirectories and re-sniffing unchanged files \
+    for CLDF metadata; defaults to `default_index_path()`, \
+    pass `False` to disable the index.
+    :param max_workers: Maximal number of subdirectories scanned concurrently.
+    :return: Generator of `pycldf.Dataset` instances.
+    """
+    d = os.environ.get(DATASETS_DIR_ENV) or default_dir
+    if interactive:
+        d = input('Directory containing the datasets [{}]:'.format(d)) or d
+    if not d:
+        raise ValueError(
+            'No directory containing the datasets specified - set {}'.format(DATASETS_DIR_ENV))
+    d = pathlib.Path(d).resolve()
+    index = default_index_path() if index is None else index
+    files = _read_index(index) if index else {}
+
+    subdirs = [
+        dd for dd in sorted(d.iterdir())
+        if dd.is_dir() and dd.name not in exclude and not dd.name.startswith('.')]
+    entries = {}
+    for datasets, scanned in ordered_map(
+            lambda dd: _scan(dd, files), subdirs, max_workers=max_workers):
+        entries.update(scanned)
+        for ds in datasets:
             if (filter is None) or filter(ds):
                 yield ds
 
+    if index:
+        # Keep the entries for files outside of `d`:
+        prefix = str(d) + os.sep
+        entries.update({k: v for k, v in files.items() if not k.startswith(prefix)})
+        _write_index(index, entries)
 
-def iter_taxa(cldf, language_tags, seen=None, enrich=False):
+
+def iter_taxa(cldf, language_tags, seen=None, enrich=False, gbif=None, max_workers=8, window=None):
     """
     Iterate over a datasets' taxa, yielding a `dict` of taxon data for each `GBIF_ID` not yet in
     `seen`.
 
+    GBIF data is retrieved concurrently for up to `window` rows read ahead, while taxa are
+    yielded in the order of the ParameterTable.
+
     :param cldf: `pycldf.Dataset` instance.
     :param language_tags: A `set` of ISO 639-2 language tags for which to retrieve vernacular \
     names for the taxon from GBIF.
-    :param seen: `set` of already encountered `GBIF_ID`s
+    :param seen: `set` of already encountered `GBIF_ID`s - updated when rows are read.
+    :param gbif: `GBIF` instance to retrieve data with.
+    :param max_workers: Maximal number of taxa for which GBIF data is retrieved concurrently.
+    :param window: Maximal number of rows read ahead; defaults to `2 * max_workers`.
     :return: Generator of triples (parameter `dict`, vernacular names `dict`, taxon data `dict`).
     """
     seen = set() if seen is None else seen
-    for param in cldf.iter_rows('ParameterTable', 'id', 'concepticonReference', 'name'):
-        if (not param['GBIF_ID']) or param['GBIF_ID'] == '-':
-            continue
-        if param['GBIF_ID'] in seen:
-            continue
+    gbif = gbif or GBIF()
 
-        seen.add(param['GBIF_ID'])
-        vnames = GBIF().get_vernacular_names(
+    def iter_params():
+        for param in cldf.iter_rows('ParameterTable', 'id', 'concepticonReference', 'name'):
+            if (not param['GBIF_ID']) or param['GBIF_ID'] == '-':
+                continue
+            if param['GBIF_ID'] in seen:
+                continue
+            seen.add(param['GBIF_ID'])
+            yield param
+
+    def taxon_data(param):
+        vnames = gbif.get_vernacular_names(
             param['GBIF_ID'], param['rank'], language_tags=language_tags)
         taxon = {k: param.get(k) for k in dir(TaxonMixin) if not k.startswith('_')}
         if any(v is None for v in taxon.values()) and enrich:
-            gbif_data = GBIF().usage(key=param['GBIF_ID'])
+            gbif_data = gbif.usage(key=param['GBIF_ID'])
             taxon.update({k: gbif_data.get(k.replace('_', '')) for k in taxon})
+        return param, vnames, taxon
 
-        yield param, vnames, taxon
+    for res in ordered_map(taxon_data, iter_params(), max_workers=max_workers, window=window):
+        yield res
 
 
 def get_center(arr):
+    """
+    Mean of the vertices `arr`; see `pytsammalex.ecoregions.area_centroid` for a proper centroid.
+    """
     return functools.reduce(
         lambda x, y: [x[0] + y[0] / len(arr), x[1] + y[1] / len(arr)], arr, [0.0, 0.0])
 
 
-def load_ecoregions(filter=None):
+def load_ecoregions(filter=None, ecoregions=None):
     """
+    Add `Biome` and `Ecoregion` objects for WWF's Terrestrial Ecoregions to the database session.
 
-    :param data:
-    :param filter:
-    :return:
+    :param filter: Callable accepting `eco_code` and properties of an ecoregion, returning \
+    whether to load the ecoregion.
+    :param ecoregions: `Ecoregions` instance; defaults to `Ecoregions.load()`.
     """
-    ecoregions = jsonlib.load(
-        pathlib.Path(pytsammalex.__file__).parent / 'ecoregions.json')['features']
+    ecoregions = ecoregions or Ecoregions.load()
 
     biome_map = {
         1: ('Tropical & Subtropical Moist Broadleaf Forests', '008001'),
@@ -88,11 +229,8 @@ def load_ecoregions(filter=None):
     }
 
     data = Data()
-    for eco_code, features in itertools.groupby(
-            sorted(ecoregions, key=lambda e: e['properties']['eco_code']),
-            key=lambda e: e['properties']['eco_code']):
-        features = list(features)
-        props = features[0]['properties']
+    for eco_code, features in ecoregions.groupby():
+        props = features[0].properties
         if filter and not filter(eco_code, props):
             continue
 
@@ -107,15 +245,15 @@ def load_ecoregions(filter=None):
                 id=str(int(props['BIOME'])),
                 name=name,
                 description=color or 'ffffff')
-        centroid = (None, None)
-        f = sorted(features, key=lambda _f: _f['properties']['AREA'])[-1]
-        if f['geometry']:
-            coords = f['geometry']['coordinates'][0]
-            if f['geometry']['type'] == 'MultiPolygon':
-                coords = coords[0]
-            centroid = get_center(coords)
-
-        polygons = nfilter([_f['geometry'] for _f in features])
+        _, centroid = area_centroid(
+            polygon for _f in features for polygon in _f.polygons())
+
+        polygons = nfilter([_f.geometry for _f in features])
+        # Simplified geometries for maps at low zoom levels:
+        simplified = {
+            str(zoom): nfilter([_f.simplified(zoom) for _f in features]) for zoom in ZOOM_LEVELS}
+        # Bounding boxes of the polygons, to build the spatial index for map tiles from:
+        bboxes = [geometry_bbox(polygon) for polygon in polygons]
         data.add(
             Ecoregion, eco_code,
             id=eco_code,
@@ -127,4 +265,4 @@ def load_ecoregions(filter=None):
             area=props['area_km2'],
             gbl_stat=Ecoregion.gbl_stat_map[int(props['GBL_STAT'])],
             realm=Ecoregion.realm_map[props['REALM']],
-            jsondata=dict(polygons=polygons))
+            jsondata=dict(polygons=polygons, simplified=simplified, bboxes=bboxes))
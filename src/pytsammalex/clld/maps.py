@@ -1,21 +1,91 @@
+import time
+import urllib.parse
+
 try:
     from clld.web.maps import Layer
+    from pyramid.response import Response
+    from pyramid.httpexceptions import HTTPNotFound, HTTPBadGateway
+    from pyramid.interfaces import IRoutesMapper
 except ImportError:
     from unittest import mock
     Layer = mock.Mock
+import requests
 
 from pytsammalex.clld.adapters import ECOREGIONS_TITLE
 
+# Ecoregions are displayed on overview maps, thus we request geometries simplified accordingly.
+OVERVIEW_ZOOM = 4
+GBIF_DENSITY_URL = 'https://api.gbif.org/v2/map/occurrence/density/{z}/{x}/{y}@1x.png'
+GBIF_DENSITY_PARAMS = [('style', 'classic.poly'), ('bin', 'hex'), ('hexPerTile', '30')]
+# Name of the route of the GBIF tile proxy - registered if enabled in the app settings.
+GBIF_TILE_ROUTE = 'gbif_tile'
+
 
-def gbif_occurrence_overlay(taxon):
+def gbif_occurrence_overlay(taxon, req=None):
+    """
+    :param req: The current request. If passed - and the GBIF tile proxy is enabled - the overlay \
+    tiles are fetched via the proxy.
+    """
+    query = urllib.parse.urlencode(GBIF_DENSITY_PARAMS + [('taxonKey', str(taxon.id))])
+    url = GBIF_DENSITY_URL + '?' + query
+    mapper = req.registry.queryUtility(IRoutesMapper) if req is not None else None
+    if mapper and mapper.get_route(GBIF_TILE_ROUTE):
+        # `route_url` would quote the braces of the URL template, thus we use placeholders:
+        url = req.route_url(GBIF_TILE_ROUTE, z='_z_', x='_x_', y='_y_') \
+            .replace('_z_', '{z}').replace('_x_', '{x}').replace('_y_', '{y}') + '?' + query
     return {
         "name": "Occurrences of {} according to GBIF".format(taxon),
-        "url": "https://api.gbif.org/v2/map/occurrence/density/{z}/{x}/{y}@1x.png?"
-               "style=classic.poly&bin=hex&hexPerTile=30&taxonKey=" + str(taxon.id),
+        "url": url,
         "options": {
             "attribution": "Occurrence data from <a href=\"https://www.gbif.org/\">GBIF</a>"},
     }
 
 
 def get_layers(req):
-    return Layer('ecoregions', ECOREGIONS_TITLE, req.route_url('ecoregions_alt', ext='geojson'))
+    return Layer(
+        'ecoregions',
+        ECOREGIONS_TITLE,
+        req.route_url('ecoregions_alt', ext='geojson', _query={'zoom': OVERVIEW_ZOOM}))
+
+
+class GBIFTileProxy:
+    """
+    View for route `gbif_tile`, serving GBIF occurrence density tiles from a `TileCache`.
+
+    :param cache: `pytsammalex.tilecache.TileCache` instance.
+    :param upstream: URL template of the tiles.
+    """
+    # Query parameters passed on to GBIF:
+    params = ['style', 'bin', 'hexPerTile', 'squareSize', 'taxonKey', 'srs']
+
+    def __init__(self, cache, upstream=GBIF_DENSITY_URL):
+        self.cache = cache
+        self.upstream = upstream
+
+    def __call__(self, req):
+        try:
+            z, x, y = [int(req.matchdict[k]) for k in 'zxy']
+        except ValueError:
+            raise HTTPNotFound()
+        if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise HTTPNotFound()
+        query = sorted((k, v) for k, v in req.params.items() if k in self.params)
+        url = self.upstream.format(z=z, x=x, y=y)
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        try:
+            tile = self.cache.get(url)
+        except requests.RequestException as e:
+            raise HTTPBadGateway(str(e))
+        res = Response(
+            status=tile.status,
+            body=tile.data,
+            content_type=tile.content_type if tile.data else None,
+            conditional_response=True)
+        if tile.etag:
+            res.headers['ETag'] = tile.etag
+        if tile.last_modified:
+            res.headers['Last-Modified'] = tile.last_modified
+        res.cache_control.public = True
+        res.cache_control.max_age = max(int(tile.expires - time.time()), 0)
+        return res
@@ -0,0 +1,23 @@
+import sys
+
+from clldutils.markup import Table
+
+from pytsammalex.gbif import METRICS
+
+
+def add_stats(parser):
+    parser.add_argument(
+        '--stats',
+        help='Print cache hits and misses, request latencies and bytes of GBIF data access to '
+             'stderr',
+        action='store_true',
+        default=False)
+
+
+def print_stats(args):
+    if getattr(args, 'stats', False):
+        rows = METRICS.summary()
+        if rows:
+            table = Table(*rows[0].keys())
+            table.extend([list(row.values()) for row in rows])
+            print(table.render(tablefmt='simple'), file=sys.stderr)
@@ -0,0 +1,31 @@
+"""
+Compile WWF's Terrestrial Ecoregions GeoJSON into the binary format read by "load_ecoregions".
+
+$ tsammalex ecoregions path/to/ecoregions.json
+
+By default, the GeoJSON is read from - and the compiled artifact is written next to - the
+pytsammalex package.
+"""
+import pathlib
+
+from pytsammalex.ecoregions import Ecoregions, default_geojson, default_dir
+
+
+def register(parser):
+    parser.add_argument(
+        'geojson',
+        help='Path of the ecoregions GeoJSON',
+        nargs='?',
+        type=pathlib.Path,
+        default=default_geojson())
+    parser.add_argument(
+        '--output',
+        help='Directory to write the compiled ecoregions to',
+        type=pathlib.Path,
+        default=None)
+
+
+def run(args):
+    d = args.output or default_dir(args.geojson)
+    ecoregions = Ecoregions.compile(args.geojson, d)
+    args.log.info('{} ecoregion features compiled into {}'.format(len(ecoregions), d))
@@ -13,15 +13,31 @@ from clldutils.html import HTML, literal
 from clldutils.misc import data_url
 
 from pytsammalex.gbif import GBIF, RANKS
+from pytsammalex.thumbnails import ThumbnailCache, width_px
+from pytsammalex.commands import add_stats, print_stats
+
+# Width of images in the PDF in cm.
+IMAGE_WIDTH = 6
 
 
 def register(parser):
     add_dataset(parser)
     parser.add_argument('language')
+    parser.add_argument(
+        '--dpi',
+        help='Resolution of images in the PDF; images are downscaled accordingly',
+        type=int,
+        default=200)
+    parser.add_argument(
+        '--thumbnail-dir',
+        help='Directory to cache downscaled images in; defaults to the user cache directory',
+        default=None)
+    add_stats(parser)
 
 
 def run(args):
     gbif = GBIF()
+    thumbnails = ThumbnailCache(args.thumbnail_dir, width=width_px(IMAGE_WIDTH, args.dpi))
     ds = get_dataset(args)
     media = MediaTable(ds)
     media_by_taxon = collections.defaultdict(list)
@@ -40,16 +56,31 @@ def run(args):
     taxa = [t for t in taxa if t['ID'] in names]
     paragraphs = []
 
-    def link_callback(src_attr, *args):
-        if src_attr in media_by_id:
-            f = media_by_id[src_attr]
+    image_paths = {}
+
+    def thumbnail(f):
+        path = f.local_path()
+        try:
+            if path and path.exists() and not f.path_in_zip:
+                return str(thumbnails.get(path=path))
+            return str(thumbnails.get(data=f.read()))
+        except OSError as e:  # Not an image Pillow can read - we embed it as is.
+            args.log.warning('Cannot downscale {}: {}'.format(f.id, e))
             return data_url(f.read(), mimetype=f.mimetype.string)
+
+    def link_callback(src_attr, *_):
+        # Images are passed to the renderer as paths of downscaled copies:
+        if src_attr in media_by_id:
+            if src_attr not in image_paths:
+                image_paths[src_attr] = thumbnail(media_by_id[src_attr])
+            return image_paths[src_attr]
         return src_attr
 
     def taxon_item(taxon):
         try:
             vnames = gbif.get_vernacular_names(taxon['GBIF_ID'])
-        except:
+        except Exception as e:
+            args.log.warning('No vernacular names for {}: {}'.format(taxon['GBIF_ID'], e))
             vnames = {}
         content = [HTML.h6(HTML.a(
             '{} {}'.format(taxon['rank'], taxon['Name']),
@@ -179,8 +210,8 @@ The list of references cited in this document is available at
     h3 { -pdf-keep-with-next: true; padding-bottom: -2mm; }
     p { -pdf-keep-with-next: true; }
     p.separator { -pdf-keep-with-next: false; font-size: 1mm; }
-    img.image { zoom: 55%; border: 1px solid black; }
-    td { text-align: center; }"""))
+    img.image { width: %scm; border: 1px solid black; }
+    td { text-align: center; }""" % IMAGE_WIDTH))
         pisa.CreatePDF(
             str(HTML.html(
                 HTML.head(charis_font_spec_html(), style),
@@ -188,6 +219,7 @@ The list of references cited in this document is available at
             dest=fp,
             link_callback=link_callback,
         )
+    print_stats(args)
 
 
 def vs():
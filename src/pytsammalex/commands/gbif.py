@@ -12,39 +12,120 @@ $ tsammalex gbif lookup "Pantera leo"
 
 If you are certain about the spelling, try "suggest" - which is quicker.
 
+To resolve many queries at once, pass "-" as query and feed queries via stdin, one query per
+line, either a plain name (or key for "usage") or a JSON object of API parameters:
+
+$ tsammalex gbif lookup - --format tsv < names.txt > names.tsv
+
+Queries are resolved concurrently, and results are written in input order as they become
+available - as JSON lines or, with "--format tsv", as TSV.
+
+With "--backbone", queries are answered offline from a local copy of the GBIF backbone taxonomy
+loaded with "tsammalex gbif_backbone".
 
 https://www.gbif.org/tools/species-lookup
 
 """
+import sys
+import csv
 import json
 
 from clldutils.clilib import Table, add_format
+from clldutils.markup import TableFormat
 
-from pytsammalex.gbif import GBIF
+from pytsammalex.gbif import GBIF, ordered_map
+from pytsammalex.backbone import Backbone, default_dbpath
+from pytsammalex.commands import add_stats, print_stats
+
+COLS = {
+    'suggest': ['key', 'scientificName', 'rank', 'status'],
+    'lookup': ['key', 'scientificName', 'rank', 'taxonomicStatus'],
+    'usage': ['key', 'scientificName', 'rank', 'taxonomicStatus'],
+}
 
 
 def register(parser):
-    # FIXME: no-cache option!
-    parser.add_argument('service')
-    parser.add_argument('query')
+    parser.add_argument('service', choices=sorted(COLS))
+    parser.add_argument(
+        'query',
+        help="Query - or '-' to read queries from stdin, one per line")
+    parser.add_argument(
+        '--workers',
+        help='Maximal number of concurrent requests to the GBIF API in batch mode',
+        type=int,
+        default=8)
+    parser.add_argument(
+        '--no-cache',
+        help='Do not use (or update) the local cache of GBIF responses',
+        action='store_true',
+        default=False)
+    parser.add_argument(
+        '--backbone',
+        help='Answer queries from the local backbone database, rather than from the GBIF API',
+        action='store_true',
+        default=False)
+    parser.add_argument(
+        '--backbone-db',
+        help='Path of the local backbone database',
+        default=str(default_dbpath()))
+    add_stats(parser)
     add_format(parser, default='simple')
 
 
+def query_kw(service, query):
+    if query.startswith('{'):
+        return json.loads(query)
+    return {'key' if service == 'usage' else 'q': query}
+
+
+def iter_rows(service, res):
+    if service == 'suggest':
+        return [row for row in res if not row['synonym']]
+    if service == 'lookup':
+        return res['results']
+    return [res]
+
+
 def run(args):
-    kw = {'key' if args.service == 'usage' else 'q': args.query}
-    res = GBIF()(args.service, **kw)
-    if args.service == 'suggest':
-        cols = ['key', 'scientificName', 'rank', 'status']
-        with Table(args, *cols) as table:
-            for row in res:
-                if not row['synonym']:
-                    table.append([row.get(col) for col in cols])
-    elif args.service == 'lookup':
-        cols = ['key', 'scientificName', 'rank', 'taxonomicStatus']
-        with Table(args, *cols) as table:
-            for row in res['results']:
-                if 1:#not row['synonym'] and 'nubKey' not in row and 'kingdom' in row:
-                    table.append([row.get(col) for col in cols])
-    elif args.service == 'usage':
+    gbif = GBIF(backend=Backbone(args.backbone_db), cache=False) if args.backbone else GBIF()
+    if args.query == '-':
+        run_batch(args, gbif)
+    else:
+        run_single(args, gbif)
+    print_stats(args)
+
+
+def run_single(args, gbif):
+    res = gbif(args.service, no_cache=args.no_cache, **query_kw(args.service, args.query))
+    if args.service == 'usage':
         print(json.dumps(res, indent=4))
+        return
+    with Table(args, *COLS[args.service]) as table:
+        for row in iter_rows(args.service, res):
+            table.append([row.get(col) for col in COLS[args.service]])
+
+
+def run_batch(args, gbif):
+    def resolve(query):
+        try:
+            return query, gbif(
+                args.service, no_cache=args.no_cache, **query_kw(args.service, query)), None
+        except Exception as e:
+            return query, None, '{}: {}'.format(e.__class__.__name__, e)
 
+    tsv = args.format == TableFormat.tsv
+    queries = (line.strip() for line in sys.stdin if line.strip())
+    writer = csv.writer(sys.stdout, delimiter='\t')
+    if tsv:
+        writer.writerow(['query'] + COLS[args.service] + ['error'])
+    for query, res, error in ordered_map(resolve, queries, max_workers=args.workers):
+        if not tsv:
+            print(json.dumps(
+                dict(query=query, error=error) if error else dict(query=query, result=res)))
+        elif error:
+            writer.writerow([query] + [''] * len(COLS[args.service]) + [error])
+        else:
+            # Queries without results get a row, too - with empty columns.
+            for row in iter_rows(args.service, res) or [{}]:
+                writer.writerow([query] + [row.get(col) for col in COLS[args.service]] + [''])
+        sys.stdout.flush()
@@ -0,0 +1,30 @@
+"""
+Load the GBIF Backbone Taxonomy into a local database, for offline use.
+
+Download and unzip https://hosted-datasets.gbif.org/datasets/backbone/current/backbone.zip, then
+
+$ tsammalex gbif_backbone backbone/
+
+The database can then be used by passing "--backbone" - and "--backbone-db" for databases at
+non-default locations - to the "gbif" command.
+"""
+import pathlib
+
+from pytsammalex.backbone import Backbone, default_dbpath
+
+
+def register(parser):
+    parser.add_argument(
+        'dwca',
+        help='Directory containing the unzipped backbone Darwin Core Archive',
+        type=pathlib.Path)
+    parser.add_argument(
+        '--db',
+        help='Path of the database to create',
+        type=pathlib.Path,
+        default=default_dbpath())
+
+
+def run(args):
+    Backbone.from_dwca(args.dwca, args.db, log=args.log)
+    args.log.info('Backbone loaded into {}'.format(args.db))
@@ -0,0 +1,53 @@
+"""
+Maintain the local cache of GBIF API responses.
+
+$ tsammalex gbif_cache stats
+$ tsammalex gbif_cache prune --max-size 100000000
+$ tsammalex gbif_cache vacuum
+$ tsammalex gbif_cache compress
+
+"prune" deletes results older than their method's time-to-live and - if --max-size is given -
+evicts the least recently accessed results until the cache fits. "vacuum" returns unused space to
+the file system. "compress" converts results stored as plain JSON - e.g. by older versions of
+pytsammalex - to the compressed format and vacuums the cache.
+
+(This is a command of its own - rather than a subcommand "gbif cache" - because the first argument
+of "gbif" selects the API service to query.)
+"""
+import datetime
+
+from clldutils.clilib import Table, add_format
+
+from pytsammalex.gbif import Cache
+
+
+def register(parser):
+    parser.add_argument('action', choices=['stats', 'prune', 'vacuum', 'compress'])
+    parser.add_argument(
+        '--max-size',
+        help='Maximal size of the cache in bytes',
+        type=int,
+        default=None)
+    add_format(parser, default='simple')
+
+
+def _ts(ts):
+    return datetime.datetime.fromtimestamp(ts).isoformat(timespec='seconds') if ts else None
+
+
+def run(args):
+    cache = Cache(max_size=args.max_size)
+    if args.action == 'prune':
+        args.log.info('{} results deleted'.format(cache.prune()))
+    elif args.action == 'vacuum':
+        cache.vacuum()
+    elif args.action == 'compress':
+        args.log.info('{} results compressed'.format(cache.convert()))
+        cache.vacuum()
+
+    cols = ['method', 'results', 'negative', 'bytes', 'oldest', 'last_accessed']
+    with Table(args, *cols) as table:
+        for row in cache.stats():
+            row['oldest'], row['last_accessed'] = _ts(row['oldest']), _ts(row['last_accessed'])
+            table.append([row[col] for col in cols])
+    print('\n{}: {:,} bytes'.format(cache.dbpath, cache.dbpath.stat().st_size))
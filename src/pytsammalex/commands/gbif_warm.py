@@ -0,0 +1,83 @@
+"""
+Pre-populate the GBIF cache for the taxa of a CLDF dataset.
+
+Retrieves usage data and vernacular names for all GBIF_IDs in the ParameterTable - and vernacular
+names of the parent species for subspecies - fetching only results which are not cached yet.
+"""
+import time
+
+from pycldf.cli_util import add_dataset, get_dataset
+
+from pytsammalex.gbif import GBIF, VERNACULAR_NAME_INDEX
+from pytsammalex.commands import add_stats, print_stats
+
+
+def register(parser):
+    add_dataset(parser)
+    parser.add_argument(
+        '--workers',
+        help='Maximal number of concurrent requests to the GBIF API',
+        type=int,
+        default=8)
+    parser.add_argument(
+        '--chunk-size',
+        help='Number of results to fetch - and write to the cache - at once',
+        type=int,
+        default=200)
+    add_stats(parser)
+
+
+def warm(args, gbif, label, method, kws):
+    """
+    Fetch the results for `kws` which are not cached yet, reporting progress.
+
+    :return: `list` of (successfully) fetched results.
+    """
+    missing = gbif.cache.missing(method, kws)
+    args.log.info('{}: {} of {} already cached'.format(label, len(kws) - len(missing), len(kws)))
+    res, errors, start = [], 0, time.time()
+    for i in range(0, len(missing), args.chunk_size):
+        chunk = missing[i:i + args.chunk_size]
+        try:
+            res.extend(gbif.many(method, chunk, max_workers=args.workers))
+        except Exception as e:  # Successful requests are cached nonetheless.
+            errors += 1
+            args.log.warning('{}: {}'.format(label, e))
+        done = i + len(chunk)
+        args.log.info('{}: {}/{} fetched, {:.1f}/s'.format(
+            label, done, len(missing), done / max(time.time() - start, 1e-6)))
+    if errors:
+        args.log.warning('{}: {} chunks with errors'.format(label, errors))
+    return res
+
+
+def run(args):
+    ds = get_dataset(args)
+    keys, subspecies, seen = [], [], set()
+    for row in ds['ParameterTable']:
+        key = row.get('GBIF_ID')
+        if (not key) or key == '-' or key in seen:
+            continue
+        seen.add(key)
+        keys.append(key)
+        if (row.get('rank') or '').lower() == 'subspecies':
+            subspecies.append(key)
+
+    gbif = GBIF()
+    warm(args, gbif, 'usage', 'usage', [dict(key=key) for key in keys])
+    warm(args, gbif, 'vernacular names', VERNACULAR_NAME_INDEX, [dict(key=key) for key in keys])
+    if subspecies:
+        species_keys = []
+        for key in subspecies:
+            try:
+                res = gbif.usage(key=key)
+            except Exception as e:
+                args.log.warning('usage: {}'.format(e))
+                continue
+            if res.get('speciesKey') and res['speciesKey'] not in species_keys:
+                species_keys.append(res['speciesKey'])
+        warm(args, gbif,
+             'vernacular names of parent species',
+             VERNACULAR_NAME_INDEX,
+             [dict(key=key) for key in species_keys])
+    print_stats(args)
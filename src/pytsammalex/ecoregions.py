@@ -0,0 +1,697 @@
+"""
+A compact, precompiled representation of WWF's Terrestrial Ecoregions.
+
+Parsing the full GeoJSON of the ecoregions - all polygon coordinates - is slow and memory hungry.
+Thus, the GeoJSON is compiled once into
+
+- memory-mappable NumPy arrays of coordinates and of offsets of rings and polygons, and
+- a small JSON table of feature properties, sorted by `eco_code`,
+
+which can be read lazily, one feature at a time:
+
+.. code-block:: python
+
+    >>> ecoregions = Ecoregions.load()
+    >>> for eco_code, features in ecoregions.groupby():
+    ...     print(eco_code, [f.geometry['type'] for f in features])
+
+For maps at low zoom levels, simplified geometries can be computed with `Feature.simplified`.
+Map tiles can be cut from the geometries with `clip`, with the features intersecting a tile looked
+up in a `GridIndex` of their bounding boxes.
+
+Points - e.g. GBIF occurrences - can be assigned to ecoregions in bulk with `EcoregionLookup`:
+
+.. code-block:: python
+
+    >>> lookup = EcoregionLookup.from_ecoregions(Ecoregions.load())
+    >>> lookup.lookup([-1.5, 40.0], [30.2, -100.0])
+    array(['AT0711', None], dtype=object)
+"""
+import json
+import math
+import array
+import pathlib
+import itertools
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+from appdirs import user_cache_dir
+from clldutils import jsonlib
+
+import pytsammalex
+
+__all__ = ['Ecoregions', 'EcoregionLookup', 'GridIndex', 'area_centroid']
+
+FORMAT_VERSION = 1
+ARRAYS = ['coords', 'rings', 'polygons']
+# Zoom levels of web maps for which simplified geometries are precomputed.
+ZOOM_LEVELS = [2, 4, 6]
+# Position of the reference points within the cells of the grid of an `EcoregionLookup`.
+REFERENCE = (0.4987213, 0.5012787)
+
+
+def default_geojson():
+    return pathlib.Path(pytsammalex.__file__).parent / 'ecoregions.json'
+
+
+def default_dir(geojson):
+    """
+    The artifact is cached next to the GeoJSON, if possible, otherwise in the user cache dir.
+    """
+    d = geojson.parent / 'ecoregions_compiled'
+    if d.exists() or _writable(geojson.parent):
+        return d
+    return pathlib.Path(user_cache_dir(appname=pytsammalex.__name__)) / 'ecoregions_compiled'
+
+
+def _writable(d):
+    try:
+        d.joinpath('.write_test').touch()
+        d.joinpath('.write_test').unlink()
+        return True
+    except OSError:
+        return False
+
+
+def _source(geojson):
+    stat = geojson.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def tolerance(zoom):
+    """
+    Size in degrees of a pixel at the equator, for map tiles of 256 pixels at `zoom`.
+    """
+    return 360 / (256 * 2 ** zoom)
+
+
+def zoom_level(zoom):
+    """
+    :return: The zoom level of the precomputed simplified geometries suitable for a map at \
+    `zoom`, or `None` if full resolution is needed.
+    """
+    for level in ZOOM_LEVELS:
+        if zoom <= level:
+            return level
+
+
+def simplify_ring(ring, tolerance):
+    """
+    Simplify a ring with the Douglas-Peucker algorithm.
+
+    :param ring: `(n, 2)` array of coordinates.
+    :param tolerance: Maximal distance - in degrees - of removed vertices from the simplified ring.
+    :return: `(m, 2)` array of the retained coordinates.
+    """
+    ring = np.asarray(ring, dtype=np.float64)
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        segment, points = ring[j] - ring[i], ring[i + 1:j] - ring[i]
+        length = np.hypot(*segment)
+        if length == 0:
+            # Closed rings start and end with the same vertex.
+            dist = np.hypot(points[:, 0], points[:, 1])
+        else:
+            dist = np.abs(segment[0] * points[:, 1] - segment[1] * points[:, 0]) / length
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            keep[i + 1 + k] = True
+            stack.extend([(i, i + 1 + k), (i + 1 + k, j)])
+    return ring[keep]
+
+
+def simplify(polygons, tolerance):
+    """
+    Simplify polygons - dropping rings which collapse - and quantise the coordinates.
+
+    :param polygons: `list` of polygons, each a `list` of rings, the exterior ring first.
+    :return: GeoJSON geometry or `None`, if all polygons collapsed.
+    """
+    # Coordinates are rounded to a tenth of the tolerance.
+    decimals = max(0, int(math.ceil(-math.log10(tolerance / 10))))
+    res = []
+    for polygon in polygons:
+        rings = [simplify_ring(ring, tolerance) for ring in polygon]
+        # A ring needs at least three distinct vertices - and must be closed.
+        if len(rings[0]) < 4:
+            continue
+        res.append([np.round(ring, decimals).tolist() for ring in rings if len(ring) >= 4])
+    if not res:
+        return None
+    if len(res) == 1:
+        return {'type': 'Polygon', 'coordinates': res[0]}
+    return {'type': 'MultiPolygon', 'coordinates': res}
+
+
+def ring_moments(coords, offsets):
+    """
+    Signed areas and centroids of a batch of rings, computed with the shoelace formula.
+
+    :param coords: `(n, 2)` array of the coordinates of all rings, stored contiguously.
+    :param offsets: Array of offsets of the rings in `coords`, followed by `n`.
+    :return: Pair (`(m,)` array of signed areas, `(m, 2)` array of centroids) for the `m` rings.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    # Shifting coordinates to the first vertex reduces rounding errors for small rings:
+    origin = coords[0]
+    x, y = (coords[:, 0] - origin[0]), (coords[:, 1] - origin[1])
+    # Cross products of consecutive vertices - with the edge from the last vertex of a ring back to
+    # its first vertex replacing the (meaningless) edge to the first vertex of the next ring.
+    nxt = np.arange(1, len(x) + 1)
+    nxt[ends - 1] = starts
+    cross = x * y[nxt] - x[nxt] * y
+    sums = np.add.reduceat(
+        np.stack([cross, (x + x[nxt]) * cross, (y + y[nxt]) * cross], axis=1), starts)
+    areas = sums[:, 0] / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroids = sums[:, 1:] / (6 * areas[:, None])
+    return areas, centroids + origin
+
+
+def area_centroid(polygons):
+    """
+    Area and area-weighted centroid of a set of polygons, with holes subtracted.
+
+    Coordinates are treated as planar, i.e. areas are in square degrees. Polygons spanning more
+    than 180° of longitude are assumed to cross the antimeridian - e.g. an ecoregion split into
+    parts at 180° - and are shifted east of it for the computation.
+
+    :param polygons: Iterable of polygons, each a `list` of rings - sequences of `(lon, lat)` \
+    pairs - with the exterior ring first.
+    :return: Pair (area, `(lon, lat)` centroid) - with centroid `(None, None)` for no polygons.
+    """
+    rings, signs = [], []
+    for polygon in polygons:
+        for i, ring in enumerate(polygon):
+            if len(ring):
+                rings.append(np.asarray(ring, dtype=np.float64))
+                signs.append(-1 if i else 1)
+    if not rings:
+        return 0.0, (None, None)
+    coords = np.concatenate(rings)
+    if coords[:, 0].max() - coords[:, 0].min() > 180:
+        coords[:, 0] = np.where(coords[:, 0] < 0, coords[:, 0] + 360, coords[:, 0])
+
+    def normalized(centroid):
+        lon, lat = (float(c) for c in centroid)
+        return (lon + 180) % 360 - 180 if lon > 180 else lon, lat
+
+    areas, centroids = ring_moments(coords, np.cumsum([0] + [len(r) for r in rings]))
+    weights = np.array(signs) * np.abs(areas)
+    area = weights.sum()
+    if area <= 0:
+        # Degenerate polygons: Fall back to the mean of the vertices.
+        return 0.0, normalized(coords.mean(axis=0))
+    # Degenerate rings - with undefined centroid - have weight 0:
+    centroids = np.nan_to_num(centroids)
+    return float(area), normalized((centroids * weights[:, None]).sum(axis=0) / area)
+
+
+def tile_bbox(z, x, y, buffer=0):
+    """
+    Bounding box of Web Mercator map tile `z/x/y`.
+
+    :param buffer: Number of pixels (of 256 pixel tiles) by which to extend the box.
+    :return: `(west, south, east, north)` in degrees.
+    """
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / 2 ** z))))
+
+    n, pad = 2 ** z, buffer / 256
+    return (
+        (x - pad) / n * 360 - 180,
+        max(lat(y + 1 + pad), -90),
+        (x + 1 + pad) / n * 360 - 180,
+        min(lat(y - pad), 90))
+
+
+def geometry_bbox(geometry):
+    """
+    :param geometry: GeoJSON `Polygon` or `MultiPolygon`.
+    :return: `[west, south, east, north]` bounding box of the geometry.
+    """
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    # Holes lie within exterior rings, so the latter suffice:
+    coords = np.concatenate([np.asarray(polygon[0], dtype=np.float64) for polygon in polygons])
+    return coords.min(axis=0).tolist() + coords.max(axis=0).tolist()
+
+
+def intersects(bboxes, bbox):
+    """
+    :param bboxes: `(n, 4)` array of bounding boxes.
+    :return: Boolean `(n,)` array, marking the boxes intersecting `bbox`.
+    """
+    return (bboxes[:, 0] <= bbox[2]) & (bboxes[:, 2] >= bbox[0]) \
+        & (bboxes[:, 1] <= bbox[3]) & (bboxes[:, 3] >= bbox[1])
+
+
+def clip_ring(ring, bbox):
+    """
+    Clip a ring to a bounding box with the Sutherland-Hodgman algorithm.
+
+    Parts of concave rings which are separated by clipping stay connected by edges running along
+    the border of the box - which is invisible, if the box is a buffered map tile.
+
+    :param ring: `(n, 2)` array of coordinates of a closed ring.
+    :param bbox: `(west, south, east, north)`.
+    :return: `(m, 2)` array of coordinates of the closed, clipped ring or `None`, if nothing is \
+    left.
+    """
+    ring = np.asarray(ring, dtype=np.float64)
+    lower, upper = ring.min(axis=0), ring.max(axis=0)
+    if lower[0] >= bbox[0] and lower[1] >= bbox[1] and upper[0] <= bbox[2] \
+            and upper[1] <= bbox[3]:
+        return ring
+    if not intersects(np.concatenate([lower, upper])[None, :], bbox)[0]:
+        return None
+    if len(ring) > 1 and (ring[0] == ring[-1]).all():
+        ring = ring[:-1]
+    # Clip against the west, east, south and north border in turn:
+    for axis, bound, sign in [
+            (0, bbox[0], 1), (0, bbox[2], -1), (1, bbox[1], 1), (1, bbox[3], -1)]:
+        if not len(ring):
+            break
+        start, end = ring, np.roll(ring, -1, axis=0)
+        inside = (start[:, axis] - bound) * sign >= 0
+        crossing = inside != ((end[:, axis] - bound) * sign >= 0)
+        # Each edge contributes its start vertex - if inside - and the intersection with the clip
+        # line - if crossing:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (bound - start[:, axis]) / (end[:, axis] - start[:, axis])
+            intersection = start + t[:, None] * (end - start)
+        intersection[:, axis] = bound
+        ring = np.stack([start, intersection], axis=1).reshape(-1, 2)[
+            np.stack([inside, crossing], axis=1).reshape(-1)]
+    if len(ring) < 3:
+        return None
+    return np.concatenate([ring, ring[:1]])
+
+
+def clip(geometry, bbox):
+    """
+    Clip a GeoJSON `Polygon` or `MultiPolygon` to a bounding box.
+
+    :return: GeoJSON geometry or `None`, if nothing is left.
+    """
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    res = []
+    for polygon in polygons:
+        exterior = clip_ring(polygon[0], bbox)
+        if exterior is None:
+            continue
+        holes = [clip_ring(ring, bbox) for ring in polygon[1:]]
+        res.append([ring.tolist() for ring in [exterior] + holes if ring is not None])
+    if not res:
+        return None
+    if len(res) == 1:
+        return {'type': 'Polygon', 'coordinates': res[0]}
+    return {'type': 'MultiPolygon', 'coordinates': res}
+
+
+def grid_cells(cell, lon, lat):
+    """
+    :param cell: Size of the cells of a regular lon/lat grid in degrees.
+    :return: Pair of arrays of column and row numbers of the grid cells containing the points - \
+    with points outside the valid coordinate range assigned to the closest cell.
+    """
+    ncols, nrows = int(math.ceil(360 / cell)), int(math.ceil(180 / cell))
+    cols = np.clip(np.floor((np.asarray(lon, dtype=np.float64) + 180) / cell), 0, ncols - 1)
+    rows = np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90) / cell), 0, nrows - 1)
+    return cols.astype(np.int64), rows.astype(np.int64)
+
+
+def _expand(counts):
+    """
+    :param counts: Array of non-negative integers.
+    :return: Pair of arrays `(i, j)`, enumerating `j in range(counts[i])` for each `i`.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    i = np.repeat(np.arange(len(counts)), counts)
+    return i, np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class GridIndex:
+    """
+    A spatial index of bounding boxes, assigning each box to the cells of a regular lon/lat grid
+    it intersects.
+
+    :param bboxes: `(n, 4)` array-like of `(west, south, east, north)` bounding boxes.
+    :param cell: Size of the grid cells in degrees.
+    """
+    def __init__(self, bboxes, cell=5):
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.cell = cell
+        self.ncols, self.nrows = int(math.ceil(360 / cell)), int(math.ceil(180 / cell))
+        cols, rows = grid_cells(cell, self.bboxes[:, [0, 2]], self.bboxes[:, [1, 3]])
+        cells, items = [], []
+        for i, (c0, c1, r0, r1) in enumerate(np.concatenate([cols, rows], axis=1).tolist()):
+            for r in range(r0, r1 + 1):
+                cells.extend(range(r * self.ncols + c0, r * self.ncols + c1 + 1))
+                items.extend([i] * (c1 - c0 + 1))
+        # The item lists of all cells, stored contiguously, sorted by cell:
+        cells, items = np.array(cells, dtype=np.int64), np.array(items, dtype=np.int64)
+        order = np.argsort(cells, kind='stable')
+        self.items = items[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.ncols * self.nrows + 1))
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def query(self, bbox):
+        """
+        :return: Sorted array of the indices of the boxes intersecting `bbox`.
+        """
+        (c0, c1), (r0, r1) = grid_cells(self.cell, [bbox[0], bbox[2]], [bbox[1], bbox[3]])
+        candidates = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            self.items[self.offsets[r * self.ncols + c0]:self.offsets[r * self.ncols + c1 + 1]]
+            for r in range(r0, r1 + 1)]))
+        return candidates[intersects(self.bboxes[candidates], bbox)]
+
+
+class EcoregionLookup:
+    """
+    Batch lookup of the ecoregions containing points.
+
+    The polygons are indexed on a regular lon/lat grid. For each grid cell, the index stores the
+    polygon edges passing through the cell and, for each polygon, whether the centre of the cell
+    lies inside it. Thus, testing a point only involves the edges in its cell: The point lies inside
+    a polygon if the centre does - unless a path from the centre to the point - horizontally, then
+    vertically - crosses an odd number of the polygon's edges. (To make coincidences with vertices
+    and edges of polygons - often with rounded coordinates - unlikely, the reference points are
+    offset slightly from the centres of the cells.)
+
+    :param coords: `(n, 2)` array of `(lon, lat)` coordinates of all rings.
+    :param rings: Array of offsets of the rings in `coords`, followed by `n`.
+    :param polygons: Array of offsets of the polygons in `rings`, followed by the number of rings.
+    :param codes: `eco_code` for each polygon.
+    :param cell: Size of the grid cells in degrees.
+    """
+    def __init__(self, coords, rings, polygons, codes, cell=0.5):
+        self.cell = cell
+        self.ncols, self.nrows = int(math.ceil(360 / cell)), int(math.ceil(180 / cell))
+        self.codes = np.array(list(codes) + [None], dtype=object)
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        rings, polygons = np.asarray(rings, dtype=np.int64), np.asarray(polygons, dtype=np.int64)
+        npolygons = len(polygons) - 1
+
+        # The edges of the rings - with the edge from the last vertex back to the first:
+        nxt = np.arange(1, len(coords) + 1)
+        nonempty = np.diff(rings) > 0
+        nxt[rings[1:][nonempty] - 1] = rings[:-1][nonempty]
+        edges = np.concatenate([coords, coords[nxt]], axis=1)
+        polygon = np.repeat(np.repeat(np.arange(npolygons), np.diff(polygons)), np.diff(rings))
+        keep = (edges[:, 0] != edges[:, 2]) | (edges[:, 1] != edges[:, 3])
+        edges, polygon = edges[keep], polygon[keep]
+
+        # Assign the edges to the cells their bounding boxes intersect:
+        c0, r0 = grid_cells(
+            cell, np.minimum(edges[:, 0], edges[:, 2]), np.minimum(edges[:, 1], edges[:, 3]))
+        c1, r1 = grid_cells(
+            cell, np.maximum(edges[:, 0], edges[:, 2]), np.maximum(edges[:, 1], edges[:, 3]))
+        i, j = _expand((c1 - c0 + 1) * (r1 - r0 + 1))
+        width = c1[i] - c0[i] + 1
+        edge_keys = ((r0[i] + j // width) * self.ncols + c0[i] + j % width) * npolygons \
+            + polygon[i]
+        order = np.argsort(edge_keys, kind='stable')
+        edge_keys, self.edges = edge_keys[order], edges[i[order]]
+
+        # Determine the cells with centres inside polygons, row by row, from the crossings of the
+        # edges with the horizontal lines through the centres:
+        ymin = np.minimum(edges[:, 1], edges[:, 3])
+        ymax = np.maximum(edges[:, 1], edges[:, 3])
+        ra = np.clip(np.ceil((ymin + 90) / cell - REFERENCE[1]), 0, self.nrows).astype(np.int64)
+        rb = np.clip(np.ceil((ymax + 90) / cell - REFERENCE[1]), 0, self.nrows).astype(np.int64)
+        i, j = _expand(np.maximum(rb - ra, 0))
+        row = ra[i] + j
+        x0, y0, x1, y1 = edges[i].T
+        x = x0 + (self._centre_lat(row) - y0) * (x1 - x0) / (y1 - y0)
+        order = np.lexsort((x, row, polygon[i]))
+        # With closed rings, crossings come in pairs, entering and leaving a polygon:
+        x, row, p = x[order], row[order][::2], polygon[i][order][::2]
+        ca, cb = [
+            np.clip(np.floor((xs + 180) / cell - REFERENCE[0]) + 1, 0, self.ncols).astype(np.int64)
+            for xs in [x[::2], x[1::2]]]
+        i, j = _expand(np.maximum(cb - ca, 0))
+        inside_keys = (row[i] * self.ncols + ca[i] + j) * npolygons + p[i]
+
+        # A run for each pair of cell and polygon, with the polygon's edges in the cell:
+        keys = np.union1d(edge_keys, inside_keys)
+        self.run_polygon = keys % max(npolygons, 1)
+        self.run_inside = np.isin(keys, inside_keys)
+        self.run_edges = np.stack(
+            [np.searchsorted(edge_keys, keys), np.searchsorted(edge_keys, keys, side='right')])
+        self.cell_runs = np.searchsorted(
+            keys // max(npolygons, 1), np.arange(self.ncols * self.nrows + 1))
+
+    def _centre_lat(self, row):
+        return -90 + (row + REFERENCE[1]) * self.cell
+
+    def _centre_lon(self, col):
+        return -180 + (col + REFERENCE[0]) * self.cell
+
+    @classmethod
+    def from_ecoregions(cls, ecoregions=None, **kw):
+        """
+        :param ecoregions: `Ecoregions` instance; defaults to `Ecoregions.load()`.
+        """
+        ecoregions = ecoregions or Ecoregions.load()
+        polygons = ecoregions._array('polygons')
+        codes = np.empty(len(polygons) - 1, dtype=object)
+        for feature in ecoregions:
+            codes[slice(*feature._polygons)] = feature.properties['eco_code']
+        return cls(ecoregions._array('coords'), ecoregions._array('rings'), polygons, codes, **kw)
+
+    @classmethod
+    def from_models(cls, ecoregions, **kw):
+        """
+        :param ecoregions: Iterable of `pytsammalex.clld.models.Ecoregion` instances.
+        """
+        codes, geometries = [], []
+        for ecoregion in ecoregions:
+            codes.append(ecoregion.id)
+            geometries.append(ecoregion.jsondata['polygons'])
+        coords, rings, polygons, ranges = _pack(g for gs in geometries for g in gs)
+        polygon_codes, ranges = [], iter(ranges)
+        for code, gs in zip(codes, geometries):
+            for _ in gs:
+                start, end = next(ranges)
+                polygon_codes.extend([code] * (end - start))
+        return cls(np.frombuffer(coords, dtype=np.float64), rings, polygons, polygon_codes, **kw)
+
+    def lookup(self, lat, lon, chunksize=100000):
+        """
+        :param lat: Array-like of latitudes.
+        :param lon: Array-like of longitudes.
+        :param chunksize: Number of points processed at once - bounding the memory used.
+        :return: Array of the `eco_code`s of the ecoregions containing the points - `None` for \
+        points outside of all ecoregions.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        if lat.shape != lon.shape:
+            raise ValueError('lat and lon must have the same shape')
+        res = np.full(len(lat), -1, dtype=np.int64)
+        for i in range(0, len(lat), chunksize):
+            res[i:i + chunksize] = self._lookup(lat[i:i + chunksize], lon[i:i + chunksize])
+        return self.codes[res]
+
+    def _lookup(self, lat, lon):
+        """
+        :return: Array of the indices of the polygons containing the points - `-1` for none.
+        """
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        cols, rows = grid_cells(self.cell, np.where(valid, lon, 0), np.where(valid, lat, 0))
+        cells = rows * self.ncols + cols
+        starts = self.cell_runs[cells]
+        point, j = _expand(np.where(valid, self.cell_runs[cells + 1] - starts, 0))
+        run = starts[point] + j
+        estarts, eends = self.run_edges[:, run]
+        pair, j = _expand(eends - estarts)
+        x0, y0, x1, y1 = self.edges[estarts[pair] + j].T
+        pair_point = point[pair]
+        px, py = lon[pair_point], lat[pair_point]
+        cx, cy = self._centre_lon(cols[pair_point]), self._centre_lat(rows[pair_point])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Crossings of the horizontal path from the centre ...
+            ix = x0 + (cy - y0) * (x1 - x0) / (y1 - y0)
+            crossings = ((y0 <= cy) != (y1 <= cy)) \
+                & (ix >= np.minimum(cx, px)) & (ix < np.maximum(cx, px))
+            # ... and of the vertical path to the point:
+            iy = y0 + (px - x0) * (y1 - y0) / (x1 - x0)
+            crossings = crossings.astype(np.int64) + (
+                ((x0 < px) != (x1 < px)) & (iy >= np.minimum(cy, py)) & (iy < np.maximum(cy, py)))
+        counts = np.concatenate([[0], np.cumsum(crossings)])
+        bounds = np.concatenate([[0], np.cumsum(eends - estarts)])
+        inside = self.run_inside[run] ^ ((counts[bounds[1:]] - counts[bounds[:-1]]) % 2 == 1)
+        res = np.full(len(lat), -1, dtype=np.int64)
+        # If polygons overlap, the first one wins:
+        res[point[inside][::-1]] = self.run_polygon[run[inside]][::-1]
+        return res
+
+
+class Feature:
+    """
+    An ecoregion feature, with geometry read from the memory-mapped arrays on access.
+    """
+    def __init__(self, ecoregions, properties, type, polygons):
+        self._ecoregions = ecoregions
+        self.properties = properties
+        self.type = type
+        self._polygons = polygons
+
+    def polygons(self):
+        """
+        :return: `list` of polygons, each a `list` of rings as `(n, 2)` arrays of coordinates - \
+        the first ring being the exterior ring.
+        """
+        return [self._ecoregions.rings(i) for i in range(*self._polygons)]
+
+    @property
+    def geometry(self):
+        """
+        The GeoJSON geometry of the feature.
+        """
+        if self.type is None:
+            return None
+        coordinates = [[ring.tolist() for ring in polygon] for polygon in self.polygons()]
+        if self.type == 'Polygon':
+            coordinates = coordinates[0]
+        return {'type': self.type, 'coordinates': coordinates}
+
+    def simplified(self, zoom):
+        """
+        The GeoJSON geometry of the feature, simplified for maps at `zoom`.
+        """
+        if self.type is None:
+            return None
+        return simplify(self.polygons(), tolerance(zoom))
+
+
+def _pack(geometries):
+    """
+    Pack the coordinates of GeoJSON geometries into flat arrays.
+
+    :return: Quadruple (`array` of coordinates, `list` of ring offsets, `list` of polygon offsets, \
+    `list` of ranges of polygon numbers per geometry).
+    """
+    coords, rings, polygons, ranges = array.array('d'), [0], [0], []
+    for geom in geometries:
+        start = len(polygons) - 1
+        if geom:
+            for polygon in (
+                    [geom['coordinates']] if geom['type'] == 'Polygon' else geom['coordinates']):
+                for ring in polygon:
+                    for lon, lat in ring:
+                        coords.append(lon)
+                        coords.append(lat)
+                    rings.append(len(coords) // 2)
+                polygons.append(len(rings) - 1)
+        ranges.append((start, len(polygons) - 1))
+    return coords, rings, polygons, ranges
+
+
+class Ecoregions:
+    """
+    Read access to a compiled ecoregions artifact in directory `d`.
+    """
+    def __init__(self, d):
+        self.dir = pathlib.Path(d)
+        md = jsonlib.load(self.dir / 'features.json')
+        if md.get('version') != FORMAT_VERSION:
+            raise ValueError('Unsupported ecoregions format: {}'.format(self.dir))
+        self.source = md['source']
+        self._features = md['features']
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(str(self.dir / '{}.npy'.format(name)), mmap_mode='r')
+        return self._arrays[name]
+
+    def rings(self, polygon):
+        """
+        :return: `list` of rings of polygon number `polygon`.
+        """
+        coords, rings = self._array('coords'), self._array('rings')
+        start, end = self._array('polygons')[polygon:polygon + 2]
+        return [coords[rings[i]:rings[i + 1]] for i in range(start, end)]
+
+    def __len__(self):
+        return len(self._features)
+
+    def __iter__(self):
+        for f in self._features:
+            yield Feature(self, f['properties'], f['type'], f['polygons'])
+
+    def groupby(self):
+        """
+        :return: Generator of pairs (`eco_code`, `list` of `Feature`s).
+        """
+        return ((k, list(fs)) for k, fs in itertools.groupby(
+            self, lambda f: f.properties['eco_code']))
+
+    @classmethod
+    def compile(cls, geojson, d):
+        """
+        Compile the ecoregions GeoJSON into an artifact in directory `d`.
+        """
+        geojson, d = pathlib.Path(geojson), pathlib.Path(d)
+        with geojson.open(encoding='utf8') as fp:
+            features = json.load(fp)['features']
+        features.sort(key=lambda f: f['properties']['eco_code'])
+
+        coords, rings, polygons, ranges = _pack(f['geometry'] for f in features)
+        table = [
+            dict(
+                properties=f['properties'],
+                type=f['geometry']['type'] if f['geometry'] else None,
+                polygons=list(r))
+            for f, r in zip(features, ranges)]
+
+        if not d.exists():
+            d.mkdir(parents=True)
+        if d.joinpath('features.json').exists():
+            d.joinpath('features.json').unlink()
+        for name, arr in zip(ARRAYS, [
+            np.frombuffer(coords, dtype=np.float64).reshape(-1, 2),
+            np.array(rings, dtype=np.int64),
+            np.array(polygons, dtype=np.int64),
+        ]):
+            np.save(str(d / '{}.npy'.format(name)), arr)
+        # The properties table is written last, marking the artifact as complete:
+        jsonlib.dump(
+            dict(version=FORMAT_VERSION, source=_source(geojson), features=table),
+            d / 'features.json')
+        return cls(d)
+
+    @classmethod
+    def load(cls, geojson=None, d=None):
+        """
+        Load the compiled ecoregions, (re-)compiling them if the artifact is missing or older than
+        the GeoJSON.
+
+        :param geojson: Path of the GeoJSON, defaulting to `ecoregions.json` in the package.
+        :param d: Directory of the artifact, defaulting to `default_dir(geojson)`.
+        """
+        geojson = pathlib.Path(geojson) if geojson else default_geojson()
+        d = pathlib.Path(d) if d else default_dir(geojson)
+        if d.joinpath('features.json').exists():
+            try:
+                res = cls(d)
+            except ValueError:  # Artifact in an outdated format.
+                res = None
+            if res is not None and ((not geojson.exists()) or res.source == _source(geojson)):
+                return res
+        return cls.compile(geojson, d)
@@ -1,15 +1,28 @@
+import os
 import json
+import zlib
+import time
+import bisect
+import random
+import asyncio
 import logging
 import pathlib
 import sqlite3
+import threading
+import functools
 import contextlib
+import collections
+import email.utils
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from pygbif import species
 from appdirs import user_cache_dir
 
 import pytsammalex
 
-__all__ = ['RANKS', 'GBIF']
+__all__ = ['RANKS', 'GBIF', 'AsyncGBIF', 'LRU', 'Scheduler', 'Metrics', 'NotFound',
+           'CircuitOpen']
 
 RANKS = [
     'KINGDOM',
@@ -25,55 +38,1072 @@ RANKS = [
     None,
 ]
 
+DAY = 24 * 60 * 60
+# Default time-to-live (in seconds) of cached results, per GBIF API method. `None` means results
+# never expire.
+TTL = {
+    'suggest': 7 * DAY,
+    'lookup': 30 * DAY,
+    'usage': 365 * DAY,
+    'vernacularNameIndex': 90 * DAY,
+}
+
+# Time-to-live (in seconds) of cached negative results, i.e. of queries which failed with a client
+# error or returned no results.
+NEGATIVE_TTL = 7 * DAY
+
+# Time (in seconds) to wait for the lock on the cache database held by other processes.
+BUSY_TIMEOUT = 30
+
+# Pseudo-method for the index of all vernacular names of a taxon, computed by `GBIF` from all pages
+# of vernacular names in the API's usage data.
+VERNACULAR_NAME_INDEX = 'vernacularNameIndex'
+
+
+class NotFound(LookupError):
+    """
+    Raised by backends if no data is available for a query, and by `Cache` for cached negative
+    results.
+    """
+
+
+class CircuitOpen(RuntimeError):
+    """
+    Raised by `Scheduler` - without calling the API - while the GBIF API is deemed unavailable.
+    """
+
+
+def canonical_query(method, kw):
+    """
+    Normalize query parameters, so that equivalent queries share one cache entry.
+    """
+    res = {}
+    for k, v in kw.items():
+        if v is None:
+            continue
+        if isinstance(v, str):
+            v = ' '.join(v.split())
+            if k == 'key' and v.isdigit():
+                v = int(v)
+            elif k in ('q', 'name'):
+                v = v.lower()
+            elif k == 'rank':
+                v = v.upper()
+        res[k] = v
+    if method == 'usage' and res.get('data') == 'all':
+        del res['data']
+    return res
+
+
+def _is_negative(e):
+    """
+    Whether an exception signals a result which is worth caching, i.e. which will not go away by
+    retrying soon.
+    """
+    if isinstance(e, NotFound):
+        return True
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    # Timeouts and rate limiting are transient.
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def _is_empty(res):
+    return res == [] or (isinstance(res, dict) and res.get('results') == [])
+
+
+def _migrate_0(cu):
+    """
+    Create the `requests` table - if necessary - and de-duplicate rows from legacy cache files
+    before adding a unique index on `(method, query)`.
+    """
+    cu.execute("CREATE TABLE IF NOT EXISTS requests (method TEXT, query TEXT, result TEXT)")
+    cu.execute(
+        "DELETE FROM requests WHERE rowid NOT IN "
+        "(SELECT min(rowid) FROM requests GROUP BY method, query)")
+    cu.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS requests_method_query ON requests (method, query)")
+
+
+def _migrate_1(cu):
+    """
+    Add timestamps to support TTL expiry and LRU eviction.
+    """
+    now = time.time()
+    cu.execute("ALTER TABLE requests ADD COLUMN created REAL")
+    cu.execute("ALTER TABLE requests ADD COLUMN accessed REAL")
+    cu.execute("UPDATE requests SET created = ?, accessed = ?", (now, now))
+    cu.execute("CREATE INDEX IF NOT EXISTS requests_accessed ON requests (accessed)")
+
+
+def _migrate_2(cu):
+    """
+    Add a column recording the encoding of the result. Existing rows are plain JSON.
+    """
+    cu.execute("ALTER TABLE requests ADD COLUMN format INTEGER NOT NULL DEFAULT 0")
+
+
+def _migrate_3(cu):
+    """
+    Add columns to support negative caching and re-key cached results by canonical query.
+    """
+    cu.execute("ALTER TABLE requests ADD COLUMN negative INTEGER NOT NULL DEFAULT 0")
+    cu.execute("ALTER TABLE requests ADD COLUMN error TEXT")
+    for rowid, method, query in cu.execute(
+            "SELECT rowid, method, query FROM requests").fetchall():
+        canonical = Cache.query(**canonical_query(method, dict(json.loads(query))))
+        if canonical != query:
+            cu.execute(
+                "UPDATE OR IGNORE requests SET query = ? WHERE rowid = ?", (canonical, rowid))
+            if not cu.rowcount:  # There's already a row for the canonical query.
+                cu.execute("DELETE FROM requests WHERE rowid = ?", (rowid,))
+
+
+# Schema migrations, applied in order. The number of migrations already applied to a cache file is
+# stored as `PRAGMA user_version`.
+MIGRATIONS = [
+    _migrate_0,
+    _migrate_1,
+    _migrate_2,
+    _migrate_3,
+]
+
+# Encodings of cached results:
+FORMAT_JSON = 0  # JSON text
+FORMAT_ZLIB = 1  # zlib-compressed, compact JSON
+
+
+def _encode(obj, fmt):
+    if fmt == FORMAT_ZLIB:
+        return zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf8'))
+    return json.dumps(obj)
+
+
+def _decode(data, fmt):
+    if fmt == FORMAT_ZLIB:
+        return json.loads(zlib.decompress(data).decode('utf8'))
+    return json.loads(data)
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _connect(dbpath):
+    """
+    Return a connection to the cache database at `dbpath` and a lock to serialize access to it.
+
+    Connections are shared between all `Cache` instances of a process and are only opened - and the
+    schema migrated - once per database file.
+    """
+    key = (os.getpid(), str(dbpath))
+    with _connections_lock:
+        if key not in _connections:
+            conn = sqlite3.connect(
+                str(dbpath), check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < len(MIGRATIONS):
+                cu = conn.cursor()
+                cu.execute('BEGIN IMMEDIATE')
+                try:
+                    for migration in MIGRATIONS[version:]:
+                        migration(cu)
+                    cu.execute('PRAGMA user_version = {}'.format(len(MIGRATIONS)))
+                    cu.execute('COMMIT')
+                except Exception:  # pragma: no cover
+                    cu.execute('ROLLBACK')
+                    raise
+            _connections[key] = (conn, threading.RLock())
+        return _connections[key]
+
+
+def _disconnect(dbpath):
+    with _connections_lock:
+        conn = _connections.pop((os.getpid(), str(dbpath)), None)
+        if conn:
+            conn[0].close()
+
+
+class Metrics:
+    """
+    Counters, byte counts and latency histograms of GBIF data access, per method.
+
+    Recorded events are
+
+    - `memory_hit`, `hit`, `negative_hit` and `miss` for lookups in the in-memory and persistent \
+      cache,
+    - `request` and `error` for (successful or failed) requests to the backend, and
+    - `write` for results written to the persistent cache.
+
+    Hooks - callables accepting arguments `(event, method, latency, nbytes)` - registered with \
+    `Metrics.add_hook` are called for each event.
+    """
+    # Upper bounds of the buckets of latency histograms, in seconds.
+    BUCKETS = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+        float('inf'))
 
-class Cache:
     def __init__(self):
-        d = pathlib.Path(user_cache_dir(appname=pytsammalex.__name__))
-        if not d.exists():
-            d.mkdir(parents=True)
-        self.dbpath = d / 'gbif.sqlite'
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = collections.Counter()
+            self.bytes = collections.Counter()
+            self.latency = collections.Counter()
+            self.histograms = {}
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def record(self, event, method, latency=None, nbytes=0):
+        key = (event, method)
+        with self._lock:
+            self.counts[key] += 1
+            self.bytes[key] += nbytes
+            if latency is not None:
+                self.latency[key] += latency
+                hist = self.histograms.setdefault(key, [0] * len(self.BUCKETS))
+                hist[bisect.bisect_left(self.BUCKETS, latency)] += 1
+        for hook in self.hooks:
+            hook(event, method, latency, nbytes)
+
+    def timed(self, method, func):
+        """
+        Wrap `func`, recording calls as `request` or `error` events.
+        """
+        def wrapped(*args, **kw):
+            start = time.perf_counter()
+            try:
+                res = func(*args, **kw)
+            except Exception:
+                self.record('error', method, latency=time.perf_counter() - start)
+                raise
+            self.record('request', method, latency=time.perf_counter() - start)
+            return res
+        return wrapped
+
+    def quantile(self, event, method, q):
+        """
+        Upper bound of the histogram bucket containing the `q`-quantile of the latency.
+        """
+        hist = self.histograms.get((event, method))
+        if not hist:
+            return None
+        total, n = sum(hist), 0
+        for bound, count in zip(self.BUCKETS, hist):
+            n += count
+            if n >= q * total:
+                return bound
+
+    def summary(self):
+        """
+        :return: `list` of `dict`s with counts, bytes and latencies (in milliseconds) per method.
+        """
+        res = []
+        for method in sorted(set(m for _, m in self.counts)):
+            requests_ = self.counts['request', method]
+            p95 = self.quantile('request', method, 0.95)
+            res.append(collections.OrderedDict([
+                ('method', method),
+                ('memory_hits', self.counts['memory_hit', method]),
+                ('hits', self.counts['hit', method] + self.counts['negative_hit', method]),
+                ('misses', self.counts['miss', method]),
+                ('requests', requests_),
+                ('errors', self.counts['error', method]),
+                ('bytes_read', self.bytes['hit', method]),
+                ('bytes_written', self.bytes['write', method]),
+                ('mean_ms', round(1000 * self.latency['request', method] / requests_, 1)
+                    if requests_ else None),
+                ('p95_ms', round(1000 * p95, 1) if p95 not in (None, float('inf')) else p95),
+            ]))
+        return res
+
+
+# The metrics recorded by `Cache` and `GBIF` instances by default.
+METRICS = Metrics()
+
+
+def ordered_map(func, iterable, max_workers=8, window=None):
+    """
+    Like `map`, but calling `func` concurrently in a thread pool, while reading at most `window`
+    items of `iterable` ahead. Results are yielded in input order as soon as they are available.
+    """
+    window = window or 2 * max_workers
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key, func):
+    """
+    Call `func` - unless a call for the same `key` is already in flight, in which case we wait for
+    and return (a copy of) its result.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return _copy(flight.result)
+    try:
+        flight.result = func()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result
+
+
+class Cache:
+    """
+    A SQLite-backed cache of GBIF API responses.
+
+    :param dbpath: Path of the SQLite database file; defaults to `gbif.sqlite` in the user cache \
+    directory.
+    :param ttl: `dict` mapping method names to time-to-live in seconds, updating `TTL`.
+    :param max_size: Maximal size of the cache in bytes. If exceeded, the least recently accessed \
+    results are evicted.
+    :param compress: Flag signaling whether to store new results compressed. Results in either \
+    format are read transparently.
+    :param negative_ttl: Time-to-live in seconds of negative results, i.e. of queries which \
+    failed with a client error - raised as `NotFound` when read from the cache - or returned no \
+    results.
+    :param metrics: `Metrics` instance; defaults to `METRICS`.
+    """
+    def __init__(
+            self,
+            dbpath=None,
+            ttl=None,
+            max_size=None,
+            compress=True,
+            negative_ttl=NEGATIVE_TTL,
+            metrics=None):
+        if dbpath is None:
+            d = pathlib.Path(user_cache_dir(appname=pytsammalex.__name__))
+            if not d.exists():
+                d.mkdir(parents=True)
+            dbpath = d / 'gbif.sqlite'
+        self.dbpath = pathlib.Path(dbpath)
+        self.ttl = dict(TTL, **(ttl or {}))
+        self.max_size = max_size
+        self.format = FORMAT_ZLIB if compress else FORMAT_JSON
+        self.negative_ttl = negative_ttl
+        self.metrics = METRICS if metrics is None else metrics
 
     def __enter__(self):
-        with self.cursor() as cu:
-            cu.execute(
-                "CREATE TABLE IF NOT EXISTS requests (method TEXT, query TEXT, result TEXT);")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
     @contextlib.contextmanager
-    def cursor(self):
-        with contextlib.closing(sqlite3.connect(str(self.dbpath))) as conn:
-            yield conn.cursor()
-            conn.commit()
+    def cursor(self, write=True):
+        """
+        Context manager yielding a cursor on the shared connection, with the `with` block run as
+        one transaction.
+
+        :param write: Flag signaling whether the transaction may write - reading cached results \
+        does, too, updating their access time. Such transactions acquire the write lock upfront, \
+        because upgrading a read transaction fails if another process wrote in the meantime.
+        """
+        conn, lock = _connect(self.dbpath)
+        with lock:
+            cu = conn.cursor()
+            cu.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield cu
+            except Exception:
+                cu.execute('ROLLBACK')
+                raise
+            else:
+                cu.execute('COMMIT')
+            finally:
+                cu.close()
+
+    def close(self):
+        _disconnect(self.dbpath)
+
+    def clear(self):
+        self.close()
+        for suffix in ['', '-wal', '-shm']:
+            p = self.dbpath.parent / (self.dbpath.name + suffix)
+            if p.exists():
+                p.unlink()
+
+    def expired(self, method, created, now=None, negative=False):
+        ttl = self.ttl.get(method)
+        if negative and self.negative_ttl is not None:
+            ttl = self.negative_ttl if ttl is None else min(ttl, self.negative_ttl)
+        if ttl is None or created is None:
+            return False
+        return created + ttl < (now or time.time())
+
+    @staticmethod
+    def _size(cu):
+        """
+        Number of bytes used by the database, i.e. not counting pages on the freelist.
+        """
+        page_size, page_count, freelist_count = [
+            cu.execute('PRAGMA ' + pragma).fetchone()[0]
+            for pragma in ['page_size', 'page_count', 'freelist_count']]
+        return (page_count - freelist_count) * page_size
+
+    def _evict(self, cu):
+        """
+        Delete the least recently accessed results until the cache fits into `max_size`.
+        """
+        n = 0
+        while self.max_size and self._size(cu) > self.max_size:
+            count = cu.execute("select count(*) from requests").fetchone()[0]
+            if not count:
+                break
+            cu.execute(
+                "delete from requests where rowid in "
+                "(select rowid from requests order by accessed limit ?)",
+                (max(1, count // 10),))
+            n += cu.rowcount
+        return n
+
+    @staticmethod
+    def query(**kw):
+        return json.dumps(list(sorted(kw.items())))
+
+    def _read(self, cu, method, query, now, record=True, stale=False):
+        """
+        :param stale: Flag signaling whether to return expired results, too.
+        :return: The cached result, a `NotFound` instance for a cached error or `None`.
+        """
+        start = time.perf_counter()
+        cu.execute(
+            "select rowid, result, created, format, negative, error from requests "
+            "where method = ? and query = ?",
+            (method, query))
+        res = cu.fetchone()
+        if res and (stale or not self.expired(method, res[2], now, negative=res[4])):
+            cu.execute("update requests set accessed = ? where rowid = ?", (now, res[0]))
+            logging.getLogger('tsammalex').debug('cache hit: {} {}'.format(method, query))
+            if res[5] is not None:
+                self.metrics.record('negative_hit', method)
+                return NotFound(res[5])
+            obj = _decode(res[1], res[3])
+            self.metrics.record(
+                'hit', method, latency=time.perf_counter() - start, nbytes=len(res[1]))
+            return obj
+        if record:
+            self.metrics.record('miss', method)
+
+    def _write(self, cu, method, query, res, now, error=None):
+        data = _encode(res, self.format)
+        self.metrics.record('write', method, nbytes=len(data))
+        cu.execute(
+            "insert or replace into requests "
+            "(method, query, result, created, accessed, format, negative, error) "
+            "values (?,?,?,?,?,?,?,?)",
+            (
+                method,
+                query,
+                data,
+                now,
+                now,
+                self.format,
+                error is not None or _is_empty(res),
+                error))
+
+    def _write_result(self, cu, method, query, res, now):
+        """
+        Cache `res` - a `NotFound` instance as negative result.
+        """
+        if isinstance(res, NotFound):
+            self._write(cu, method, query, None, now, error=str(res))
+        else:
+            self._write(cu, method, query, res, now)
 
     def get(self, method, **kw):
-        query = json.dumps(list(sorted(kw.items())))
+        kw = canonical_query(method, kw)
+        return self.compute(
+            method, functools.partial(getattr(species, 'name_' + method), **kw), **kw)
+
+    def compute(self, method, func, **kw):
+        """
+        Return the cached result for `method` and `kw`, calling `func()` to compute it if missing.
+
+        While the circuit of the scheduler is open, an expired result is returned if available.
+
+        :raises NotFound: If `func()` failed with a client error, now or within `negative_ttl`.
+        :raises CircuitOpen: If the API is unavailable and no result is cached.
+        """
+        query = self.query(**canonical_query(method, kw))
+        now = time.time()
         with self.cursor() as cu:
+            res = self._read(cu, method, query, now)
+        if res is None:
+            try:
+                # Concurrent requests for the same query are coalesced into one API call.
+                res = _single_flight(
+                    (str(self.dbpath), method, query),
+                    lambda: self._fetch(method, query, func, now))
+            except CircuitOpen:
+                with self.cursor() as cu:
+                    res = self._read(cu, method, query, now, record=False, stale=True)
+                if res is None:
+                    raise
+        if isinstance(res, NotFound):
+            raise res
+        return res
+
+    def _fetch(self, method, query, func, now, write=True):
+        """
+        The function run in flight for a missing result - by `compute` as well as by `get_many`.
+
+        :param write: Flag signaling whether to write the result to the cache.
+        :return: The result or a `NotFound` instance if `func()` failed with a client error.
+        :raises: Exceptions other than client errors raised by `func()`.
+        """
+        # Another thread may have written the result since we looked.
+        with self.cursor() as cu:
+            res = self._read(cu, method, query, now, record=False)
+        if res is None:
+            try:
+                res = self.metrics.timed(method, func)()
+            except Exception as e:
+                if not _is_negative(e):
+                    raise
+                res = NotFound('{}: {}'.format(e.__class__.__name__, e))
+            if write:
+                with self.cursor() as cu:
+                    self._write_result(cu, method, query, res, now)
+                    self._evict(cu)
+        return res
+
+    def missing(self, method, kws):
+        """
+        :param kws: `list` of `dict`s of keyword arguments for the GBIF API method.
+        :return: `list` of the items in `kws` for which no valid result is cached.
+        """
+        now = time.time()
+        res = []
+        with self.cursor(write=False) as cu:
+            for kw in kws:
+                cu.execute(
+                    "select created, negative from requests where method = ? and query = ?",
+                    (method, self.query(**canonical_query(method, kw))))
+                row = cu.fetchone()
+                if (not row) or self.expired(method, row[0], now, negative=row[1]):
+                    res.append(kw)
+        return res
+
+    def get_many(self, method, kws, max_workers=8, op=None):
+        """
+        Retrieve results for a batch of queries, fetching missing results concurrently.
+
+        :param kws: `list` of `dict`s of keyword arguments for the GBIF API method.
+        :param max_workers: Maximal number of concurrent requests to the GBIF API.
+        :param op: Function to compute missing results, defaults to the GBIF API method.
+        :return: `list` of results, in the order of `kws`.
+        :raises: The first error encountered - after caching all successfully retrieved results. \
+            While the API is unavailable, expired results are returned instead of `CircuitOpen`.
+        """
+        kws = [canonical_query(method, kw) for kw in kws]
+        queries = [self.query(**kw) for kw in kws]
+        now = time.time()
+        res = {}
+        with self.cursor() as cu:
+            for query in set(queries):
+                r = self._read(cu, method, query, now)
+                if r is not None:
+                    res[query] = r
+
+        missing = collections.OrderedDict((q, kw) for q, kw in zip(queries, kws) if q not in res)
+        if missing:
+            op = op or getattr(species, 'name_' + method)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        _single_flight,
+                        (str(self.dbpath), method, query),
+                        functools.partial(
+                            self._fetch,
+                            method,
+                            query,
+                            functools.partial(op, **kw),
+                            now,
+                            write=False))
+                    for query, kw in missing.items()]
+            error = None
+            # Results retrieved successfully - and negative results - are written to the cache, in
+            # one transaction, even if other requests failed.
+            with self.cursor() as cu:
+                for query, future in zip(missing, futures):
+                    if isinstance(future.exception(), CircuitOpen):
+                        # While the API is unavailable, expired results are served.
+                        stale = self._read(cu, method, query, now, record=False, stale=True)
+                        if stale is not None:
+                            res[query] = stale
+                            continue
+                    if future.exception():
+                        error = error or future.exception()
+                        continue
+                    res[query] = future.result()
+                    self._write_result(cu, method, query, res[query], now)
+                    if isinstance(res[query], NotFound):
+                        error = error or res[query]
+                self._evict(cu)
+            if error:
+                raise error
+        for query in queries:
+            if isinstance(res[query], NotFound):
+                raise res[query]
+        return [res[query] for query in queries]
+
+    def prune(self):
+        """
+        Delete expired results and evict results exceeding `max_size`.
+
+        :return: Number of deleted results.
+        """
+        n, now = 0, time.time()
+        with self.cursor() as cu:
+            for method, ttl in sorted(self.ttl.items()):
+                if ttl is not None:
+                    cu.execute(
+                        "delete from requests where method = ? and created < ?",
+                        (method, now - ttl))
+                    n += cu.rowcount
+            if self.negative_ttl is not None:
+                cu.execute(
+                    "delete from requests where negative and created < ?",
+                    (now - self.negative_ttl,))
+                n += cu.rowcount
+            n += self._evict(cu)
+        return n
+
+    def vacuum(self):
+        """
+        Rebuild the database file, returning unused space to the file system.
+        """
+        conn, lock = _connect(self.dbpath)
+        with lock:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def convert(self, batch_size=1000):
+        """
+        Re-encode all cached results which are not stored in the format of this cache.
+
+        :return: Number of converted results.
+        """
+        n = 0
+        while True:
+            with self.cursor() as cu:
+                cu.execute(
+                    "select rowid, result, format from requests where format != ? limit ?",
+                    (self.format, batch_size))
+                rows = cu.fetchall()
+                for rowid, result, fmt in rows:
+                    cu.execute(
+                        "update requests set result = ?, format = ? where rowid = ?",
+                        (_encode(_decode(result, fmt), self.format), self.format, rowid))
+            n += len(rows)
+            if len(rows) < batch_size:
+                return n
+
+    def stats(self):
+        """
+        :return: `list` of `dict`s with number of (negative) results, size in bytes and timestamps \
+        per method.
+        """
+        with self.cursor(write=False) as cu:
             cu.execute(
-                "select result from requests where method = ? and query = ?", (method, query))
-            res = cu.fetchone()
-            if res:
-                logging.getLogger('tsammalex').debug('cache hit: {} {}'.format(method, query))
-                return json.loads(res[0])
-            res = getattr(species, 'name_' + method)(**kw)
-            cu.execute(
-                "insert into requests (method, query, result) values (?,?,?)",
-                (method, query, json.dumps(res)))
-            return res
+                "select method, count(*), sum(negative), sum(length(result)), min(created), "
+                "max(accessed) from requests group by method order by method")
+            return [
+                dict(zip(
+                    ['method', 'results', 'negative', 'bytes', 'oldest', 'last_accessed'], row))
+                for row in cu.fetchall()]
+
+
+def _copy(obj):
+    """
+    Copy JSON data - much faster than `copy.deepcopy`.
+    """
+    if isinstance(obj, dict):
+        return {k: _copy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy(v) for v in obj]
+    return obj
+
+
+class LRU:
+    """
+    A bounded, thread-safe in-memory cache of decoded GBIF API responses.
+
+    Values are copied on read, so callers cannot corrupt the cached data.
+
+    :param max_entries: Maximal number of cached responses.
+    :param max_bytes: Maximal size of the cached responses, measured as length of their JSON \
+    serialization.
+    """
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return _copy(self._data[key][0])
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        size = len(json.dumps(value)) if self.max_bytes else 0
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self._data and (
+                    (self.max_entries and len(self._data) > self.max_entries)
+                    or (self.max_bytes and self.nbytes > self.max_bytes)):
+                self.nbytes -= self._data.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
+# The in-memory cache shared by `GBIF` instances by default.
+MEMORY = LRU()
+
+
+def _retry_after(e):
+    """
+    The delay in seconds requested by the server via a `Retry-After` header - if any.
+    """
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient(e):
+    """
+    Whether a failed request is worth retrying.
+    """
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status in (408, 429) or (status is not None and status >= 500)
+
+
+class Scheduler:
+    """
+    Schedules requests to the GBIF API to get the maximal sustainable throughput:
+
+    - A token bucket limits the request rate.
+    - Transient failures - connection errors, timeouts, HTTP 429 and 5xx - are retried with \
+      exponential backoff with full jitter, honouring `Retry-After` headers.
+    - The number of concurrent requests adapts - additive increase, multiplicative decrease - to \
+      transient failures.
+    - After `failure_threshold` consecutive transient failures, the circuit opens: requests fail \
+      right away with `CircuitOpen` - so `GBIF` can only answer from the cache - until a trial \
+      request after `reset_timeout` seconds succeeds.
+
+    :param rate: Maximal number of requests per second.
+    :param burst: Maximal number of requests sent at once, after idling.
+    :param max_concurrency: Maximal number of concurrent requests.
+    """
+    def __init__(
+            self,
+            rate=10.0,
+            burst=None,
+            max_concurrency=8,
+            retries=5,
+            backoff=0.5,
+            max_backoff=60.0,
+            failure_threshold=10,
+            reset_timeout=60.0):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.concurrency = float(max_concurrency)
+        self.failures = 0  # Number of consecutive transient failures.
+        self.opened = None  # Time when the circuit was opened.
+        self._trial = False
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.opened is not None:
+                    if now - self.opened < self.reset_timeout or self._trial:
+                        raise CircuitOpen('GBIF API unavailable after {} failures'.format(
+                            self.failures))
+                    self._trial = True  # Half-open: Let one trial request pass.
+                self._refill(now)
+                if self._active < max(1, int(self.concurrency)) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._active += 1
+                    return
+                self._cond.wait(
+                    (1 - self._tokens) / self.rate if self._tokens < 1 else self.reset_timeout)
+
+    def _release(self, transient_failure):
+        with self._cond:
+            self._active -= 1
+            if transient_failure:
+                self.failures += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                if self._trial or self.failures >= self.failure_threshold:
+                    self.opened = time.monotonic()
+                    logging.getLogger('tsammalex').warning(
+                        'GBIF API circuit opened after {} failures'.format(self.failures))
+            else:
+                self.failures = 0
+                self.opened = None
+                self.concurrency = min(
+                    float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            self._trial = False
+            self._cond.notify_all()
+
+    def call(self, func, *args, **kw):
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                res = func(*args, **kw)
+            except Exception as e:
+                transient = _is_transient(e)
+                self._release(transient)
+                if (not transient) or attempt >= self.retries or self.is_open:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                logging.getLogger('tsammalex').debug(
+                    'retrying in {:.1f}s after {}'.format(delay, e))
+                time.sleep(min(delay, self.max_backoff))
+                attempt += 1
+            else:
+                self._release(False)
+                return res
+
+
+# The scheduler shared by `GBIF` instances accessing the GBIF API by default.
+SCHEDULER = Scheduler()
+
+
+# Maximal number of vernacular names per request allowed by the GBIF API.
+VERNACULAR_NAMES_PAGE_SIZE = 1000
+
+
+def _needs_species_names(index, rank, language_tags):
+    """
+    For subspecies we try to supplement names missing for some of the `language_tags` with names
+    for the species.
+    """
+    if language_tags is None or not (rank and rank.lower() == 'subspecies'):
+        return False
+    return bool(set(language_tags) - set(res.get('language') for res in index['results']))
+
+
+def _species_key(usage, key):
+    """
+    :return: The key of the species a taxon belongs to - or `None`, if it is the species itself.
+    """
+    if usage.get('speciesKey') not in (None, key):
+        return usage['speciesKey']
+
+
+def _select_vernacular_names(index, species_index, language_tags):
+    """
+    Select names for `language_tags` from a vernacular name index, supplemented with names from
+    the index of the parent species - if given.
+    """
+    langs = set(tag for tag in language_tags or [])
+    names = {k: None for k in langs}
+
+    def _add_names(index):
+        for res in index['results']:
+            tag = res.get('language')
+            if (tag in langs) or language_tags is None:
+                names[tag] = res['vernacularName']
+                if tag in langs:
+                    langs.remove(tag)  # We take the first matching name, then clear the tag.
+
+    _add_names(index)
+    if langs and species_index:
+        _add_names(species_index)
+    return {k: v for k, v in names.items() if v}
 
 
 class GBIF:
+    """
+    Access to GBIF's species API, backed by an in-memory LRU in front of a persistent `Cache`.
+
+    :param cache: `Cache` instance or `False` to disable the persistent cache; defaults to a \
+    `Cache` at the default location - or no persistent cache for non-default backends.
+    :param memory: `LRU` instance; defaults to `MEMORY` - or a new `LRU` for non-default backends.
+    :param backend: Object providing the functions `name_suggest`, `name_lookup` and \
+    `name_usage`, with the same signatures as `pygbif.species`, e.g. a \
+    `pytsammalex.backbone.Backbone`. Defaults to `pygbif.species`, i.e. to the GBIF API.
+    :param scheduler: `Scheduler` for requests to the backend; defaults to `SCHEDULER` when \
+    accessing the GBIF API, and no scheduling for other backends.
+    :param metrics: `Metrics` instance; defaults to the metrics of `cache` or `METRICS`.
+    """
+    def __init__(self, cache=None, memory=None, backend=None, scheduler=None, metrics=None):
+        if cache is None:
+            # Results from other backends must not end up in the cache of GBIF API responses.
+            cache = Cache() if backend is None else False
+        self.cache = cache
+        self.backend = backend or species
+        if memory is None:
+            memory = MEMORY if backend is None else LRU()
+        self.memory = memory
+        if scheduler is None and backend is None:
+            scheduler = SCHEDULER
+        self.scheduler = scheduler
+        if metrics is None:
+            metrics = self.cache.metrics if self.cache else METRICS
+        self.metrics = metrics
+
     def __call__(self, method, no_cache=False, **kw):
-        op = getattr(species, 'name_' + method)
+        kw = canonical_query(method, kw)
         if no_cache:
-            return op(**kw)
-        with Cache() as cache:
-            return cache.get(method, **kw)
+            return self._op(method)(**kw)
+        key = (method, Cache.query(**kw))
+        res = self.memory.get(key)
+        if res is None:
+            res = self._fetch(key, kw)
+        else:
+            self.metrics.record('memory_hit', method)
+        return res
+
+    def _op(self, method):
+        """
+        The function computing results for `method`.
+        """
+        if method == VERNACULAR_NAME_INDEX:
+            return self._vernacular_name_index
+        return self._request(getattr(self.backend, 'name_' + method))
+
+    def _request(self, func):
+        if self.scheduler is None:
+            return func
+        return functools.partial(self.scheduler.call, func)
+
+    def _fetch(self, key, kw):
+        """
+        Retrieve a result missing from the in-memory cache.
+        """
+        op = functools.partial(self._op(key[0]), **kw)
+        if self.cache:
+            res = self.cache.compute(key[0], op, **kw)
+        else:
+            res = self.metrics.timed(key[0], op)()
+        self.memory.put(key, res)
+        return _copy(res)
+
+    def many(self, method, kws, max_workers=8):
+        """
+        Batch version of `GBIF.__call__`.
+
+        :param kws: `list` of `dict`s of keyword arguments for the GBIF API method.
+        :return: `list` of results, in the order of `kws`.
+        """
+        kws = [canonical_query(method, kw) for kw in kws]
+        keys = [(method, Cache.query(**kw)) for kw in kws]
+        res = {key: self.memory.get(key) for key in set(keys)}
+        missing = [(key, kw) for key, kw in dict(zip(keys, kws)).items() if res[key] is None]
+        for _ in range(len(res) - len(missing)):
+            self.metrics.record('memory_hit', method)
+        if missing:
+            op = self._op(method)
+            if self.cache:
+                results = self.cache.get_many(
+                    method, [kw for _, kw in missing], max_workers=max_workers, op=op)
+            else:
+                op = self.metrics.timed(method, op)
+                results = ordered_map(
+                    lambda kw: op(**kw), [kw for _, kw in missing], max_workers=max_workers)
+            for (key, _), r in zip(missing, results):
+                self.memory.put(key, r)
+                res[key] = r
+        return [_copy(res[key]) for key in keys]
 
     def clear_cache(self):
-        Cache().dbpath.unlink()
+        self.memory.clear()
+        if self.cache:
+            self.cache.clear()
 
     def suggest(self, **kw):
         return self('suggest', **kw)
@@ -84,20 +1114,142 @@ class GBIF:
     def usage(self, **kw):
         return self('usage', **kw)
 
+    def usage_many(self, keys, max_workers=8, **kw):
+        """
+        Retrieve usage data for a batch of GBIF keys.
+
+        :return: `list` of results, in the order of `keys`.
+        """
+        return self.many('usage', [dict(kw, key=key) for key in keys], max_workers=max_workers)
+
+    def _vernacular_name_index(self, key):
+        results, offset = [], 0
+        while True:
+            page = self._request(self.backend.name_usage)(
+                key=key, data='vernacularNames', limit=VERNACULAR_NAMES_PAGE_SIZE, offset=offset)
+            results.extend(
+                {'language': r.get('language'), 'vernacularName': r['vernacularName']}
+                for r in page['results'])
+            if page.get('endOfRecords', True) or not page['results']:
+                break
+            offset += len(page['results'])
+        return {'results': results}
+
+    def vernacular_name_index(self, key):
+        """
+        Index of the vernacular names of a taxon in all languages, computed once from all pages of
+        GBIF's vernacular names and cached.
+
+        :return: `dict` with key `results` - `list` of `dict`s with keys `language` and \
+        `vernacularName`.
+        """
+        return self(VERNACULAR_NAME_INDEX, key=key)
+
+    def vernacular_name_index_many(self, keys, max_workers=8):
+        return self.many(
+            VERNACULAR_NAME_INDEX, [dict(key=key) for key in keys], max_workers=max_workers)
+
     def get_vernacular_names(self, key, rank='species', language_tags=['eng']):
-        langs = set(tag for tag in language_tags or [])
-        names = {k: None for k in langs}
-
-        def _get_names(k):
-            for res in self.usage(key=k, data='vernacularNames')['results']:
-                tag = res.get('language')
-                if (tag in langs) or language_tags is None:
-                    names[tag] = res['vernacularName']
-                    if tag in langs:
-                        langs.remove(tag)  # We take the first matching name, then clear the tag.
-
-        _get_names(key)
-        if langs and rank and (rank.lower() == 'subspecies'):
-            # For subspecies we try to supplement names for the species.
-            _get_names(self.usage(key=key)['speciesKey'])
-        return {k: v for k, v in names.items() if v}
+        index = self.vernacular_name_index(key)
+        species_index = None
+        if _needs_species_names(index, rank, language_tags):
+            species_key = _species_key(self.usage(key=key), key)
+            if species_key:
+                species_index = self.vernacular_name_index(species_key)
+        return _select_vernacular_names(index, species_index, language_tags)
+
+    def get_vernacular_names_many(self, keys, ranks=None, language_tags=['eng'], max_workers=8):
+        """
+        Batch version of `GBIF.get_vernacular_names`.
+
+        :param ranks: `list` of ranks of the taxa, in the order of `keys`.
+        :return: `list` of `dict`s mapping language tags to names, in the order of `keys`.
+        """
+        ranks = ranks or ['species'] * len(keys)
+        indexes = self.vernacular_name_index_many(keys, max_workers=max_workers)
+        # Only subspecies lacking names need their species - and thus their usage data.
+        needs_species = list(set(
+            key for key, rank, index in zip(keys, ranks, indexes)
+            if _needs_species_names(index, rank, language_tags)))
+        species_keys = {
+            key: _species_key(usage, key) for key, usage in
+            zip(needs_species, self.usage_many(needs_species, max_workers=max_workers))}
+        species_keys = {k: v for k, v in species_keys.items() if v}
+        unique_species_keys = list(set(species_keys.values()))
+        species_indexes = dict(zip(
+            unique_species_keys,
+            self.vernacular_name_index_many(unique_species_keys, max_workers=max_workers)))
+        return [
+            _select_vernacular_names(
+                index,
+                species_indexes[species_keys[key]] if key in species_keys else None,
+                language_tags)
+            for key, index in zip(keys, indexes)]
+
+
+class AsyncGBIF:
+    """
+    asyncio counterpart of `GBIF`.
+
+    Results available from the in-memory cache are returned right away; all blocking work -
+    requests to the GBIF API and access to the SQLite cache - is run in a thread pool of size
+    `concurrency`, thus limiting the number of concurrent requests.
+
+    .. code-block:: python
+
+        async with AsyncGBIF(concurrency=4) as gbif:
+            names = await gbif.get_vernacular_names(5219404)
+    """
+    def __init__(self, gbif=None, concurrency=8):
+        self.gbif = gbif or GBIF()
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, func, *args, **kw):
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kw))
+
+    async def __call__(self, method, no_cache=False, **kw):
+        kw = canonical_query(method, kw)
+        if no_cache:
+            return await self._run(self.gbif, method, no_cache=True, **kw)
+        key = (method, Cache.query(**kw))
+        res = self.gbif.memory.get(key)
+        if res is None:
+            res = await self._run(self.gbif._fetch, key, kw)
+        else:
+            self.gbif.metrics.record('memory_hit', method)
+        return res
+
+    async def suggest(self, **kw):
+        return await self('suggest', **kw)
+
+    async def lookup(self, **kw):
+        return await self('lookup', **kw)
+
+    async def usage(self, **kw):
+        return await self('usage', **kw)
+
+    async def usage_many(self, keys, **kw):
+        return list(await asyncio.gather(*[self.usage(key=key, **kw) for key in keys]))
+
+    async def vernacular_name_index(self, key):
+        return await self(VERNACULAR_NAME_INDEX, key=key)
+
+    async def get_vernacular_names(self, key, rank='species', language_tags=['eng']):
+        index = await self.vernacular_name_index(key)
+        species_index = None
+        if _needs_species_names(index, rank, language_tags):
+            species_key = _species_key(await self.usage(key=key), key)
+            if species_key:
+                species_index = await self.vernacular_name_index(species_key)
+        return _select_vernacular_names(index, species_index, language_tags)
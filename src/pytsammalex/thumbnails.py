@@ -0,0 +1,94 @@
+"""
+A content-addressed on-disk cache of images downscaled - and recompressed - for print.
+
+Thumbnails are keyed on a hash of the content of the original image and the thumbnail parameters,
+so they are re-used across runs - and across datasets sharing images - and never go stale.
+"""
+import io
+import os
+import hashlib
+import pathlib
+import tempfile
+
+from PIL import Image, ImageOps
+from appdirs import user_cache_dir
+
+import pytsammalex
+
+__all__ = ['ThumbnailCache', 'width_px']
+
+# Default width of thumbnails in pixels.
+WIDTH = 480
+QUALITY = 80
+CHUNK_SIZE = 1024 * 1024
+
+
+def width_px(cm, dpi=200):
+    """
+    :return: Number of pixels of an image printed `cm` centimetres wide at `dpi`.
+    """
+    return int(round(cm / 2.54 * dpi))
+
+
+class ThumbnailCache:
+    """
+    :param d: Directory of the cache; defaults to `thumbnails` in the user cache directory.
+    :param width: Maximal width of thumbnails in pixels. Smaller images are not upscaled.
+    :param quality: JPEG quality of the thumbnails.
+    """
+    def __init__(self, d=None, width=WIDTH, quality=QUALITY):
+        self.dir = pathlib.Path(d) if d \
+            else pathlib.Path(user_cache_dir(appname=pytsammalex.__name__)) / 'thumbnails'
+        self.width = width
+        self.quality = quality
+
+    def path(self, digest):
+        return self.dir / digest[:2] / '{}-{}-q{}.jpg'.format(digest, self.width, self.quality)
+
+    def get(self, data=None, path=None):
+        """
+        Return the path of the thumbnail of an image - creating it if it is not cached yet.
+
+        :param data: `bytes` of the image.
+        :param path: Path of the image - read in chunks, if `data` is not given.
+        :raises OSError: If the image cannot be read.
+        """
+        sha = hashlib.sha256()
+        if data is None:
+            with pathlib.Path(path).open('rb') as fp:
+                for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+        else:
+            sha.update(data)
+        target = self.path(sha.hexdigest())
+        if not target.exists():
+            self._make(str(path) if data is None else io.BytesIO(data), target)
+        return target
+
+    def _make(self, src, target):
+        with Image.open(src) as img:
+            # Let JPEG decoders skip detail we'd discard anyway - using less time and memory. Since
+            # the image may still be rotated according to its EXIF orientation, the short side must
+            # cover the thumbnail width:
+            short_side = max(min(img.size), 1)
+            img.draft('RGB', tuple(n * self.width // short_side for n in img.size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((self.width, img.height))
+            if img.mode in ('RGBA', 'LA', 'P'):
+                # JPEG has no transparency - we put images on a white background.
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, 'white')
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            img = img.convert('RGB')
+            # Concurrent runs may create the directory at the same time:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Write atomically, so that concurrent runs never see partial thumbnails:
+            fd, tmp = tempfile.mkstemp(dir=str(target.parent), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    img.save(fp, format='JPEG', quality=self.quality, optimize=True)
+                os.replace(tmp, str(target))
+            except Exception:
+                os.remove(tmp)
+                raise
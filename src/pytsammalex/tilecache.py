@@ -0,0 +1,240 @@
+"""
+A size-bounded disk cache for map tiles fetched over HTTP - e.g. GBIF's occurrence density maps.
+
+Tiles are stored in a SQLite database, together with the validators (`ETag`, `Last-Modified`)
+sent by the upstream server. Expired tiles are revalidated with a conditional request, so unchanged
+tiles need not be downloaded again - and are served stale if the upstream server is unreachable.
+"""
+import os
+import re
+import time
+import pathlib
+import sqlite3
+import logging
+import threading
+import contextlib
+import collections
+
+import requests
+from appdirs import user_cache_dir
+
+import pytsammalex
+
+__all__ = ['TileCache', 'Tile']
+
+DAY = 24 * 60 * 60
+# Default time-to-live (in seconds) of cached tiles, if the upstream response doesn't specify one.
+TTL = DAY
+MAX_SIZE = 256 * 1024 * 1024
+
+# Time (in seconds) to wait for the lock on the database held by other processes.
+BUSY_TIMEOUT = 30
+
+_connections_lock = threading.Lock()
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tiles ("
+    "url TEXT PRIMARY KEY, status INTEGER, data BLOB, content_type TEXT, etag TEXT, "
+    "last_modified TEXT, expires REAL, accessed REAL)",
+    "CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)",
+    # The size of the cached tiles is maintained incrementally - by triggers - so that checking it
+    # upon each write doesn't require a scan of the table.
+    "CREATE TABLE IF NOT EXISTS tiles_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)",
+    "INSERT OR IGNORE INTO tiles_size (id, size) "
+    "SELECT 0, coalesce(sum(length(data)), 0) FROM tiles "
+    "WHERE NOT EXISTS (SELECT 1 FROM tiles_size)",
+    "CREATE TRIGGER IF NOT EXISTS tiles_insert AFTER INSERT ON tiles BEGIN "
+    "UPDATE tiles_size SET size = size + coalesce(length(new.data), 0); END",
+    "CREATE TRIGGER IF NOT EXISTS tiles_delete AFTER DELETE ON tiles BEGIN "
+    "UPDATE tiles_size SET size = size - coalesce(length(old.data), 0); END",
+    "CREATE TRIGGER IF NOT EXISTS tiles_update AFTER UPDATE OF data ON tiles BEGIN "
+    "UPDATE tiles_size SET size = size + coalesce(length(new.data), 0) "
+    "- coalesce(length(old.data), 0); END",
+]
+
+Tile = collections.namedtuple(
+    'Tile', ['status', 'data', 'content_type', 'etag', 'last_modified', 'expires'])
+
+
+def _max_age(response):
+    """
+    :return: `max-age` from the `Cache-Control` header of `response` or `None`.
+    """
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    if match:
+        return int(match.group(1))
+
+
+class TileCache:
+    """
+    A cache of map tiles - keyed on their URL.
+
+    :param dbpath: Path of the SQLite database file; defaults to `tiles.sqlite` in the user cache \
+    directory.
+    :param ttl: Time-to-live in seconds of tiles for which the upstream server sends no `max-age`.
+    :param max_size: Maximal size of the cached tiles in bytes. If exceeded, the least recently \
+    accessed tiles are evicted.
+    :param timeout: Timeout in seconds for requests to the upstream server.
+    :param session: `requests.Session` to use for requests to the upstream server.
+    """
+    def __init__(self, dbpath=None, ttl=TTL, max_size=MAX_SIZE, timeout=10, session=None):
+        if dbpath is None:
+            d = pathlib.Path(user_cache_dir(appname=pytsammalex.__name__))
+            if not d.exists():
+                d.mkdir(parents=True)
+            dbpath = d / 'tiles.sqlite'
+        self.dbpath = pathlib.Path(dbpath)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self._connection = None
+
+    def _connect(self):
+        """
+        Return a connection to the database and a lock to serialize access to it.
+
+        The connection is opened lazily - once per process, since SQLite connections must not be
+        shared with processes forked e.g. by a WSGI server after the cache was created.
+        """
+        pid = os.getpid()
+        with _connections_lock:
+            if self._connection is None or self._connection[0] != pid:
+                conn = sqlite3.connect(
+                    str(self.dbpath),
+                    check_same_thread=False,
+                    isolation_level=None,
+                    timeout=BUSY_TIMEOUT)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for sql in SCHEMA:
+                        conn.execute(sql)
+                    conn.execute('COMMIT')
+                except Exception:  # pragma: no cover
+                    conn.execute('ROLLBACK')
+                    raise
+                self._connection = (pid, conn, threading.RLock())
+            return self._connection[1:]
+
+    @contextlib.contextmanager
+    def cursor(self, write=True):
+        """
+        Context manager yielding a cursor, with the `with` block run as one transaction.
+
+        :param write: Flag signaling whether the transaction may write - reading tiles does, too, \
+        updating their access time. Such transactions acquire the write lock upfront, because \
+        upgrading a read transaction fails if another process wrote in the meantime.
+        """
+        conn, lock = self._connect()
+        with lock:
+            cu = conn.cursor()
+            cu.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield cu
+            except Exception:
+                cu.execute('ROLLBACK')
+                raise
+            else:
+                cu.execute('COMMIT')
+            finally:
+                cu.close()
+
+    def close(self):
+        with _connections_lock:
+            if self._connection and self._connection[0] == os.getpid():
+                self._connection[1].close()
+            self._connection = None
+
+    def size(self):
+        """
+        :return: Size of the cached tiles in bytes.
+        """
+        with self.cursor(write=False) as cu:
+            return cu.execute("select size from tiles_size").fetchone()[0]
+
+    def _read(self, url, now):
+        with self.cursor() as cu:
+            row = cu.execute(
+                "select status, data, content_type, etag, last_modified, expires from tiles "
+                "where url = ?",
+                (url,)).fetchone()
+            if row:
+                cu.execute("update tiles set accessed = ? where url = ?", (now, url))
+                return Tile(*row)
+
+    def _write(self, url, tile, now):
+        with self.cursor() as cu:
+            # Delete explicitly - rows replaced by "insert or replace" don't fire delete triggers.
+            cu.execute("delete from tiles where url = ?", (url,))
+            cu.execute(
+                "insert into tiles "
+                "(url, status, data, content_type, etag, last_modified, expires, accessed) "
+                "values (?,?,?,?,?,?,?,?)",
+                (url,) + tuple(tile) + (now,))
+            self._evict(cu)
+
+    def _evict(self, cu, batch_size=100):
+        """
+        Delete the least recently accessed tiles until the cache fits into `max_size`.
+        """
+        size = cu.execute("select size from tiles_size").fetchone()[0]
+        while self.max_size is not None and size > self.max_size:
+            rows = cu.execute(
+                "select url, length(data) from tiles order by accessed limit ?",
+                (batch_size,)).fetchall()
+            if not rows:  # pragma: no cover
+                break
+            for url, nbytes in rows:
+                cu.execute("delete from tiles where url = ?", (url,))
+                size -= nbytes or 0
+                if size <= self.max_size:
+                    break
+
+    def get(self, url):
+        """
+        Return the tile at `url`, from the cache if possible, revalidating expired tiles.
+
+        :return: `Tile` instance - with status 200 or 204 (for empty tiles).
+        :raises requests.RequestException: If the tile could not be retrieved and isn't cached.
+        """
+        now = time.time()
+        cached = self._read(url, now)
+        if cached and cached.expires > now:
+            return cached
+
+        headers = {}
+        if cached and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code not in (200, 204) \
+                    and not (response.status_code == 304 and cached):
+                raise requests.HTTPError(
+                    '{} for url: {}'.format(response.status_code, url), response=response)
+        except requests.RequestException as e:
+            if cached:
+                logging.getLogger('tsammalex').warning(
+                    'serving stale tile {}: {}'.format(url, e))
+                return cached
+            raise
+
+        max_age = _max_age(response)
+        expires = now + (self.ttl if max_age is None else max_age)
+        if response.status_code == 304:
+            tile = cached._replace(
+                etag=response.headers.get('ETag', cached.etag),
+                last_modified=response.headers.get('Last-Modified', cached.last_modified),
+                expires=expires)
+        else:
+            tile = Tile(
+                response.status_code,
+                response.content,
+                response.headers.get('Content-Type', 'image/png'),
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                expires)
+        self._write(url, tile, now)
+        return tile
@@ -0,0 +1,147 @@
+"""
+Fixtures for the benchmark suite, building synthetic datasets of a given size.
+
+The benchmarks are excluded from the default test run; run (and save the results) with
+
+    pytest tests/benchmarks --benchmark-autosave
+
+and compare with the latest saved run with
+
+    pytest tests/benchmarks --benchmark-compare
+"""
+import io
+import json
+import math
+import random
+import itertools
+
+import pytest
+
+from pytsammalex.gbif import GBIF, LRU, Cache, Scheduler
+
+TERMS = 'http://cldf.clld.org/v1.0/terms.rdf#'
+RANKS = ['kingdom', 'phylum', 'class_', 'order', 'family', 'genus']
+
+
+@pytest.fixture
+def make_gbif(gbif_server, tmp_path):
+    """
+    Factory for `GBIF` instances accessing the GBIF stand-in, with a fresh persistent cache (if \
+    `cold`) and a fresh in-memory cache.
+    """
+    counter = itertools.count()
+    # We don't want to measure the rate limit for the GBIF API:
+    scheduler = Scheduler(rate=10000)
+
+    def make(cold=True):
+        name = 'cache{}.sqlite'.format(next(counter) if cold else '')
+        return GBIF(cache=Cache(tmp_path / name), memory=LRU(), scheduler=scheduler)
+    return make
+
+
+@pytest.fixture
+def make_dataset(tmp_path):
+    """
+    Factory for CLDF datasets with `n` taxa - with one name in language "l" and one image each.
+    """
+    pycldf = pytest.importorskip('pycldf')
+
+    def make(n, images=True):
+        d = tmp_path / 'ds{}'.format(n)
+        ds = pycldf.StructureDataset.in_dir(d)
+        ds.add_component(
+            'ParameterTable',
+            {'name': 'Concepticon_ID', 'propertyUrl': TERMS + 'concepticonReference'},
+            'GBIF_ID',
+            {'name': 'gbifReference',
+             'propertyUrl': TERMS + 'gbifReference',
+             'valueUrl': 'https://www.gbif.org/species/{GBIF_ID}'},
+            'rank',
+            *(RANKS + [r.rstrip('_') + 'Key' for r in RANKS]))
+        ds.add_component('FormTable')
+        ds.add_component('LanguageTable')
+        ds.add_component(
+            'MediaTable', {'name': 'Taxon_ID', 'propertyUrl': TERMS + 'parameterReference'})
+        params, forms, media = [], [], []
+        for i in range(n):
+            pid = 't{}'.format(i)
+            param = dict(
+                ID=pid, Name='Genus species{}'.format(i + 1), GBIF_ID=str(i + 1), rank='SPECIES')
+            for j, rank in enumerate(RANKS):
+                # A balanced taxonomy, with about 3 children per node:
+                param[rank] = '{}{}'.format(rank, i // 3 ** (len(RANKS) - j))
+                param[rank.rstrip('_') + 'Key'] = i // 3 ** (len(RANKS) - j)
+            params.append(param)
+            forms.append(dict(ID=pid, Language_ID='l', Parameter_ID=pid, Form='name{}'.format(i)))
+            if images:
+                media.append(dict(
+                    ID='img{}'.format(i),
+                    Name='img{}.jpg'.format(i),
+                    Media_Type='image/jpeg',
+                    Download_URL='img{}.jpg'.format(i),
+                    Taxon_ID=pid))
+        ds.write(
+            ParameterTable=params,
+            FormTable=forms,
+            LanguageTable=[dict(ID='l', Name='Language')],
+            MediaTable=media)
+        if images:
+            Image = pytest.importorskip('PIL.Image')
+            img = io.BytesIO()
+            Image.effect_noise((1600, 1200), 64).convert('RGB').save(img, format='JPEG')
+            for row in media:
+                d.joinpath(row['Download_URL']).write_bytes(img.getvalue())
+        return ds
+    return make
+
+
+def polygon(rng, lon, lat, n):
+    """
+    A closed, star-shaped polygon with `n` vertices around `(lon, lat)`.
+    """
+    ring = []
+    for i in range(n):
+        angle = 2 * math.pi * i / n
+        r = rng.uniform(0.5, 1.5)
+        ring.append([
+            round(lon + r * math.cos(angle), 6),
+            round(lat + r * math.sin(angle), 6)])
+    return ring + ring[:1]
+
+
+@pytest.fixture
+def make_ecoregions(tmp_path):
+    """
+    Factory for synthetic ecoregion GeoJSON features - in the format of pytsammalex' \
+    ecoregions.json - with `n` ecoregions made up of `parts` polygons with `vertices` vertices.
+
+    :return: Path of the directory containing ecoregions.json.
+    """
+    def make(n, parts=2, vertices=200):
+        rng = random.Random(n)
+        features = []
+        for i in range(n):
+            lon, lat = rng.uniform(-170, 170), rng.uniform(-80, 80)
+            for j in range(parts):
+                features.append({
+                    'type': 'Feature',
+                    'properties': {
+                        'eco_code': 'AT{:04d}'.format(i),
+                        'ECO_NAME': 'Ecoregion {}'.format(i),
+                        'G200_REGIO': None,
+                        'BIOME': float(i % 14 + 1),
+                        'REALM': 'AT',
+                        'GBL_STAT': i % 3 + 1,
+                        'AREA': float(j + 1),
+                        'area_km2': 1000 * (i + 1),
+                    },
+                    'geometry': {
+                        'type': 'Polygon',
+                        'coordinates': [polygon(rng, lon + 3 * j, lat, vertices)]},
+                })
+        d = tmp_path / 'eco{}'.format(n)
+        d.mkdir()
+        d.joinpath('ecoregions.json').write_text(
+            json.dumps({'type': 'FeatureCollection', 'features': features}))
+        return d
+    return make
@@ -0,0 +1,137 @@
+import json
+import types
+import itertools
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('clld')
+
+import pytsammalex  # noqa: E402
+from pytsammalex.clld import load  # noqa: E402
+from pytsammalex.ecoregions import Ecoregions, ZOOM_LEVELS, tile_bbox  # noqa: E402
+from pytsammalex.clld.adapters import GeoJsonEcoregions, EcoregionTiles  # noqa: E402
+
+
+@pytest.mark.parametrize('n', [10, 100])
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_iter_taxa_cold(benchmark, gbif_server, make_gbif, make_dataset, n, max_workers):
+    gbif_server.latency = 0.01
+    ds = make_dataset(n, images=False)
+    res = benchmark.pedantic(
+        lambda gbif: list(load.iter_taxa(ds, {'eng'}, gbif=gbif, max_workers=max_workers)),
+        setup=lambda: ((make_gbif(),), {}),
+        rounds=3)
+    assert len(res) == n
+
+
+@pytest.mark.parametrize('n', [10, 100])
+def test_iter_taxa_warm(benchmark, make_gbif, make_dataset, n):
+    # Results are read from the persistent cache, with a fresh in-memory cache in each round.
+    ds = make_dataset(n, images=False)
+    assert len(list(load.iter_taxa(ds, {'eng'}, gbif=make_gbif(cold=False)))) == n
+    benchmark.pedantic(
+        lambda gbif: list(load.iter_taxa(ds, {'eng'}, gbif=gbif)),
+        setup=lambda: ((make_gbif(cold=False),), {}),
+        rounds=20)
+
+
+@pytest.fixture
+def session():
+    from clld.db.meta import DBSession
+
+    yield DBSession
+    DBSession.remove()
+
+
+@pytest.mark.parametrize('n', [10, 100, 1000])
+def test_Ecoregions_compile(benchmark, make_ecoregions, n):
+    d = make_ecoregions(n)
+    benchmark.pedantic(
+        Ecoregions.compile, args=(d / 'ecoregions.json', d / 'compiled'), rounds=3)
+
+
+@pytest.mark.parametrize('n', [10, 100, 1000])
+def test_load_ecoregions(benchmark, mocker, session, make_ecoregions, n):
+    d = make_ecoregions(n)
+    mocker.patch.object(pytsammalex, '__file__', str(d / '__init__.py'))
+    Ecoregions.load()  # Compile the ecoregions before measuring.
+    benchmark.pedantic(load.load_ecoregions, setup=lambda: session.expunge_all(), rounds=3)
+
+
+@pytest.fixture
+def make_ecoregion_objects(make_ecoregions):
+    """
+    Factory for stand-ins for `Ecoregion` instances - as created by `load_ecoregions`.
+    """
+    def make(n):
+        d = make_ecoregions(n)
+        res = []
+        for eco_code, features in Ecoregions.compile(d / 'ecoregions.json', d / 'c').groupby():
+            res.append(types.SimpleNamespace(
+                id=eco_code,
+                name=eco_code,
+                latitude=0.0,
+                longitude=0.0,
+                biome=types.SimpleNamespace(description='ffffff'),
+                jsondata={
+                    'polygons': [f.geometry for f in features],
+                    'simplified': {
+                        str(zoom): [f.simplified(zoom) for f in features]
+                        for zoom in ZOOM_LEVELS}}))
+        return res
+    return make
+
+
+@pytest.mark.parametrize('n', [10, 100, 1000])
+@pytest.mark.parametrize('zoom', [None, 2, 6])
+@pytest.mark.parametrize('cached', [False, True])
+def test_GeoJsonEcoregions(benchmark, mocker, make_ecoregion_objects, n, zoom, cached):
+    from pyramid import testing
+
+    ecoregions = make_ecoregion_objects(n)
+    ctx = types.SimpleNamespace(get_query=lambda: ecoregions)
+    mocker.patch.dict(GeoJsonEcoregions._cache, clear=True)
+    version = itertools.count()
+    mocker.patch.object(
+        GeoJsonEcoregions,
+        'data_version',
+        side_effect=lambda *args: (n if cached else next(version), None))
+    testing.setUp()
+    try:
+        req = testing.DummyRequest(params={'zoom': str(zoom)} if zoom else {})
+        res = benchmark(GeoJsonEcoregions(None).render, ctx, req)
+        assert len(json.loads(res)['features']) == 2 * n
+        benchmark.extra_info['bytes'] = len(res)
+    finally:
+        testing.tearDown()
+
+
+@pytest.mark.parametrize('n', [100, 1000])
+@pytest.mark.parametrize('z', [2, 6])
+def test_EcoregionTiles(benchmark, make_ecoregion_objects, n, z):
+    """
+    Render all (uncached) tiles at zoom level `z` within the area of the synthetic ecoregions.
+    """
+    tiles = EcoregionTiles(make_ecoregion_objects(n))
+    coords = [
+        (x, y) for x in range(2 ** z) for y in range(2 ** z)
+        if tiles.index[None].query(tile_bbox(z, x, y)).size]
+
+    def render():
+        return [tiles._tile(z, x, y) for x, y in coords]
+
+    res = benchmark(render)
+    benchmark.extra_info['tiles'] = len(res)
+    benchmark.extra_info['bytes'] = sum(len(b''.join(body.identity)) for body in res)
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_iter_datasets(benchmark, monkeypatch, tmp_path, make_dataset, indexed):
+    monkeypatch.delenv(load.DATASETS_DIR_ENV, raising=False)
+    for i in range(20):
+        make_dataset(i + 1, images=False)
+    index = tmp_path / 'index.json' if indexed else False
+    list(load.iter_datasets(str(tmp_path), index=index))
+    res = benchmark(lambda: list(load.iter_datasets(str(tmp_path), index=index)))
+    assert len(res) == 20
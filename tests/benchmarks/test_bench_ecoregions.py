@@ -0,0 +1,65 @@
+import json
+import random
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+np = pytest.importorskip('numpy')
+
+from pytsammalex.ecoregions import Ecoregions, EcoregionLookup, area_centroid  # noqa: E402
+
+from conftest import polygon  # noqa: E402
+
+
+def get_center(arr):
+    # The vertex mean, as computed by `pytsammalex.clld.load.get_center`:
+    from pytsammalex.clld.load import get_center
+
+    return get_center(arr)
+
+
+@pytest.fixture(params=[(1, 100), (1, 10000), (50, 1000)], ids=lambda p: '{}x{}'.format(*p))
+def polygons(request):
+    rng = random.Random(1)
+    n, vertices = request.param
+    return [[polygon(rng, 3 * i, 0, vertices)] for i in range(n)]
+
+
+def test_get_center(benchmark, polygons):
+    # Note: The vertex mean of the exterior ring of the first polygon only.
+    benchmark(get_center, polygons[0][0])
+
+
+def test_area_centroid(benchmark, polygons):
+    # Rings as read by `load_ecoregions` - as (memory-mapped) arrays:
+    polygons = [[np.array(ring) for ring in p] for p in polygons]
+    benchmark(area_centroid, polygons)
+
+
+@pytest.fixture(scope='module')
+def lookup(tmp_path_factory):
+    rng = random.Random(1)
+    features = []
+    for i in range(1000):
+        lon, lat = rng.uniform(-170, 170), rng.uniform(-80, 80)
+        features.append({
+            'type': 'Feature',
+            'properties': {'eco_code': 'AT{:04d}'.format(i)},
+            'geometry': {'type': 'Polygon', 'coordinates': [polygon(rng, lon, lat, 1000)]}})
+    d = tmp_path_factory.mktemp('lookup')
+    d.joinpath('ecoregions.json').write_text(
+        json.dumps({'type': 'FeatureCollection', 'features': features}))
+    return EcoregionLookup.from_ecoregions(Ecoregions.compile(d / 'ecoregions.json', d / 'c'))
+
+
+@pytest.mark.parametrize('n', [10000, 1000000])
+def test_EcoregionLookup(benchmark, lookup, n):
+    """
+    Look up `n` random points in 1000 ecoregions with 1000 vertices each.
+    """
+    rng = np.random.default_rng(1)
+    lat, lon = rng.uniform(-90, 90, n), rng.uniform(-180, 180, n)
+    res = benchmark(lookup.lookup, lat, lon)
+    if benchmark.stats:  # Not measured with --benchmark-disable.
+        benchmark.extra_info['points_per_minute'] = n * 60 / benchmark.stats.stats.mean
+    benchmark.extra_info['found'] = sum(code is not None for code in res)
@@ -0,0 +1,29 @@
+import logging
+import argparse
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('xhtml2pdf')
+
+from pytsammalex.commands import fieldguide  # noqa: E402
+
+
+@pytest.mark.parametrize('n', [5, 25])
+def test_fieldguide(benchmark, mocker, tmp_path, monkeypatch, make_gbif, make_dataset, n):
+    ds = make_dataset(n)
+    gbif = make_gbif(cold=False)
+    mocker.patch('pytsammalex.commands.fieldguide.GBIF', lambda: gbif)
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(
+        dataset=str(ds.tablegroup._fname),
+        download_dir=None,
+        language='l',
+        dpi=200,
+        thumbnail_dir=str(tmp_path / 'thumbnails'),
+        stats=False,
+        log=logging.getLogger(__name__))
+    mocker.patch('builtins.print')
+    benchmark.pedantic(fieldguide.run, args=(args,), rounds=3)
+    assert tmp_path.joinpath('fg.pdf').stat().st_size > 0
+    benchmark.extra_info['pdf_bytes'] = tmp_path.joinpath('fg.pdf').stat().st_size
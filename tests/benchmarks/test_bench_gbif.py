@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture
+def warm_gbif(make_gbif):
+    gbif = make_gbif(cold=False)
+    gbif.usage(key=42)
+    gbif.get_vernacular_names(42)
+    return lambda: make_gbif(cold=False)
+
+
+def test_Cache_get_cold(benchmark, make_gbif):
+    benchmark.pedantic(
+        lambda gbif: gbif.cache.get('usage', key=42),
+        setup=lambda: ((make_gbif(),), {}),
+        rounds=20)
+
+
+def test_Cache_get_warm(benchmark, warm_gbif):
+    cache = warm_gbif().cache
+    assert benchmark(cache.get, 'usage', key=42)['key'] == 42
+
+
+def test_get_vernacular_names_cold(benchmark, make_gbif):
+    benchmark.pedantic(
+        lambda gbif: gbif.get_vernacular_names(42),
+        setup=lambda: ((make_gbif(),), {}),
+        rounds=20)
+
+
+def test_get_vernacular_names_warm(benchmark, warm_gbif):
+    # Results are read from the persistent cache, with a fresh in-memory cache in each round.
+    res = benchmark.pedantic(
+        lambda gbif: gbif.get_vernacular_names(42),
+        setup=lambda: ((warm_gbif(),), {}),
+        rounds=100)
+    assert res == {'eng': 'species 42'}
+
+
+def test_get_vernacular_names_memory(benchmark, warm_gbif):
+    gbif = warm_gbif()
+    assert benchmark(gbif.get_vernacular_names, 42) == {'eng': 'species 42'}
+
+
+@pytest.mark.parametrize('n', [10, 100])
+def test_get_vernacular_names_many(benchmark, make_gbif, n):
+    benchmark.pedantic(
+        lambda gbif: gbif.get_vernacular_names_many(range(1, n + 1)),
+        setup=lambda: ((make_gbif(),), {}),
+        rounds=5)
@@ -0,0 +1,125 @@
+import json
+import time
+import importlib
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+
+class GBIFStandIn(BaseHTTPRequestHandler):
+    """
+    A minimal stand-in for the parts of GBIF's species API used by pytsammalex, serving synthetic
+    taxa: Every integer is a valid key, keys > 1000 are subspecies of the species `key // 10`.
+
+    Occurrence density tiles of the maps API are served, too - empty for taxon key 0.
+    """
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        args = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.split('/')[2:]
+        self.server.requests.append(self.path)
+        time.sleep(self.server.latency)
+        # Queries for "nothing" have no results:
+        keys = [] if args.get('q') == 'nothing' else range(1, 4)
+        if path == ['species', 'suggest']:
+            return self._json([usage(k) for k in keys])
+        if path == ['species', 'search']:
+            return self._json({'results': [usage(k) for k in keys]})
+        if path[0] == 'species' and path[1].isdigit():
+            key = int(path[1])
+            if len(path) == 2:
+                return self._json(usage(key))
+            if path[2] == 'vernacularNames':
+                offset, limit = int(args.get('offset', 0)), int(args.get('limit', 100))
+                names = vernacular_names(key)
+                return self._json({
+                    'offset': offset,
+                    'limit': limit,
+                    'endOfRecords': offset + limit >= len(names),
+                    'results': names[offset:offset + limit]})
+        if path[:3] == ['map', 'occurrence', 'density'] and len(path) == 6:
+            return self._tile(path[3:], args)
+        self._json({}, status=404)
+
+    def _tile(self, tile, args):
+        etag = '"{}-{}"'.format(args.get('taxonKey'), self.server.tile_version)
+        body = b''
+        if self.headers.get('If-None-Match') == etag:
+            status = 304
+        elif args.get('taxonKey') == '0':
+            status = 204
+        else:
+            status, body = 200, b'\x89PNG ' + '/'.join(tile + [etag]).encode('utf8')
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        if body:
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+        if self.server.tile_max_age is not None:
+            self.send_header('Cache-Control', 'max-age={}'.format(self.server.tile_max_age))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GBIFServer(ThreadingHTTPServer):
+    # Concurrent requests - each on a new connection - must not overflow the listen queue.
+    request_queue_size = 128
+
+
+def usage(key):
+    res = {
+        'key': key,
+        'scientificName': 'Genus species{}'.format(key),
+        'canonicalName': 'Genus species{}'.format(key),
+        'rank': 'SUBSPECIES' if key > 1000 else 'SPECIES',
+        'kingdom': 'Animalia',
+        'kingdomKey': 1,
+        'genus': 'Genus',
+        'genusKey': 2,
+        'synonym': False,
+        'status': 'ACCEPTED',
+    }
+    res['speciesKey'] = key // 10 if key > 1000 else key
+    return res
+
+
+def vernacular_names(key):
+    if key > 1000:
+        return [{'language': 'deu', 'vernacularName': 'Unterart {}'.format(key)}]
+    return [
+        {'language': 'eng', 'vernacularName': 'species {}'.format(key)},
+        {'language': 'deu', 'vernacularName': 'Art {}'.format(key)},
+    ]
+
+
+@pytest.fixture
+def gbif_server(mocker):
+    """
+    Run a local GBIF stand-in and point pygbif at it.
+    """
+    server = GBIFServer(('127.0.0.1', 0), GBIFStandIn)
+    server.requests = []
+    server.latency = 0  # Simulated network latency in seconds.
+    server.tile_version = 1  # Changing the version changes the content of the tiles.
+    server.tile_max_age = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}/v1/'.format(server.server_port)
+    for mod in ['name_usage', 'name_suggest', 'name_lookup']:
+        mocker.patch.object(importlib.import_module('pygbif.species.' + mod), 'gbif_baseurl', url)
+    yield server
+    server.shutdown()
+    server.server_close()
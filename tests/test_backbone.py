@@ -0,0 +1,112 @@
+import argparse
+
+import pytest
+
+from pytsammalex.gbif import GBIF, NotFound
+from pytsammalex.backbone import Backbone, trigrams
+
+COLUMNS = {
+    'Taxon': [
+        'taxonID', 'parentNameUsageID', 'acceptedNameUsageID', 'scientificName',
+        'scientificNameAuthorship', 'canonicalName', 'taxonRank', 'taxonomicStatus', 'kingdom',
+        'phylum', 'class', 'order', 'family', 'genus'],
+    'VernacularName': [
+        'taxonID', 'vernacularName', 'language', 'country', 'countryCode', 'sex', 'lifeStage',
+        'source'],
+}
+CLASSIFICATION = ['Animalia', 'Chordata', 'Mammalia', 'Carnivora', 'Felidae', 'Panthera']
+TAXON = [
+    ['1', '', '', 'Animalia', '', 'Animalia', 'kingdom', 'accepted'] + CLASSIFICATION[:1],
+    ['2', '1', '', 'Chordata', '', 'Chordata', 'phylum', 'accepted'] + CLASSIFICATION[:2],
+    ['3', '2', '', 'Mammalia', '', 'Mammalia', 'class', 'accepted'] + CLASSIFICATION[:3],
+    ['4', '3', '', 'Carnivora', '', 'Carnivora', 'order', 'accepted'] + CLASSIFICATION[:4],
+    ['5', '4', '', 'Felidae', '', 'Felidae', 'family', 'accepted'] + CLASSIFICATION[:5],
+    ['6', '5', '', 'Panthera', '', 'Panthera', 'genus', 'accepted'] + CLASSIFICATION,
+    ['7', '6', '', 'Panthera leo (Linnaeus, 1758)', '(Linnaeus, 1758)', 'Panthera leo',
+     'species', 'accepted'] + CLASSIFICATION,
+    ['8', '7', '', 'Panthera leo melanochaita (Smith, 1842)', '(Smith, 1842)',
+     'Panthera leo melanochaita', 'subspecies', 'accepted'] + CLASSIFICATION,
+    ['9', '6', '', 'Panthera pardus (Linnaeus, 1758)', '(Linnaeus, 1758)', 'Panthera pardus',
+     'species', 'accepted'] + CLASSIFICATION,
+    ['10', '6', '7', 'Felis leo Linnaeus, 1758', 'Linnaeus, 1758', 'Felis leo', 'species',
+     'synonym'] + CLASSIFICATION,
+]
+VERNACULAR_NAME = [
+    ['7', 'lion', 'en', '', 'GB'],
+    ['7', 'Löwe', 'de', '', 'DE'],
+    ['7', 'simba', 'sw', '', 'TZ'],
+    ['8', 'Southern lion', 'en'],
+]
+
+
+def tsv(name, rows):
+    return ''.join('\t'.join(row) + '\n' for row in [COLUMNS[name]] + rows)
+
+
+@pytest.fixture(scope='module')
+def backbone(tmp_path_factory):
+    d = tmp_path_factory.mktemp('backbone')
+    d.joinpath('Taxon.tsv').write_text(tsv('Taxon', TAXON), encoding='utf8')
+    d.joinpath('VernacularName.tsv').write_text(
+        tsv('VernacularName', VERNACULAR_NAME), encoding='utf8')
+    return Backbone.from_dwca(d, d / 'backbone.sqlite')
+
+
+def test_usage(backbone):
+    res = backbone.name_usage(key=8)
+    assert res['rank'] == 'SUBSPECIES'
+    assert res['speciesKey'] == 7 and res['kingdomKey'] == 1 and res['genus'] == 'Panthera'
+    assert backbone.name_usage(key='10')['acceptedKey'] == 7
+
+    res = backbone.name_usage(key=7, data='vernacularNames', limit=2)
+    assert [r['language'] for r in res['results']] == ['eng', 'deu']
+    assert not res['endOfRecords']
+    with pytest.raises(NotFound):
+        backbone.name_usage(key=100)
+
+
+def test_suggest_lookup(backbone):
+    assert [r['key'] for r in backbone.name_suggest(q='panthera l')] == [7, 8]
+    assert [r['key'] for r in backbone.name_suggest(q='panthera', rank='species')] == [7, 9]
+    res = backbone.name_lookup(q='Pantera leo')
+    assert res['results'][0]['canonicalName'] == 'Panthera leo'
+    assert backbone.name_lookup(q='xyz')['results'] == []
+
+
+@pytest.mark.parametrize('query,threshold', [
+    ('Pantera leo', 0.3), ('panthera', 0.2), ('leo', 0.1), ('felis', 0.5), ('Panthera leo', 1)])
+def test_similar(backbone, query, threshold):
+    # Pruning candidates must not change the result of comparing against all names:
+    def jaccard(a, b):
+        a, b = trigrams(a), trigrams(b)
+        return len(a & b) / len(a | b)
+
+    names = {row[5].lower() for row in TAXON}
+    expected = {n for n in names if jaccard(query.lower(), n) >= threshold}
+    with backbone.cursor() as cu:
+        assert {n for n, _ in backbone._similar(cu, query.lower(), threshold)} == expected
+
+
+def test_GBIF(backbone):
+    gbif = GBIF(backend=backbone)
+    assert gbif.cache is False
+    assert gbif.get_vernacular_names(8, rank='subspecies', language_tags=['eng', 'swa']) == \
+        {'eng': 'Southern lion', 'swa': 'simba'}
+    assert [r['key'] for r in gbif.usage_many([9, 7])] == [9, 7]
+
+
+def test_Backbone_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Backbone(tmp_path / 'backbone.sqlite')
+    assert not tmp_path.joinpath('backbone.sqlite').exists()
+
+
+def test_gbif_command(backbone, capsys):
+    from pytsammalex.commands import gbif
+
+    parser = argparse.ArgumentParser()
+    gbif.register(parser)
+    # --backbone doesn't swallow the query:
+    gbif.run(parser.parse_args(
+        ['lookup', '--backbone', 'Pantera leo', '--backbone-db', str(backbone.dbpath)]))
+    assert 'Panthera leo (Linnaeus, 1758)' in capsys.readouterr().out
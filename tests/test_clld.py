@@ -0,0 +1,299 @@
+import os
+import json
+from unittest import mock
+
+import pytest
+
+from pytsammalex.gbif import GBIF, LRU, Cache, Scheduler
+
+pycldf = pytest.importorskip('pycldf')
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    ds = pycldf.StructureDataset.in_dir(tmp_path / 'ds')
+    ds.add_component(
+        'ParameterTable',
+        {'name': 'Concepticon_ID',
+         'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#concepticonReference'},
+        'GBIF_ID',
+        'rank')
+    ds.write(ParameterTable=[
+        dict(ID=str(i), Name='t{}'.format(i), GBIF_ID=str(key), rank='species')
+        for i, key in enumerate([5, 3, '-', 1, 3, 2, 4, 10, 7, 6])])
+    return ds
+
+
+def test_iter_taxa(gbif_server, tmp_path, dataset):
+    from pytsammalex.clld.load import iter_taxa
+
+    gbif_server.latency = 0.01
+    gbif = GBIF(cache=Cache(tmp_path / 'db.sqlite'), memory=LRU(), scheduler=Scheduler(rate=1000))
+    seen = {'4'}
+    res = list(iter_taxa(dataset, {'eng'}, seen=seen, gbif=gbif, max_workers=4, window=3))
+    assert [param['GBIF_ID'] for param, _, _ in res] == ['5', '3', '1', '2', '10', '7', '6']
+    assert res[0][1] == {'eng': 'species 5'}
+    assert seen == {'1', '2', '3', '4', '5', '6', '7', '10'}
+
+
+def test_iter_datasets(tmp_path, monkeypatch, mocker):
+    from pytsammalex.clld.load import iter_datasets
+
+    for name in ['b', 'a', 'bin']:
+        tmp_path.joinpath('datasets', name).mkdir(parents=True)
+        ds = pycldf.StructureDataset.in_dir(tmp_path / 'datasets' / name / 'cldf')
+        ds.properties['dc:title'] = name
+        ds.write(ValueTable=[])
+    tmp_path.joinpath('datasets', 'a', 'other.json').write_text('{"a": 1}')
+    # Hidden directories, e.g. git repository data, are neither scanned nor indexed:
+    for name in ['.git', 'a/.git/objects']:
+        tmp_path.joinpath('datasets', name).mkdir(parents=True)
+        tmp_path.joinpath('datasets', name, 'file.json').write_text('{}')
+    monkeypatch.setenv('TSAMMALEX_DATASETS', str(tmp_path / 'datasets'))
+    index = tmp_path / 'index.json'
+
+    sniff = mocker.spy(pycldf, 'sniff')
+    assert [ds.properties['dc:title'] for ds in iter_datasets(index=index)] == ['a', 'b']
+    assert sniff.call_count == 5 and index.exists()
+    assert not any('.git' in k for k in json.loads(index.read_text(encoding='utf8'))['files'])
+
+    sniff.reset_mock()
+    walk = mocker.spy(os, 'walk')
+    res = list(iter_datasets(index=index, filter=lambda ds: ds.properties['dc:title'] == 'b'))
+    assert len(res) == 1
+    assert sniff.call_count == 0 and walk.call_count == 0
+
+    tmp_path.joinpath('datasets', 'a', 'other.json').write_text('{"a": 12}')
+    assert len(list(iter_datasets(index=index))) == 2
+    assert sniff.call_count == 1
+    assert [c.args[0] for c in walk.call_args_list] == [str(tmp_path / 'datasets' / 'a')]
+
+    # New files are discovered, too:
+    sniff.reset_mock()
+    tmp_path.joinpath('datasets', 'b', 'cldf', 'new.json').write_text('{}')
+    assert len(list(iter_datasets(index=index))) == 2
+    assert sniff.call_count == 1
+
+    monkeypatch.delenv('TSAMMALEX_DATASETS')
+    with pytest.raises(ValueError):
+        list(iter_datasets(index=False))
+    mocker.patch('builtins.input', return_value=str(tmp_path / 'datasets'))
+    assert len(list(iter_datasets(index=False, interactive=True))) == 2
+
+
+def test_load_ecoregions(tmp_path):
+    pytest.importorskip('clld')
+    from clld.db.meta import DBSession
+    from pytsammalex.ecoregions import Ecoregions
+    from pytsammalex.clld.load import load_ecoregions
+    from pytsammalex.clld.models import Ecoregion
+
+    props = dict(ECO_NAME='Name', G200_REGIO=None, BIOME=7.0, REALM='AT', GBL_STAT=1, area_km2=5)
+    ring = [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+    geojson = tmp_path / 'ecoregions.json'
+    geojson.write_text(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'properties': dict(eco_code='AT0701', AREA=1.0, **props),
+         'geometry': {'type': 'Polygon', 'coordinates': [[[x + 10, y] for x, y in ring]]}},
+        {'properties': dict(eco_code='AT0701', AREA=2.0, **props),
+         'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring]]}},
+        {'properties': dict(eco_code='AT0702', AREA=2.0, **props), 'geometry': None},
+    ]}))
+    try:
+        load_ecoregions(
+            ecoregions=Ecoregions.load(geojson, tmp_path / 'compiled'),
+            filter=lambda eco_code, props: eco_code != 'AT0702')
+        ecoregions = [obj for obj in DBSession.new if isinstance(obj, Ecoregion)]
+        assert len(ecoregions) == 1
+        assert len(ecoregions[0].jsondata['polygons']) == 2
+        assert (ecoregions[0].longitude, ecoregions[0].latitude) == (6.0, 1.0)
+        assert set(ecoregions[0].jsondata['simplified']) == {'2', '4', '6'}
+        assert ecoregions[0].jsondata['bboxes'] == [[10, 0, 12, 2], [0, 0, 2, 2]]
+    finally:
+        DBSession.remove()
+
+
+def test_GeoJsonEcoregions():
+    from pytsammalex.clld.adapters import GeoJsonEcoregions
+
+    full = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+    simplified = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]}
+    ecoregions = [
+        mock.Mock(jsondata={'polygons': [full], 'simplified': {'2': [simplified], '4': []}}),
+        mock.Mock(jsondata={'polygons': [full]}),
+    ]
+    ctx = mock.Mock(get_query=mock.Mock(return_value=ecoregions))
+
+    def geometries(**params):
+        features = GeoJsonEcoregions(None).get_features(ctx, mock.Mock(params=params))
+        return [f['geometry'] for f in features]
+
+    assert geometries() == [full, full]
+    assert geometries(zoom='x') == [full, full]
+    assert geometries(zoom='1') == [simplified, full]
+    assert geometries(zoom='3') == [full, full]
+    assert geometries(zoom='10') == [full, full]
+
+
+def test_GeoJsonEcoregions_render_to_response(mocker):
+    pytest.importorskip('clld')
+    import gzip
+    from pyramid.request import Request
+    from pytsammalex.clld.adapters import GeoJsonEcoregions
+
+    ecoregions = [mock.Mock(
+        id='AT0701',
+        latitude=1.0,
+        longitude=2.0,
+        biome=mock.Mock(description='ffffff'),
+        jsondata={'polygons': [{'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 0]]]}]})]
+    ecoregions[0].name = 'Name'
+    ctx = mock.Mock(get_query=mock.Mock(return_value=ecoregions))
+    mocker.patch.dict(GeoJsonEcoregions._cache, clear=True)
+    version = mocker.patch.object(GeoJsonEcoregions, 'data_version', return_value=(1, None))
+    iter_json = mocker.spy(GeoJsonEcoregions, 'iter_json')
+    adapter = GeoJsonEcoregions(None)
+
+    def get(**headers):
+        req = Request.blank('/ecoregions.geojson?zoom=2', headers=headers)
+        return req.get_response(adapter.render_to_response(ctx, req))
+
+    res = get(**{'Accept-Encoding': 'gzip'})
+    assert res.status_code == 200 and res.content_encoding == 'gzip'
+    geojson = json.loads(gzip.decompress(res.body).decode('utf8'))
+    assert geojson['features'][0]['properties']['label'] == 'AT0701 Name'
+    assert json.loads(get().body.decode('utf8')) == geojson
+    assert json.loads(adapter.render(ctx, mock.Mock(params={'zoom': '2'}))) == geojson
+    assert iter_json.call_count == 1
+    assert get(**{'If-None-Match': res.headers['ETag']}).status_code == 200  # Other encoding.
+    assert get(**{'If-None-Match': res.headers['ETag'], 'Accept-Encoding': 'gzip'}).status_code \
+        == 304
+
+    # A new data version invalidates the cache:
+    version.return_value = (2, None)
+    assert get().status_code == 200
+    assert iter_json.call_count == 2
+    assert len(GeoJsonEcoregions._cache) == 1
+
+    # Requests with other parameters - which may affect the query - are not cached:
+    for _ in range(2):
+        req = Request.blank('/ecoregions.geojson?zoom=2&sSearch_1=x')
+        req.get_response(adapter.render_to_response(ctx, req))
+    assert iter_json.call_count == 4
+    assert len(GeoJsonEcoregions._cache) == 1
+
+    # The number of cached responses is bounded:
+    for layer in range(GeoJsonEcoregions.max_cached + 5):
+        req = Request.blank('/ecoregions.geojson?layer={}'.format(layer))
+        req.get_response(adapter.render_to_response(ctx, req))
+    assert len(GeoJsonEcoregions._cache) == GeoJsonEcoregions.max_cached
+
+
+def test_ecoregion_tile(mocker):
+    pytest.importorskip('clld')
+    from pyramid.request import Request
+    from pyramid.httpexceptions import HTTPNotFound
+    from pytsammalex.clld.adapters import EcoregionTiles, ecoregion_tile
+
+    ring = [[0, 0], [20, 0], [20, 20], [0, 20], [0, 0]]
+    ecoregions = []
+    for i, dx in enumerate([0, 100]):
+        ecoregions.append(mock.Mock(
+            id='AT070{}'.format(i),
+            latitude=10.0,
+            longitude=10.0 + dx,
+            biome=mock.Mock(description='ffffff'),
+            jsondata={'polygons': [
+                {'type': 'Polygon', 'coordinates': [[[x + dx, y] for x, y in ring]]}]}))
+    tiles = EcoregionTiles(ecoregions)
+    mocker.patch.object(EcoregionTiles, 'get', return_value=tiles)
+
+    def get(z, x, y):
+        req = Request.blank('/')
+        req.matchdict = dict(z=str(z), x=str(x), y=str(y))
+        return json.loads(ecoregion_tile(req).body.decode('utf8'))['features']
+
+    assert len(get(0, 0, 0)) == 2
+    # Tile 3/4/3 spans longitudes 0 to 45 and latitudes 0 to 41:
+    features = get(3, 4, 3)
+    assert [f['properties']['id'] for f in features] == ['AT0700']
+    assert features[0]['geometry'] == ecoregions[0].jsondata['polygons'][0]
+    # Tile 8/128/127 covers the ecoregion partially - and is buffered by 4 pixels:
+    coords = get(8, 128, 127)[0]['geometry']['coordinates'][0]
+    assert min(c[0] for c in coords) == 0
+    assert max(c[0] for c in coords) == pytest.approx(360 / 256 * (1 + 4 / 256))
+    assert not get(3, 0, 0)
+    assert tiles.tile.cache_info().hits == 0
+    get(3, 0, 0)
+    assert tiles.tile.cache_info().hits == 1
+
+    for z, x, y in [(1, 2, 0), ('a', 0, 0), (20, 0, 0)]:
+        with pytest.raises(HTTPNotFound):
+            get(z, x, y)
+
+
+def test_EcoregionLookup_from_models():
+    pytest.importorskip('numpy')
+    from pytsammalex.ecoregions import EcoregionLookup
+
+    ring = [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+    ecoregions = [
+        mock.Mock(id='AT0701', jsondata={'polygons': [
+            {'type': 'Polygon', 'coordinates': [ring]},
+            {'type': 'MultiPolygon', 'coordinates': [[[[x + 10, y] for x, y in ring]]]}]}),
+        mock.Mock(id='AT0702', jsondata={'polygons': [
+            {'type': 'Polygon', 'coordinates': [[[x + 5, y] for x, y in ring]]}]}),
+    ]
+    lookup = EcoregionLookup.from_models(ecoregions)
+    assert lookup.lookup([1, 1, 1, 1], [1, 11, 6, 8]).tolist() == [
+        'AT0701', 'AT0701', 'AT0702', None]
+
+
+def test_gbif_occurrence_overlay():
+    pytest.importorskip('clld')
+    from pyramid import testing
+    from pytsammalex.clld.maps import gbif_occurrence_overlay
+
+    taxon = mock.Mock(id=5)
+    config = testing.setUp()
+    try:
+        req = testing.DummyRequest()
+        assert gbif_occurrence_overlay(taxon, req)['url'] == gbif_occurrence_overlay(taxon)['url']
+        assert gbif_occurrence_overlay(taxon)['url'].startswith('https://api.gbif.org/v2/map/')
+        config.add_route('gbif_tile', '/gbif-tiles/{z}/{x}/{y}.png')
+        assert gbif_occurrence_overlay(taxon, req)['url'] == \
+            'http://example.com/gbif-tiles/{z}/{x}/{y}.png?' \
+            'style=classic.poly&bin=hex&hexPerTile=30&taxonKey=5'
+    finally:
+        testing.tearDown()
+
+
+def test_GBIFTileProxy(gbif_server, tmp_path):
+    pytest.importorskip('clld')
+    from pyramid.request import Request
+    from pyramid.httpexceptions import HTTPNotFound, HTTPBadGateway
+    from pytsammalex.clld.maps import GBIFTileProxy
+    from pytsammalex.tilecache import TileCache
+
+    upstream = 'http://127.0.0.1:{}/v2/map/occurrence/density/{{z}}/{{x}}/{{y}}@1x.png'.format(
+        gbif_server.server_port)
+    proxy = GBIFTileProxy(TileCache(tmp_path / 'tiles.sqlite'), upstream=upstream)
+
+    def get(tile, query='taxonKey=5&style=classic.poly&other=x', **headers):
+        req = Request.blank('/gbif-tiles/{}.png?{}'.format(tile, query), headers=headers)
+        req.matchdict = dict(zip('zxy', tile.split('/')))
+        return req.get_response(proxy(req))
+
+    res = get('1/0/1')
+    assert res.status_code == 200 and res.content_type == 'image/png'
+    assert res.body.startswith(b'\x89PNG') and res.headers['ETag'] == '"5-1"'
+    assert gbif_server.requests[-1].endswith('/1/0/1@1x.png?style=classic.poly&taxonKey=5')
+    assert get('1/0/1', **{'If-None-Match': '"5-1"'}).status_code == 304
+    assert get('1/0/1', query='taxonKey=0').status_code == 204
+    assert len(gbif_server.requests) == 2
+
+    for tile in ['1/2/0', 'a/0/0']:
+        with pytest.raises(HTTPNotFound):
+            get(tile)
+    proxy.upstream = upstream.replace('density', 'unknown')
+    with pytest.raises(HTTPBadGateway):
+        get('1/0/0')
@@ -0,0 +1,113 @@
+import io
+import csv
+import json
+import logging
+import argparse
+import functools
+import urllib.parse
+
+import pytest
+
+from pytsammalex.gbif import GBIF, LRU, Cache
+
+pycldf = pytest.importorskip('pycldf')
+
+
+def run(module, *args):
+    parser = argparse.ArgumentParser()
+    module.register(parser)
+    args = parser.parse_args(args)
+    args.log = logging.getLogger(__name__)
+    module.run(args)
+
+
+def requested(server):
+    """
+    :return: `set` of pairs (key, `'usage'` or `'names'`) for the requests the server received.
+    """
+    res = set()
+    for url in server.requests:
+        path = urllib.parse.urlparse(url).path.split('/')[3:]
+        res.add((int(path[0]), 'names' if path[1:] == ['vernacularNames'] else 'usage'))
+    return res
+
+
+@pytest.fixture
+def gbif(tmp_path, gbif_server, mocker):
+    """
+    Patch the `GBIF` class used by commands to use a cache in `tmp_path`.
+    """
+    cache = Cache(tmp_path / 'gbif.sqlite')
+    factory = functools.partial(GBIF, cache=cache, memory=LRU())
+    for name in ['gbif', 'gbif_warm']:
+        mocker.patch('pytsammalex.commands.{}.GBIF'.format(name), factory)
+    return factory
+
+
+def test_gbif_warm(tmp_path, gbif_server, gbif):
+    from pytsammalex.commands import gbif_warm
+
+    ds = pycldf.StructureDataset.in_dir(tmp_path / 'ds')
+    ds.add_component('ParameterTable', 'GBIF_ID', 'rank')
+    ds.write(ParameterTable=[
+        dict(ID=str(i), Name='t{}'.format(i), GBIF_ID=key, rank=rank) for i, (key, rank) in
+        enumerate([
+            ('1', 'species'),
+            ('2', 'species'),
+            ('-', 'species'),
+            ('10001', 'subspecies'),
+            ('10021', 'subspecies'),
+            ('10001', 'subspecies')])])
+    gbif().usage(key='1')
+    gbif().vernacular_name_index('2')
+    del gbif_server.requests[:]
+
+    run(gbif_warm, str(ds.directory / 'StructureDataset-metadata.json'))
+    assert requested(gbif_server) == {
+        (2, 'usage'), (10001, 'usage'), (10021, 'usage'),
+        (1, 'names'), (10001, 'names'), (10021, 'names'),
+        # Names of the parent species of the subspecies:
+        (1000, 'names'), (1002, 'names')}
+    assert len(gbif_server.requests) == 8
+
+    del gbif_server.requests[:]
+    run(gbif_warm, str(ds.directory / 'StructureDataset-metadata.json'))
+    assert not gbif_server.requests
+
+
+def test_gbif_query_required(capsys):
+    from pytsammalex.commands import gbif as gbif_cmd
+
+    # Without a query, we don't block reading stdin:
+    with pytest.raises(SystemExit):
+        run(gbif_cmd, 'lookup')
+    assert 'query' in capsys.readouterr().err
+
+
+def test_gbif_batch(tmp_path, gbif_server, gbif, capsys, mocker):
+    from pytsammalex.commands import gbif as gbif_cmd
+
+    mocker.patch('sys.stdin', io.StringIO('3\n\nunknown\n{"key": 1}\n1\n'))
+    run(gbif_cmd, 'usage', '-', '--workers', '2')
+    res = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r['query'] for r in res] == ['3', 'unknown', '{"key": 1}', '1']
+    assert [r['result']['key'] for r in res if 'result' in r] == [3, 1, 1]
+    assert res[1]['error'].startswith('NotFound')
+    assert len(gbif_server.requests) == 3
+
+    mocker.patch('sys.stdin', io.StringIO('Genus\nnothing\n'))
+    run(gbif_cmd, 'lookup', '-', '--format', 'tsv', '--no-cache')
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out), delimiter='\t'))
+    assert rows[0] == ['query', 'key', 'scientificName', 'rank', 'taxonomicStatus', 'error']
+    assert [row[:2] for row in rows[1:4]] == [['Genus', '1'], ['Genus', '2'], ['Genus', '3']]
+    # Queries without results are written as rows with empty columns:
+    assert rows[4:] == [['nothing', '', '', '', '', '']]
+    # With --no-cache, results are not written to the cache:
+    assert gbif().cache.missing('lookup', [dict(q='Genus')]) == [dict(q='Genus')]
+
+    mocker.patch('sys.stdin', io.StringIO('unknown\n2\n'))
+    run(gbif_cmd, 'usage', '--format', 'tsv', '-')
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out), delimiter='\t'))
+    assert [row[0] for row in rows[1:]] == ['unknown', '2']
+    assert rows[1][1:5] == ['', '', '', ''] and rows[1][5].startswith('NotFound')
+    assert rows[2][1:4] == ['2', 'Genus species2', 'SPECIES'] and rows[2][5] == ''
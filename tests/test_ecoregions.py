@@ -0,0 +1,192 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from pytsammalex.ecoregions import (  # noqa: E402
+    Ecoregions, EcoregionLookup, GridIndex, area_centroid, simplify_ring, simplify, zoom_level,
+    tile_bbox, geometry_bbox, clip_ring, clip)
+
+RING = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+HOLE = [[1, 1], [2, 1], [2, 2], [1, 1]]
+
+
+def feature(eco_code, geometry, area=1.0):
+    return {
+        'type': 'Feature',
+        'properties': {'eco_code': eco_code, 'AREA': area},
+        'geometry': geometry,
+    }
+
+
+FEATURES = [
+    feature('b', {'type': 'Polygon', 'coordinates': [RING, HOLE]}),
+    feature('a', None),
+    feature('b', {
+        'type': 'MultiPolygon',
+        'coordinates': [[[[x + 10.5, y] for x, y in RING]], [RING, HOLE]]}, area=2.0),
+    feature('a', {'type': 'Polygon', 'coordinates': [RING]}),
+]
+
+
+@pytest.fixture
+def geojson(tmp_path):
+    p = tmp_path / 'ecoregions.json'
+    p.write_text(json.dumps({'type': 'FeatureCollection', 'features': FEATURES}))
+    return p
+
+
+def test_Ecoregions(geojson, tmp_path):
+    ecoregions = Ecoregions.compile(geojson, tmp_path / 'compiled')
+    assert len(ecoregions) == 4
+    assert [(f.properties['eco_code'], f.geometry) for f in ecoregions] == [
+        (f['properties']['eco_code'], f['geometry'])
+        for f in sorted(FEATURES, key=lambda f: f['properties']['eco_code'])]
+    groups = list(ecoregions.groupby())
+    assert [(k, len(fs)) for k, fs in groups] == [('a', 2), ('b', 2)]
+    polygons = groups[1][1][1].polygons()
+    assert [[len(ring) for ring in polygon] for polygon in polygons] == [[5], [5, 4]]
+    assert polygons[0][0][1].tolist() == [14.5, 0]
+    assert groups[1][1][1].simplified(2) == groups[1][1][1].geometry
+    assert groups[0][1][0].simplified(2) is None
+
+
+def test_Ecoregions_load(geojson, tmp_path, mocker):
+    d = tmp_path / 'compiled'
+    compile = mocker.spy(Ecoregions, 'compile')
+    assert len(Ecoregions.load(geojson, d)) == 4
+    assert len(Ecoregions.load(geojson, d)) == 4
+    assert compile.call_count == 1
+
+    geojson.write_text(json.dumps({'type': 'FeatureCollection', 'features': FEATURES[:1]}))
+    assert len(Ecoregions.load(geojson, d)) == 1
+    assert compile.call_count == 2
+
+    # The artifact can be used without the GeoJSON:
+    os.remove(str(geojson))
+    assert len(Ecoregions.load(geojson, d)) == 1
+    assert compile.call_count == 2
+
+
+@pytest.mark.parametrize(
+    'polygons,area,centroid',
+    [
+        ([], 0, (None, None)),
+        ([[RING]], 16, (2, 2)),
+        ([[RING[::-1]]], 16, (2, 2)),  # Orientation doesn't matter.
+        ([[RING[:-1]]], 16, (2, 2)),  # Neither does closing the ring.
+        ([[RING, HOLE]], 15.5, ((32 - 5 / 6) / 15.5, (32 - 4 / 6) / 15.5)),
+        ([[RING], [[[x + 10, y] for x, y in RING]]], 32, (7, 2)),
+        # Dense digitisation of one side doesn't skew the centroid:
+        ([[[[0, 0]] + [[x / 100, 0] for x in range(1, 400)] + [[4, 0], [4, 4], [0, 4]]]],
+         16,
+         (2, 2)),
+        ([[[[0, 0], [1, 1], [2, 2]]]], 0, (1, 1)),  # Degenerate polygon.
+        # Polygons split at the antimeridian:
+        ([[[[170, 60], [180, 60], [180, 70], [170, 70]]],
+          [[[-180, 60], [-172, 60], [-172, 70], [-180, 70]]]],
+         180,
+         (179, 65)),
+        ([[[[176, 60], [180, 60], [180, 70], [176, 70]]],
+          [[[-180, 60], [-170, 60], [-170, 70], [-180, 70]]]],
+         140,
+         (-177, 65)),
+    ]
+)
+def test_area_centroid(polygons, area, centroid):
+    a, c = area_centroid(polygons)
+    assert a == pytest.approx(area)
+    assert c == (pytest.approx(centroid, abs=1e-4) if area else centroid)
+
+
+def test_simplify_ring():
+    # A densely digitised square, with a small dent:
+    ring = [[x / 100, 0] for x in range(400)] + [[4, 0], [4, 4], [2, 4], [2, 3.99], [2.01, 4],
+                                                 [0, 4], [0, 0]]
+    assert simplify_ring(ring, 0.1).tolist() == [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+    assert len(simplify_ring(ring, 0.001)) == 8
+
+
+def test_simplify():
+    dense = [[x / 1000, 0] for x in range(4000)] + [[4, 0], [4, 4], [0, 4], [0, 0]]
+    small = [[10, 10], [10.01, 10], [10.01, 10.01], [10, 10]]
+    assert simplify([[dense, small]], 0.1) == {'type': 'Polygon', 'coordinates': [RING]}
+    assert simplify([[dense], [small]], 0.1)['type'] == 'Polygon'
+    assert simplify([[dense], [small]], 0.001)['type'] == 'MultiPolygon'
+    assert simplify([[small]], 0.1) is None
+    assert simplify([[[[0.123456, 0], [4, 0], [4, 4], [0, 0]]]], 0.1)['coordinates'][0][0] \
+        == [0.12, 0]
+
+
+def test_zoom_level():
+    assert [zoom_level(zoom) for zoom in [0, 2, 3, 6, 7]] == [2, 2, 4, 6, None]
+
+
+def test_tile_bbox():
+    assert tile_bbox(0, 0, 0) == pytest.approx((-180, -85.0511, 180, 85.0511), abs=1e-4)
+    assert tile_bbox(1, 1, 0) == pytest.approx((0, 0, 180, 85.0511), abs=1e-4)
+    west, south, east, north = tile_bbox(1, 1, 0, buffer=128)
+    assert (west, east) == (-90, 270)
+    assert south < 0 and north > 85.0512
+
+
+def test_geometry_bbox():
+    assert geometry_bbox({'type': 'Polygon', 'coordinates': [RING, HOLE]}) == [0, 0, 4, 4]
+    assert geometry_bbox(FEATURES[2]['geometry']) == [0, 0, 14.5, 4]
+
+
+def test_clip_ring():
+    assert clip_ring(RING, (-1, -1, 5, 5)).tolist() == RING
+    assert clip_ring(RING, (5, 5, 6, 6)) is None
+    clipped = clip_ring(RING, (2, 1, 5, 3))
+    assert clipped[0].tolist() == clipped[-1].tolist()
+    assert sorted(map(tuple, clipped[:-1].tolist())) == [(2, 1), (2, 3), (4, 1), (4, 3)]
+    assert area_centroid([[clipped]]) == (4, (3, 2))
+    # A concave ring, clipped into two parts, connected along the border of the box:
+    ring = [[0, 0], [3, 0], [3, 3], [2, 3], [2, 1], [1, 1], [1, 3], [0, 3], [0, 0]]
+    assert area_centroid([[clip_ring(ring, (-1, 2, 4, 4))]])[0] == pytest.approx(2)
+
+
+def test_clip():
+    multi = FEATURES[2]['geometry']
+    assert clip(multi, (10, -1, 20, 5)) == {
+        'type': 'Polygon', 'coordinates': [[[x + 10.5, y] for x, y in RING]]}
+    assert clip(multi, (-1, -1, 20, 5))['type'] == 'MultiPolygon'
+    exterior, hole = clip(multi, (-1, -1, 1.5, 5))['coordinates']
+    assert area_centroid([[exterior, hole]])[0] == pytest.approx(6 - 0.125)
+    # The clip box itself - starting with a different vertex:
+    assert clip(multi, (3, 3, 3.5, 3.5))['coordinates'] == [
+        [[3.5, 3], [3.5, 3.5], [3, 3.5], [3, 3], [3.5, 3]]]
+    assert clip(multi, (20, 20, 30, 30)) is None
+
+
+def test_GridIndex():
+    index = GridIndex(
+        [[0, 0, 4, 4], [10.5, 0, 14.5, 4], [-180, -90, 180, 90], [179, 89, 180, 90]], cell=5)
+    assert len(index) == 4
+    assert index.query((1, 1, 2, 2)).tolist() == [0, 2]
+    assert index.query((4, 4, 10.5, 5)).tolist() == [0, 1, 2]
+    assert index.query((170, 80, 180, 90)).tolist() == [2, 3]
+    assert index.query((-190, -95, 190, 95)).tolist() == [0, 1, 2, 3]
+    assert len(GridIndex([]).query((0, 0, 1, 1))) == 0
+
+
+@pytest.mark.parametrize('cell', [0.5, 3, 90])
+def test_EcoregionLookup(geojson, tmp_path, cell):
+    lookup = EcoregionLookup.from_ecoregions(
+        Ecoregions.compile(geojson, tmp_path / 'compiled'), cell=cell)
+    lat = [3, 1.2, 1.2, 2, 2, float('nan'), 0.5, 3.9]
+    lon = [3, 1.5, 12, 12.5, 8, 1, 190, 14.4]
+    # Where polygons overlap, the first - in order of eco_code - wins:
+    assert lookup.lookup(lat, lon).tolist() == ['a', 'a', 'b', 'b', None, None, None, 'b']
+    assert lookup.lookup(lat, lon, chunksize=3).tolist() == lookup.lookup(lat, lon).tolist()
+
+    # Points in holes are outside of the polygon:
+    geojson.write_text(json.dumps({'type': 'FeatureCollection', 'features': FEATURES[:1]}))
+    lookup = EcoregionLookup.from_ecoregions(Ecoregions.compile(geojson, tmp_path / 'c'), cell=cell)
+    assert lookup.lookup([1.2, 1.9, 1.5], [1.5, 1.5, 1.1]).tolist() == [None, 'b', 'b']
+
+    with pytest.raises(ValueError):
+        lookup.lookup([1, 2], [1])
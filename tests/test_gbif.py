@@ -0,0 +1,392 @@
+import asyncio
+import time
+import sqlite3
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from pytsammalex.gbif import *
+from pytsammalex.gbif import Cache, ordered_map, canonical_query
+
+
+@pytest.fixture
+def species(mocker):
+    return mocker.patch(
+        'pytsammalex.gbif.species',
+        mocker.Mock(name_usage=mocker.Mock(return_value={'key': 5219404})))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    res = Cache(tmp_path / 'gbif.sqlite')
+    yield res
+    res.close()
+
+
+def test_Cache(cache, species):
+    assert cache.get('usage', key=5219404) == {'key': 5219404}
+    assert cache.get('usage', key=5219404) == {'key': 5219404}
+    assert species.name_usage.call_count == 1
+    with cache.cursor() as cu:
+        cu.execute('select count(*) from requests')
+        assert cu.fetchone()[0] == 1
+    cache.clear()
+    assert not cache.dbpath.exists()
+
+
+def test_Cache_migration(tmp_path, species):
+    dbpath = tmp_path / 'gbif.sqlite'
+    conn = sqlite3.connect(str(dbpath))
+    conn.execute("CREATE TABLE requests (method TEXT, query TEXT, result TEXT)")
+    for q in ['[["key", 1]]', '[["key", 1]]', '[["key", "1"]]']:
+        conn.execute("insert into requests values (?, ?, ?)", ('usage', q, '{"key": 1}'))
+    conn.commit()
+    conn.close()
+
+    cache = Cache(dbpath)
+    assert cache.get('usage', key=' 1') == {'key': 1}
+    assert species.name_usage.call_count == 0
+    with cache.cursor() as cu:
+        cu.execute('select count(*) from requests')
+        assert cu.fetchone()[0] == 1
+        cu.execute("PRAGMA index_list(requests)")
+        assert any(row[2] for row in cu.fetchall())
+    cache.close()
+
+
+def test_GBIF(cache, species):
+    gbif = GBIF(cache=cache, memory=LRU())
+    assert gbif.usage(key=5219404) == {'key': 5219404}
+    assert gbif('usage', no_cache=True, key=5219404) == {'key': 5219404}
+    assert species.name_usage.call_count == 2
+
+
+def test_Cache_ttl(tmp_path, species, mocker):
+    cache = Cache(tmp_path / 'gbif.sqlite', ttl={'usage': 10})
+    cache.get('usage', key=1)
+    mocker.patch('pytsammalex.gbif.time.time', return_value=cache.stats()[0]['oldest'] + 20)
+    cache.get('usage', key=1)
+    assert species.name_usage.call_count == 2
+    cache.get('usage', key=1)
+    assert species.name_usage.call_count == 2
+    cache.close()
+
+
+def test_Cache_prune(tmp_path, species):
+    species.name_usage.side_effect = lambda key: {'key': key, 'data': 'x' * 10000}
+    cache = Cache(tmp_path / 'gbif.sqlite', max_size=200000, compress=False)
+    for key in range(100):
+        cache.get('usage', key=key)
+    assert cache.stats()[0]['results'] < 100
+    cache.get('usage', key=99)
+    assert species.name_usage.call_count == 100
+
+    cache.ttl['usage'] = -1
+    assert cache.prune() > 0
+    assert not cache.stats()
+    cache.vacuum()
+    cache.close()
+
+
+def test_LRU():
+    lru = LRU(max_entries=2, max_bytes=30)
+    lru.put('a', {'x': [1]})
+    lru.put('b', 2)
+    assert lru.get('a') == {'x': [1]}
+    lru.get('a')['x'].append(2)
+    assert lru.get('a') == {'x': [1]}
+    lru.put('c', 3)
+    assert 'b' not in lru and len(lru) == 2
+    assert lru.get('b') is None
+    assert (lru.hits, lru.misses) == (3, 1)
+    lru.put('d', 'x' * 30)
+    assert len(lru) == 0
+
+
+def test_GBIF_memory(cache, species):
+    gbif = GBIF(cache=cache, memory=LRU())
+    gbif.usage(key=1)['key'] = 2
+    assert gbif.usage(key=1) == {'key': 5219404}
+    assert gbif.memory.hits == 1
+    gbif.clear_cache()
+    assert len(gbif.memory) == 0
+
+
+def _usage(key, data='all', **kw):
+    if data == 'vernacularNames':
+        return {'results': [{'language': 'eng', 'vernacularName': 'name{}'.format(key)}]
+                if key < 100 else []}
+    return {'key': key, 'speciesKey': key - 100 if key > 100 else key}
+
+
+def test_GBIF_usage_many(cache, species):
+    species.name_usage.side_effect = _usage
+    gbif = GBIF(cache=cache, memory=LRU())
+    assert gbif.usage(key=2)['key'] == 2
+    assert cache.missing('usage', [dict(key=1), dict(key=2)]) == [dict(key=1)]
+    res = gbif.usage_many([3, 2, 1, 3])
+    assert [r['key'] for r in res] == [3, 2, 1, 3]
+    assert species.name_usage.call_count == 3
+    with cache.cursor() as cu:
+        assert cu.execute('select count(*) from requests').fetchone()[0] == 3
+
+    species.name_usage.side_effect = ValueError
+    with pytest.raises(ValueError):
+        gbif.usage_many([5, 6])
+
+
+def test_GBIF_get_vernacular_names_many(cache, species):
+    species.name_usage.side_effect = _usage
+    gbif = GBIF(cache=cache, memory=LRU())
+    res = gbif.get_vernacular_names_many([1, 102], ranks=['species', 'subspecies'])
+    assert res == [{'eng': 'name1'}, {'eng': 'name2'}]
+    # Names of 1, 102 and 2, and usage of 102.
+    n = species.name_usage.call_count
+    assert n == 4
+    assert gbif.get_vernacular_names(102, 'subspecies') == {'eng': 'name2'}
+    assert species.name_usage.call_count == n
+
+
+def test_AsyncGBIF(cache, gbif_server):
+    async def run():
+        async with AsyncGBIF(GBIF(cache=cache, memory=LRU()), concurrency=2) as gbif:
+            assert len(await gbif.suggest(q='Genus')) == 3
+            assert len((await gbif.lookup(q='Genus'))['results']) == 3
+            res = await gbif.usage_many(range(1, 6))
+            assert [r['key'] for r in res] == [1, 2, 3, 4, 5]
+            assert (await gbif.usage(key=1))['key'] == 1
+            assert await gbif.get_vernacular_names(
+                10001, 'subspecies', language_tags=['eng', 'deu']) == \
+                {'deu': 'Unterart 10001', 'eng': 'species 1000'}
+            return gbif.gbif.memory.hits
+
+    assert asyncio.run(run()) == 1
+    assert len(gbif_server.requests) == 10
+
+
+def test_GBIF_single_flight(cache, species):
+    def usage(key, data='all', **kw):
+        time.sleep(0.2)
+        return _usage(key, data=data)
+
+    species.name_usage.side_effect = usage
+    gbif = GBIF(cache=cache, memory=LRU())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        res = list(executor.map(lambda _: gbif.usage(key=1), range(4)))
+    assert all(r == res[0] for r in res)
+    assert species.name_usage.call_count == 1
+
+
+@pytest.mark.parametrize('leader', ['get', 'get_many'])
+def test_Cache_single_flight_negative(cache, species, mocker, leader):
+    def usage(key, data='all', **kw):
+        time.sleep(0.3)
+        raise requests.HTTPError(response=mocker.Mock(status_code=404))
+
+    def call(method):
+        time.sleep(0 if method == leader else 0.1)
+        if method == 'get':
+            return cache.get('usage', key=1)
+        return cache.get_many('usage', [dict(key=1), dict(key=2)])
+
+    species.name_usage.side_effect = usage
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(call, method) for method in ['get', 'get_many']]
+    # Both callers see the same error - no matter which one made the API call.
+    assert all(isinstance(f.exception(), NotFound) for f in futures)
+    assert species.name_usage.call_count == 2
+    assert not cache.missing('usage', [dict(key=1), dict(key=2)])
+    with pytest.raises(NotFound):
+        cache.get_many('usage', [dict(key=1)])
+
+
+def _read_usages(dbpath, keys):
+    """
+    Read cached results - run in a separate process.
+
+    :return: Number of failed reads.
+    """
+    cache, errors = Cache(dbpath), 0
+    for key in keys:
+        try:
+            cache.compute('usage', lambda: None, key=key)
+        except sqlite3.OperationalError:
+            errors += 1
+    return errors
+
+
+def test_Cache_multiprocess(tmp_path, species):
+    cache = Cache(tmp_path / 'gbif.sqlite')
+    cache.get_many('usage', [dict(key=key) for key in range(20)])
+    with multiprocessing.get_context('spawn').Pool(6) as pool:
+        errors = pool.starmap(
+            _read_usages, [(cache.dbpath, list(range(20)) * 20) for _ in range(6)])
+    assert sum(errors) == 0
+
+
+def test_Cache_formats(tmp_path, species):
+    cache = Cache(tmp_path / 'gbif.sqlite', compress=False)
+    cache.get('usage', key=1)
+    cache = Cache(tmp_path / 'gbif.sqlite')
+    cache.get('usage', key=2)
+    with cache.cursor() as cu:
+        assert [r[0] for r in cu.execute('select format from requests order by rowid')] == [0, 1]
+    assert cache.convert() == 1
+    assert cache.get('usage', key=1) == cache.get('usage', key=2) == {'key': 5219404}
+    assert species.name_usage.call_count == 2
+    cache.close()
+
+
+def test_GBIF_get_vernacular_names(cache, gbif_server):
+    gbif = GBIF(cache=cache, memory=LRU())
+    assert gbif.get_vernacular_names(1, language_tags=None) == {'eng': 'species 1', 'deu': 'Art 1'}
+    assert gbif.get_vernacular_names(10001, rank='subspecies', language_tags=['deu']) == \
+        {'deu': 'Unterart 10001'}
+    # Usage data is only requested for subspecies lacking names:
+    assert len(gbif_server.requests) == 2
+    n = len(gbif_server.requests)
+    assert gbif.get_vernacular_names(10001, rank='subspecies', language_tags=['deu', 'eng']) == \
+        {'deu': 'Unterart 10001', 'eng': 'species 1000'}
+    assert len(gbif_server.requests) == n + 2
+    assert gbif.get_vernacular_names(1, language_tags=['deu']) == {'deu': 'Art 1'}
+    assert len(gbif_server.requests) == n + 2
+
+
+def test_GBIF_vernacular_name_index_paging(cache, gbif_server, mocker):
+    mocker.patch('pytsammalex.gbif.VERNACULAR_NAMES_PAGE_SIZE', 1)
+    gbif = GBIF(cache=cache, memory=LRU())
+    assert len(gbif.vernacular_name_index(1)['results']) == 2
+    assert len(gbif_server.requests) == 2
+
+
+def test_ordered_map():
+    def func(i):
+        time.sleep(0.01 * (5 - i))
+        return i * 2
+
+    assert list(ordered_map(func, iter(range(5)), max_workers=3, window=2)) == [0, 2, 4, 6, 8]
+
+
+def test_canonical_query():
+    assert canonical_query('suggest', dict(q=' Panthera  Leo ', rank='species')) == \
+        dict(q='panthera leo', rank='SPECIES')
+    assert canonical_query('usage', dict(key='5', data='all', language=None)) == dict(key=5)
+
+
+def test_Cache_negative(cache, species, mocker):
+    species.name_usage.side_effect = requests.HTTPError(response=mocker.Mock(status_code=404))
+    for _ in range(2):
+        with pytest.raises(NotFound):
+            cache.get('usage', key=1)
+    assert species.name_usage.call_count == 1
+    assert not cache.missing('usage', [dict(key=1)])
+    with pytest.raises(NotFound):
+        cache.get_many('usage', [dict(key=1)])
+
+    species.name_usage.side_effect = requests.HTTPError(response=mocker.Mock(status_code=429))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            cache.get('usage', key=2)
+    assert species.name_usage.call_count == 3
+
+    species.name_suggest.return_value = []
+    cache.get('suggest', q='xyz')
+    assert cache.stats() == [
+        {'method': 'suggest', 'results': 1, 'negative': 1, 'bytes': mocker.ANY,
+         'oldest': mocker.ANY, 'last_accessed': mocker.ANY},
+        {'method': 'usage', 'results': 1, 'negative': 1, 'bytes': mocker.ANY,
+         'oldest': mocker.ANY, 'last_accessed': mocker.ANY}]
+    cache.negative_ttl = -1
+    assert cache.prune() == 2
+
+
+def test_Scheduler(mocker):
+    def error(status, retry_after=None):
+        response = requests.Response()
+        response.status_code = status
+        if retry_after is not None:
+            response.headers['Retry-After'] = retry_after
+        return requests.HTTPError(response=response)
+
+    sleep = mocker.patch('pytsammalex.gbif.time.sleep')
+    func = mocker.Mock(side_effect=[error(429, '2'), error(503), 'ok'])
+    scheduler = Scheduler(retries=2, max_concurrency=4)
+    assert scheduler.call(func) == 'ok'
+    assert sleep.call_args_list[0][0][0] == 2
+    assert scheduler.concurrency < 4
+
+    with pytest.raises(requests.HTTPError):
+        scheduler.call(mocker.Mock(side_effect=error(404)))
+    assert scheduler.failures == 0
+
+    scheduler = Scheduler(retries=0, failure_threshold=2, reset_timeout=10)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            scheduler.call(mocker.Mock(side_effect=error(500)))
+    with pytest.raises(CircuitOpen):
+        scheduler.call(func)
+    scheduler.opened -= 10
+    assert scheduler.call(lambda: 'ok') == 'ok'
+    assert not scheduler.is_open
+
+
+def test_Cache_circuit_open(tmp_path, mocker):
+    response = requests.Response()
+    response.status_code = 503
+    backend = mocker.Mock(name_usage=mocker.Mock(return_value={'key': 1}))
+    cache = Cache(tmp_path / 'gbif.sqlite', ttl={'usage': 10})
+    scheduler = Scheduler(retries=0, failure_threshold=1, reset_timeout=60)
+    gbif = GBIF(cache=cache, backend=backend, scheduler=scheduler, memory=LRU())
+    assert gbif.usage(key=1) == {'key': 1}
+    assert cache.get_many('usage', [dict(key=2)], op=backend.name_usage) == [{'key': 1}]
+
+    mocker.patch('pytsammalex.gbif.time.time', return_value=time.time() + 20)
+    backend.name_usage.side_effect = requests.HTTPError(response=response)
+    with pytest.raises(requests.HTTPError):
+        GBIF(cache=cache, backend=backend, scheduler=scheduler, memory=LRU()).usage(key=1)
+    assert scheduler.is_open
+    # While the circuit is open, expired results are served ...
+    gbif = GBIF(cache=cache, backend=backend, scheduler=scheduler, memory=LRU())
+    assert gbif.usage(key=1) == {'key': 1}
+    assert cache.get_many(
+        'usage', [dict(key=1), dict(key=2)], op=gbif._request(backend.name_usage)) == \
+        [{'key': 1}, {'key': 1}]
+    assert backend.name_usage.call_count == 3
+    # ... but not written to the cache as if they were fresh:
+    assert cache.missing('usage', [dict(key=1), dict(key=2)]) == [dict(key=1), dict(key=2)]
+    # Without a cached result, `CircuitOpen` is raised:
+    with pytest.raises(CircuitOpen):
+        gbif.usage(key=3)
+    with pytest.raises(CircuitOpen):
+        cache.get_many('usage', [dict(key=1), dict(key=3)], op=gbif._request(backend.name_usage))
+    cache.close()
+
+
+def test_Scheduler_rate():
+    scheduler = Scheduler(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        scheduler.call(lambda: None)
+    assert time.monotonic() - start > 0.09
+
+
+def test_Metrics(gbif_server, tmp_path):
+    metrics, events = Metrics(), []
+    metrics.add_hook(lambda event, method, latency, nbytes: events.append(event))
+    gbif = GBIF(cache=Cache(tmp_path / 'db.sqlite'), metrics=metrics)
+    assert gbif.metrics is metrics and gbif.cache.metrics is not metrics
+    gbif = GBIF(cache=Cache(tmp_path / 'db.sqlite', metrics=metrics))
+    gbif.usage(key=5219404)
+    gbif.usage(key=5219404)
+    assert events == ['miss', 'request', 'write', 'memory_hit']
+    GBIF(cache=Cache(tmp_path / 'db.sqlite', metrics=metrics), memory=LRU()).usage(key=5219404)
+    with pytest.raises(NotFound):
+        gbif.usage(key='unknown')
+    row = metrics.summary()[0]
+    assert row['method'] == 'usage'
+    assert (row['memory_hits'], row['hits'], row['misses'], row['requests'], row['errors']) == \
+        (1, 1, 2, 1, 1)
+    assert 0 < row['bytes_read'] <= row['bytes_written']
+    assert metrics.quantile('request', 'usage', 0.5) == row['p95_ms'] / 1000
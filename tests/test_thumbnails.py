@@ -0,0 +1,49 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from pytsammalex.thumbnails import ThumbnailCache, width_px  # noqa: E402
+
+
+def image(size=(1600, 1200), mode='RGB', format='JPEG', **kw):
+    img = io.BytesIO()
+    Image.effect_noise(size, 64).convert(mode).save(img, format=format, **kw)
+    return img.getvalue()
+
+
+def test_ThumbnailCache(tmp_path, mocker):
+    cache = ThumbnailCache(tmp_path / 'thumbs', width=400)
+    data = image()
+    p = cache.get(data=data)
+    assert p.parent.parent == tmp_path / 'thumbs'
+    with Image.open(str(p)) as thumbnail:
+        assert thumbnail.size == (400, 300) and thumbnail.format == 'JPEG'
+    assert p.stat().st_size < len(data)
+
+    # Thumbnails are looked up by content:
+    make = mocker.spy(cache, '_make')
+    tmp_path.joinpath('img.jpg').write_bytes(data)
+    assert cache.get(path=tmp_path / 'img.jpg') == p
+    assert ThumbnailCache(tmp_path / 'thumbs', width=400).get(data=data) == p
+    assert make.call_count == 0
+    assert ThumbnailCache(tmp_path / 'thumbs', width=200).get(data=data) != p
+
+    # Small images are not upscaled, transparent ones are put on a white background:
+    with Image.open(str(cache.get(data=image((100, 50), mode='RGBA', format='PNG')))) as img:
+        assert img.size == (100, 50) and img.mode == 'RGB'
+
+    # Images are rotated according to their EXIF orientation - and scaled after rotating:
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90° clockwise.
+    with Image.open(str(cache.get(data=image((1600, 1200), exif=exif.tobytes())))) as img:
+        assert img.size == (400, 533)
+
+    with pytest.raises(OSError):
+        cache.get(data=b'not an image')
+    assert not list(tmp_path.joinpath('thumbs').glob('*/*.tmp'))
+
+
+def test_width_px():
+    assert width_px(2.54, dpi=300) == 300
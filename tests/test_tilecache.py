@@ -0,0 +1,122 @@
+import time
+import sqlite3
+import multiprocessing
+
+import pytest
+import requests
+
+from pytsammalex.tilecache import TileCache, Tile
+
+
+@pytest.fixture
+def tile_url(gbif_server):
+    def url(taxon=5, z=0, x=0, y=0):
+        return 'http://127.0.0.1:{}/v2/map/occurrence/density/{}/{}/{}@1x.png?taxonKey={}'.format(
+            gbif_server.server_port, z, x, y, taxon)
+    return url
+
+
+def test_TileCache(gbif_server, tile_url, tmp_path):
+    cache = TileCache(tmp_path / 'tiles.sqlite', ttl=100)
+    tile = cache.get(tile_url())
+    assert tile.status == 200 and tile.data.startswith(b'\x89PNG')
+    assert tile.content_type == 'image/png' and tile.etag == '"5-1"'
+    assert cache.get(tile_url()) == tile
+    assert len(gbif_server.requests) == 1
+
+    # Empty tiles are cached, too:
+    assert cache.get(tile_url(taxon=0)).status == 204
+    assert cache.get(tile_url(taxon=0)).data == b''
+    assert len(gbif_server.requests) == 2
+
+    with pytest.raises(requests.HTTPError):
+        cache.get(tile_url().replace('density', 'unknown'))
+    assert cache.size() == len(tile.data)
+    cache.close()
+
+
+def test_TileCache_revalidation(gbif_server, tile_url, tmp_path, mocker):
+    cache = TileCache(tmp_path / 'tiles.sqlite', ttl=0)
+    tile = cache.get(tile_url())
+    # Expired tiles are revalidated - and not downloaded again, if unchanged:
+    assert cache.get(tile_url()).data == tile.data
+    assert len(gbif_server.requests) == 2
+    get = mocker.spy(cache.session, 'get')
+    cache.get(tile_url())
+    assert get.call_args[1]['headers'] == {'If-None-Match': '"5-1"'}
+
+    gbif_server.tile_version = 2
+    assert cache.get(tile_url()).etag == '"5-2"'
+
+    # The upstream server's max-age takes precedence over the default TTL:
+    gbif_server.tile_max_age = 100
+    cache.get(tile_url())
+    n = len(gbif_server.requests)
+    assert cache.get(tile_url()).etag == '"5-2"'
+    assert len(gbif_server.requests) == n
+
+    # Stale tiles are served if the upstream server fails:
+    gbif_server.tile_max_age = 0
+    cache.get(tile_url())
+    mocker.patch.object(
+        cache.session, 'get', side_effect=requests.ConnectionError('unreachable'))
+    assert cache.get(tile_url()).etag == '"5-2"'
+    with pytest.raises(requests.ConnectionError):
+        cache.get(tile_url(taxon=6))
+
+
+def test_TileCache_eviction(gbif_server, tile_url, tmp_path):
+    cache = TileCache(tmp_path / 'tiles.sqlite', max_size=100)
+    sizes = [len(cache.get(tile_url(x=x, z=4)).data) for x in range(10)]
+    assert sum(sizes) > 100 >= cache.size() > 100 - max(sizes)
+    # The least recently accessed tiles were evicted:
+    n = len(gbif_server.requests)
+    cache.get(tile_url(x=9, z=4))
+    assert len(gbif_server.requests) == n
+    cache.get(tile_url(x=0, z=4))
+    assert len(gbif_server.requests) == n + 1
+
+
+def test_TileCache_connection(gbif_server, tile_url, tmp_path, mocker):
+    cache = TileCache(tmp_path / 'tiles.sqlite')
+    # The database is only opened on first use ...
+    assert not cache.dbpath.exists()
+    tile = cache.get(tile_url())
+    conn, _ = cache._connect()
+    assert cache._connect()[0] is conn
+    # ... and re-opened in forked processes:
+    mocker.patch('pytsammalex.tilecache.os.getpid', return_value=-1)
+    assert cache._connect()[0] is not conn
+    assert cache.get(tile_url()) == tile
+    assert len(gbif_server.requests) == 1
+    cache.close()
+    conn.close()
+
+
+def _read_tiles(dbpath, urls):
+    """
+    Read cached tiles - run in a separate process.
+
+    :return: Number of failed reads.
+    """
+    cache, errors = TileCache(dbpath), 0
+    for url in urls:
+        try:
+            assert cache.get(url).status == 200
+        except sqlite3.OperationalError:
+            errors += 1
+    return errors
+
+
+def test_TileCache_multiprocess(tmp_path):
+    cache = TileCache(tmp_path / 'tiles.sqlite')
+    urls = ['http://example.org/{}.png'.format(i) for i in range(20)]
+    for i, url in enumerate(urls):
+        cache._write(url, Tile(200, b'x' * i, 'image/png', None, None, time.time() + 1000), 0)
+    # The size is maintained when tiles are replaced:
+    cache._write(urls[0], Tile(200, b'xx', 'image/png', None, None, time.time() + 1000), 0)
+    assert cache.size() == sum(range(20)) + 2
+    with multiprocessing.get_context('spawn').Pool(6) as pool:
+        errors = pool.starmap(_read_tiles, [(cache.dbpath, urls * 20) for _ in range(6)])
+    assert sum(errors) == 0
+    cache.close()